@@ -0,0 +1,101 @@
+"""Benchmarks the clouds raw-file parser against the original line-by-line implementation
+
+Usage:
+    python benchmarks/bench_create_dataset.py --rows 1024 100000 1000000
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import src.create_dataset as cd  # pylint: disable=wrong-import-position
+
+COLUMNS = [
+    'visible_mean', 'visible_max', 'visible_min', 'visible_mean_distribution',
+    'visible_contrast', 'visible_entropy', 'visible_second_angular_momentum',
+    'IR_mean', 'IR_max', 'IR_min'
+]
+
+
+def write_synthetic(path: Path, rows_per_class: int, seed: int = 0) -> Tuple[slice, slice]:
+    """Writes a file in the UCI clouds layout: a commented header and two class blocks
+
+    Args:
+        path: The file to write
+        rows_per_class: The number of data lines in each class block
+        seed: The random seed for the generated values
+
+    Returns:
+        The line slices of the two class blocks, as hard-coded by the original parser
+    """
+    rng = np.random.default_rng(seed)
+    header = [';' * 62] + [';synthetic clouds data'] * 50 + ['']
+    with open(path, 'w') as f:
+        f.write('\n'.join(header) + '\n')
+        first = slice(len(header), len(header) + rows_per_class)
+        np.savetxt(f, rng.random((rows_per_class, len(COLUMNS))) * 100, fmt='%.4f', delimiter='  ')
+        f.write('\n;second class\n;\n\n')
+        second_start = first.stop + 4
+        np.savetxt(f, rng.random((rows_per_class, len(COLUMNS))) * 100, fmt='%.4f', delimiter='  ')
+        f.write('\n')
+    return first, slice(second_start, second_start + rows_per_class)
+
+
+def legacy_create_dataset(data_path: Path, columns: List[str], first: slice, second: slice) -> pd.DataFrame:
+    """The original readlines/list-comprehension parser, with its block slices passed in"""
+    with open(data_path, 'r') as f:
+        data = [[s for s in line.split(' ') if s != ''] for line in f.readlines()]
+
+    first_cloud = [[float(s.replace('/n', '')) for s in cloud] for cloud in data[first]]
+    first_cloud = pd.DataFrame(first_cloud, columns=columns)
+    first_cloud['class'] = np.zeros(len(first_cloud))
+
+    second_cloud = [[float(s.replace('/n', '')) for s in cloud] for cloud in data[second]]
+    second_cloud = pd.DataFrame(second_cloud, columns=columns)
+    second_cloud['class'] = np.ones(len(second_cloud))
+
+    return pd.concat([first_cloud, second_cloud])
+
+
+def best_of(fn, repeat: int) -> float:
+    """Returns the fastest wall time of `repeat` calls to fn"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1024, 100_000, 1_000_000],
+                        help='Rows per class block')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed calls per implementation')
+    args = parser.parse_args()
+
+    config = {'load_data': {'names': COLUMNS}}
+    print(f"{'rows/class':>12} {'MB':>8} {'legacy s':>10} {'new s':>10} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            path = Path(tmp) / 'clouds.data'
+            first, second = write_synthetic(path, rows)
+
+            expected = legacy_create_dataset(path, COLUMNS, first, second)
+            actual = cd.create_dataset(path, config)
+            np.testing.assert_allclose(actual.to_numpy(), expected.to_numpy())
+
+            legacy = best_of(lambda: legacy_create_dataset(path, COLUMNS, first, second), args.repeat)
+            new = best_of(lambda: cd.create_dataset(path, config), args.repeat)
+            size = path.stat().st_size / 1e6
+            print(f'{rows:>12} {size:>8.1f} {legacy:>10.3f} {new:>10.3f} {legacy / new:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
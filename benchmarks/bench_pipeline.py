@@ -0,0 +1,191 @@
+"""Times each pipeline stage on synthetic clouds data and checks for regressions
+
+Every stage runs in this process through the functions of `src.stages`, on a synthetic
+raw file of each requested size (see synthetic_clouds.py), with the configuration of
+`--config`. For each stage the wall time, the throughput in raw rows per second and the
+peak resident memory above the level at the stage's start are recorded. The artifact
+I/O entry times writing and reading back the feature artifact.
+
+The results are compared with a stored baseline: a stage regresses when it is more
+than `--tolerance` slower (and at least `--min-seconds` slower) or uses more than
+`--tolerance` more memory (and at least `--min-mb` more) than its baseline, in which
+case the command exits with status 1. Baselines are machine-specific; record one with
+`--save-baseline` on the machine that runs the checks.
+
+Usage:
+    python benchmarks/bench_pipeline.py --rows 1000 100000 1000000
+    python benchmarks/bench_pipeline.py --rows 100000000 --chunk-rows 1000000 --format npy
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import src.artifact_io as aio  # pylint: disable=wrong-import-position
+import src.profiling as prof  # pylint: disable=wrong-import-position
+import src.stages as st  # pylint: disable=wrong-import-position
+from benchmarks.synthetic_clouds import write_clouds  # pylint: disable=wrong-import-position
+
+BASELINE = Path(__file__).with_name('baseline.json')
+
+# The timed stages of src.stages, in pipeline order; acquisition is replaced by the
+# synthetic file
+STAGES = ['create_dataset', 'generate_features', 'analysis', 'train_model', 'score_model',
+          'evaluate_performance']
+
+
+def measure(fn: Callable[[], Any], rows: int) -> Dict[str, float]:
+    """Runs fn once and returns its wall time, throughput and peak memory growth"""
+    with prof.measure() as measured:
+        fn()
+    seconds = measured['wall_seconds']
+    return {'seconds': seconds, 'rows_per_s': rows / seconds if seconds else float('inf'),
+            'peak_mb': measured['peak_rss_delta_mb']}
+
+
+def run_artifact_io(ctx: st.RunContext) -> None:
+    """Writes the feature artifact to a new file and reads it back into memory"""
+    path = ctx.run_dir / 'io_check'
+    if ctx.chunk_rows:
+        with aio.FrameWriter(path, ctx.fmt) as writer:
+            for chunk in aio.iter_frame(ctx.path('features'), ctx.chunk_rows, ctx.fmt):
+                writer.write(chunk)
+        return
+    aio.write_frame(ctx.frame('features'), path, ctx.fmt)
+    aio.read_frame(aio.artifact_path(path, ctx.fmt), ctx.fmt, mmap=False)
+
+
+def bench_size(config: Dict[str, Any], rows: int, work_dir: Path) -> Dict[str, Dict[str, float]]:
+    """Runs every stage on a synthetic file of `rows` rows and measures each one
+
+    Args:
+        config: The pipeline configuration
+        rows: The number of raw rows
+        work_dir: An empty directory for the raw file and the artifacts
+
+    Returns:
+        The measurements of each stage by name
+    """
+    ctx = st.RunContext(work_dir, config)
+    write_clouds(ctx.path('clouds.data'), rows)
+    stages = {stage.name: stage for stage in st.STAGES}
+    results = {}
+    for name in STAGES:
+        results[name] = measure(lambda: stages[name].run(ctx), rows)  # pylint: disable=cell-var-from-loop
+    results['artifact_io'] = measure(lambda: run_artifact_io(ctx), rows)
+    return results
+
+
+def regressions(results: Dict[str, Dict[str, Dict[str, float]]],
+                baseline: Dict[str, Dict[str, Dict[str, float]]], tolerance: float,
+                min_seconds: float, min_mb: float) -> List[str]:
+    """Compares results with a baseline
+
+    Args:
+        results: Measurements by row count (as a string) and stage
+        baseline: Baseline measurements in the same layout; sizes or stages missing from
+            it are not checked
+        tolerance: The allowed relative increase of time and memory
+        min_seconds: Time increases below this many seconds are ignored as noise
+        min_mb: Memory increases below this many MB are ignored as noise
+
+    Returns:
+        A description of each regression
+    """
+    found = []
+    for rows, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(rows, {}).get(stage)
+            if base is None:
+                continue
+            for metric, floor in (('seconds', min_seconds), ('peak_mb', min_mb)):
+                if (result[metric] > base[metric] * (1 + tolerance)
+                        and result[metric] - base[metric] >= floor):
+                    found.append(f'{stage} at {rows} rows: {metric} {result[metric]:.3f} '
+                                 f'vs baseline {base[metric]:.3f}')
+    return found
+
+
+def load_config(config_path: Path, fmt: Optional[str], chunk_rows: Optional[int]) -> Dict[str, Any]:
+    """Loads the pipeline configuration, with the benchmark's artifact settings applied"""
+    with open(config_path, 'r') as f:
+        config = yaml.safe_load(f)
+    run_config = config.setdefault('run_config', {})
+    # Time feature generation itself, not hits of features stored by earlier runs
+    run_config['feature_store'] = None
+    if fmt:
+        run_config['artifact_format'] = fmt
+    if chunk_rows:
+        run_config['chunk_rows'] = chunk_rows
+    return config
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100_000, 1_000_000],
+                        help='Total raw rows of each benchmarked file')
+    parser.add_argument('--config', type=Path, default=Path('config/default-config.yaml'),
+                        help='Pipeline configuration to run the stages with')
+    parser.add_argument('--format', help='Artifact format, overriding run_config.artifact_format')
+    parser.add_argument('--chunk-rows', type=int,
+                        help='Out-of-core chunk size, overriding run_config.chunk_rows')
+    parser.add_argument('--baseline', type=Path, default=BASELINE, help='Baseline file')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store these results as the baseline instead of checking them')
+    parser.add_argument('--output', type=Path, help='Also write the results to this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='Allowed relative increase of time and memory')
+    parser.add_argument('--min-seconds', type=float, default=0.05,
+                        help='Smallest time increase counted as a regression')
+    parser.add_argument('--min-mb', type=float, default=16,
+                        help='Smallest memory increase counted as a regression')
+    args = parser.parse_args()
+
+    config = load_config(args.config, args.format, args.chunk_rows)
+    results = {}
+    print(f"{'rows':>10} {'stage':<22} {'seconds':>9} {'rows/s':>12} {'peak MB':>9}")
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            results[str(rows)] = bench_size(config, rows, Path(tmp))
+        for stage, result in results[str(rows)].items():
+            print(f"{rows:>10} {stage:<22} {result['seconds']:>9.3f} "
+                  f"{result['rows_per_s']:>12.0f} {result['peak_mb']:>9.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        baseline = {}
+        if args.baseline.is_file():
+            with open(args.baseline, 'r') as f:
+                baseline = json.load(f)
+        baseline.setdefault('results', {}).update(results)
+        baseline['machine'] = {'platform': platform.platform(), 'processor': platform.processor(),
+                               'cpus': os.cpu_count(), 'python': platform.python_version()}
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f'Baseline saved to {args.baseline}')
+        return
+
+    if not args.baseline.is_file():
+        print(f'No baseline at {args.baseline}; run with --save-baseline to record one')
+        return
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)['results']
+    found = regressions(results, baseline, args.tolerance, args.min_seconds, args.min_mb)
+    for regression in found:
+        print(f'REGRESSION {regression}')
+    if found:
+        sys.exit(1)
+    print('No regressions against the baseline')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Synthetic data in the layout of the UCI clouds file, at any size
+
+The file has the 10 columns of `clouds.data` and two class blocks separated by comment
+lines, so it parses with `src.create_dataset` like the real file. Each class draws its
+columns from its own distributions, so the classes are partly separable and training
+and scoring do representative work. Rows are written in chunks, so files far larger
+than memory can be generated.
+
+Usage:
+    python benchmarks/synthetic_clouds.py clouds.data --rows 100000000
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+COLUMNS = [
+    'visible_mean', 'visible_max', 'visible_min', 'visible_mean_distribution',
+    'visible_contrast', 'visible_entropy', 'visible_second_angular_momentum',
+    'IR_mean', 'IR_max', 'IR_min'
+]
+
+# Per-class location and scale of each column, in COLUMNS order, roughly those of the
+# real data
+LOCATIONS = np.array([
+    [30.0, 60.0, 10.0, 1.5, 150.0, 0.4, 40.0, 215.0, 230.0, 200.0],
+    [45.0, 85.0, 20.0, 2.5, 250.0, 0.6, 25.0, 205.0, 225.0, 185.0],
+])
+SCALES = np.array([
+    [15.0, 25.0, 8.0, 1.0, 80.0, 0.15, 20.0, 20.0, 15.0, 25.0],
+    [20.0, 30.0, 12.0, 1.2, 120.0, 0.2, 15.0, 25.0, 20.0, 30.0],
+])
+
+
+def sample_rows(rng: np.random.Generator, label: int, rows: int) -> np.ndarray:
+    """Draws rows of one class
+
+    Values are positive, and each row's minimum, mean and maximum columns are ordered
+    as in the real data, so derived features such as logs and ranges stay finite.
+
+    Args:
+        rng: The random generator
+        label: The class, 0 or 1
+        rows: The number of rows
+
+    Returns:
+        A (rows, 10) array in COLUMNS order
+    """
+    values = np.abs(rng.normal(LOCATIONS[label], SCALES[label], size=(rows, len(COLUMNS)))) + 0.01
+    for mean, high, low in ((0, 1, 2), (7, 8, 9)):
+        values[:, [low, mean, high]] = np.sort(values[:, [low, mean, high]], axis=1)
+    return values
+
+
+def write_clouds(path: Path, rows: int, seed: int = 0, chunk_rows: int = 1_000_000) -> Path:
+    """Writes a synthetic clouds file
+
+    Args:
+        path: The file to write
+        rows: The total number of data lines; the first half is class 0, the rest class 1
+        seed: The random seed for the generated values
+        chunk_rows: The number of rows generated and written at a time
+
+    Returns:
+        The path of the written file
+    """
+    rng = np.random.default_rng(seed)
+    path = Path(path)
+    with open(path, 'w') as f:
+        f.write(';' * 62 + '\n;synthetic clouds data\n;\n\n')
+        for label, block_rows in enumerate((rows // 2, rows - rows // 2)):
+            if label:
+                f.write('\n;second class\n;\n\n')
+            for start in range(0, block_rows, chunk_rows):
+                values = sample_rows(rng, label, min(chunk_rows, block_rows - start))
+                np.savetxt(f, values, fmt='%.4f', delimiter='  ')
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', type=Path, help='The file to write')
+    parser.add_argument('--rows', type=int, default=1_000_000, help='Total data lines')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+    write_clouds(args.path, args.rows, args.seed)
+
+
+if __name__ == '__main__':
+    main()
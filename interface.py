@@ -1,12 +1,16 @@
+import json
 import os
 from pathlib import Path
 import logging
 import logging.config
 import boto3
-import joblib
 import yaml
 import streamlit as st
 from botocore.exceptions import NoCredentialsError
+import src.feature_store as fs
+import src.generate_features as gf
+import src.model_cache as mc
+import src.prediction_service as ps
 import src.present_interface as pi
 
 logging.config.fileConfig("config/logging/local.conf")
@@ -16,6 +20,16 @@ logger = logging.getLogger("clouds")
 # Load configuration reference
 CONFIG_REF = os.getenv("CONFIG_REF", "config/config.yaml")
 
+# Prediction service to score with instead of loading the models into the app
+PREDICTION_SERVICE_URL = os.getenv("PREDICTION_SERVICE_URL")
+
+# Local model cache, and how often the app checks S3 for a new model version
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", ".model-cache")
+MODEL_CHECK_SECONDS = int(os.getenv("MODEL_CHECK_SECONDS", "60"))
+
+# Feature store written by the pipeline, for scoring stored observations by row id
+FEATURE_STORE_DIR = os.getenv("FEATURE_STORE_DIR", ".feature-store")
+
 def main() -> None:
     """
     Main function to run the Streamlit app.
@@ -41,26 +55,42 @@ def main() -> None:
     artifacts = Path("artifacts")
     artifacts.mkdir(parents=True, exist_ok=True)
 
-    # Create a cache function to load model from S3
+    # Models are cached on disk by S3 key and ETag, shared by every app process
     @st.cache_resource
-    def load_model_from_s3(bucket_name: str, object_name: str, local_file_name: str):
+    def get_model_cache() -> mc.ModelCache:
+        """
+        Create the on-disk model cache once per process.
+        Returns:
+            The model cache.
         """
-        Download a file from S3 and load a model.
+        return mc.ModelCache(MODEL_CACHE_DIR)
+
+    @st.cache_data(ttl=MODEL_CHECK_SECONDS)
+    def get_model_version(bucket_name: str, object_name: str):
+        """
+        Look up the current version of a model with a HEAD request.
         Args:
             bucket_name (str): Name of the S3 bucket.
             object_name (str): Path in S3.
-            local_file_name (str): Path where the file will be saved locally.
         Returns:
-            The loaded model.
+            The model's ETag, or None if S3 cannot be reached.
         """
-        # Create an S3 client
-        s3_ = boto3.client("s3")
+        return get_model_cache().etag(bucket_name, object_name)
 
-        # Try to download the model from S3
-        # Try to download the model from S3
+    @st.cache_resource
+    def load_model_from_s3(bucket_name: str, object_name: str, etag: str):
+        """
+        Load a model version through the local model cache, downloading it on a miss.
+        Args:
+            bucket_name (str): Name of the S3 bucket.
+            object_name (str): Path in S3.
+            etag (str): The model version; the latest cached one when None.
+        Returns:
+            The loaded model, with its arrays memory-mapped.
+        """
         try:
-            s3_.download_file(bucket_name, object_name, local_file_name)
-            logging.info("Model downloaded successfully from S3")
+            model = get_model_cache().load(bucket_name, object_name, etag)
+            logging.info("Model loaded successfully")
         except NoCredentialsError:
             logging.error("No AWS credentials were found")
             return None
@@ -68,15 +98,37 @@ def main() -> None:
             logging.error("File not found: %s", e)
             return None
 
-        # If the model was downloaded successfully, try to load it
-        try:
-            model = joblib.load(local_file_name)
-            logging.info("Model loaded successfully")
-        except FileNotFoundError as e:
-            logging.error("File not found: %s", e)
+        return model
+
+    # Compile the feature plan once per process; every rerun reuses it
+    @st.cache_resource
+    def load_feature_plan(config_json: str) -> gf.FeaturePlan:
+        """
+        Compile the generate_features config into a reusable feature plan.
+        Args:
+            config_json (str): The generate_features config serialized as JSON.
+        Returns:
+            The compiled feature plan.
+        """
+        return gf.compile_plan(json.loads(config_json))
+
+    feature_plan = load_feature_plan(json.dumps(config["generate_features"], sort_keys=True))
+
+    @st.cache_resource
+    def load_stored_features(config_json: str):
+        """
+        Open the most recent features stored for the create_dataset and generate_features config.
+        Args:
+            config_json (str): The config sections serialized as JSON.
+        Returns:
+            The memory-mapped feature set, or None without a feature store entry.
+        """
+        if not Path(FEATURE_STORE_DIR).is_dir():
             return None
+        return fs.FeatureStore(FEATURE_STORE_DIR).latest(json.loads(config_json))
 
-        return model
+    stored_features = load_stored_features(
+        json.dumps({section: config.get(section) for section in fs.FEATURE_SECTIONS}, sort_keys=True))
 
     # Define Streamlit title and sidebar header
     st.title("Cloud Prediction")
@@ -87,17 +139,39 @@ def main() -> None:
         "Choose the model",
         ("Random Forest", "Logistic Regression")
     )
-    local_model_file_name = "local_model.pkl"
     # Depending on the choice, instantiate the correct model
     if model_choice == "Random Forest":
         model_s3_key = config["aws"]["random_forest_model_name"]
+        service_model_name = "random_forest"
     elif model_choice == "Logistic Regression":
         model_s3_key = config["aws"]["logistic_regression_model_name"]
-    model = load_model_from_s3(bucket_name, model_s3_key, local_model_file_name)
+        service_model_name = "logistic_regression"
+
+    # Score through the micro-batching prediction service when one is configured
+    service_url = PREDICTION_SERVICE_URL or config.get("prediction_service", {}).get("url")
+    if service_url:
+        model = ps.RemoteModel(service_url, service_model_name)
+    else:
+        model = load_model_from_s3(
+            bucket_name, model_s3_key, get_model_version(bucket_name, model_s3_key))
+
+    # Score an observation of the feature store by its row id, without recomputing its features
+    if stored_features is not None and model is not None:
+        row_id = st.sidebar.number_input(
+            "Stored observation (row id, -1 to enter inputs)",
+            min_value=-1, max_value=len(stored_features) - 1, value=-1, step=1
+        )
+        if row_id >= 0:
+            row = stored_features.take([int(row_id)])
+            columns = list(getattr(model, "feature_names_in_", []))
+            proba = model.predict_proba(row[columns] if columns else row)[0]
+            st.subheader(f"Stored observation {row_id}")
+            st.write(row)
+            st.write(dict(zip(map(str, model.classes_), proba.tolist())))
 
     # Present user interface
     logger.info("Presenting user interface...")
-    pi.present_interface(model, config["present_interface"], config["generate_features"], config["prediction"])
+    pi.present_interface(model, config["present_interface"], feature_plan, config["prediction"])
 
 if __name__ == "__main__":
     main()
@@ -1,81 +1,265 @@
 import argparse
 import datetime
 import logging.config
+import sys
 from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
 
 import yaml
 
-import src.acquire_data as ad
-import src.analysis as eda
-import src.aws_utils as aws
-import src.create_dataset as cd
-import src.evaluate_performance as ep
-import src.generate_features as gf
-import src.score_model as sm
-import src.train_model as tm
+import src.artifact_sink as asink
+import src.profiling as prof
+import src.scheduler as sch
+import src.stage_cache as sc
+import src.stages as st
+import src.sweep as sw
 
-logging.config.fileConfig("config/logging/local.conf")
+logging.config.fileConfig("config/logging/local.conf", disable_existing_loggers=False)
 logger = logging.getLogger("clouds")
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-        description="Acquire, clean, and create features from clouds data"
-    )
-    parser.add_argument(
-        "--config", default="config/default-config.yaml", help="Path to configuration file"
-    )
-    args = parser.parse_args()
+# Subcommands running a single stage, by the name of the stage they run
+COMMANDS = {
+    "acquire": "acquire",
+    "dataset": "create_dataset",
+    "features": "generate_features",
+    "analysis": "analysis",
+    "train": "train_model",
+    "score": "score_model",
+    "evaluate": "evaluate_performance",
+}
+
 
-    # Load configuration file for parameters and run config
-    with open(args.config, "r") as f:
+def latest_run(output: Path) -> Path:
+    """Returns the most recent timestamped run directory under the output directory"""
+    runs = [p for p in output.iterdir() if p.is_dir() and p.name.isdigit()] if output.is_dir() else []
+    if not runs:
+        raise FileNotFoundError(f"No previous run to resume in {output}")
+    return max(runs, key=lambda p: int(p.name))
+
+
+def load_config(config_path: str) -> Dict[str, Any]:
+    """Loads the pipeline configuration file"""
+    with open(config_path, "r") as f:
         try:
             config = yaml.load(f, Loader=yaml.FullLoader)
         except yaml.error.YAMLError as e:
-            logger.error("Error while loading configuration from %s", args.config)
+            logger.error("Error while loading configuration from %s", config_path)
+            raise e
         else:
-            logger.info("Configuration file loaded from %s", args.config)
+            logger.info("Configuration file loaded from %s", config_path)
+    return config
 
-    run_config = config.get("run_config", {})
 
-    # Set up output directory for saving artifacts
+def new_run(output: Path) -> Path:
+    """Creates a timestamped run directory under the output directory"""
     now = int(datetime.datetime.now().timestamp())
-    artifacts = Path(run_config.get("output", "artifacts")) / str(now)
+    artifacts = output / str(now)
     artifacts.mkdir(parents=True)
+    return artifacts
+
+
+def open_run(artifacts: Path, config: Dict[str, Any],
+             no_cache: bool) -> Tuple[st.RunContext, Optional[sc.StageCache], asink.ArtifactSink]:
+    """Prepares a run directory for running stages in it
 
-    # Save config file to artifacts directory for traceability
+    Saves the configuration next to the artifacts for traceability and sets up the stage
+    cache and the sink that writes artifacts in the background and uploads each stage's
+    outputs to S3 as soon as the stage completes, while the next stages run.
+
+    Returns:
+        The run context, the stage cache (None with no_cache) and the artifact sink
+    """
     with (artifacts / "config.yaml").open("w") as f:
         yaml.dump(config, f)
 
-    # Acquire data from online repository and save to disk
-    ad.acquire_data(run_config["data_source"], artifacts / "clouds.data")
+    run_config = config.get("run_config", {})
+    cache = None if no_cache else sc.StageCache(run_config.get("cache_dir", ".stage-cache"))
+    sink = asink.open_sink(artifacts, config)
+    return st.RunContext(artifacts, config, sink), cache, sink
+
+
+def run_pipeline(args: argparse.Namespace) -> None:
+    """Runs every stage, skipping those already complete in the run or served from the cache"""
+    config = load_config(args.config)
+    run_config = config.get("run_config", {})
+
+    # Set up output directory for saving artifacts, or reuse the last one when resuming
+    output = Path(run_config.get("output", "artifacts"))
+    if args.resume:
+        artifacts = latest_run(output)
+        logger.info("Resuming run in %s", artifacts)
+    else:
+        artifacts = new_run(output)
+
+    ctx, cache, sink = open_run(artifacts, config, args.no_cache)
+    state = st.load_state(artifacts)
+    # Each stage's time, CPU time, peak memory, rows and bytes written go to profile.json
+    profile = prof.load_profile(artifacts / prof.PROFILE_FILE)
+
+    def run(stage: st.Stage) -> dict:
+        profile_path = artifacts / "profile" / f"{stage.name}.prof" if args.profile == stage.name else None
+        return st.run_profiled(stage, ctx, cache, state, profile_path)
+
+    def done(stage: st.Stage, record: dict, remaining: list) -> None:
+        # A stage resumed from an earlier attempt keeps the record of the attempt that ran it
+        if record["status"] != "resumed" or stage.name not in profile:
+            profile[stage.name] = record
+        prof.save_profile(profile, artifacts / prof.PROFILE_FILE)
+        # Release in-memory results that no remaining stage consumes
+        ctx.retain(name for later in remaining for name in later.inputs)
+
+    # Stages start as soon as the stages producing their inputs are done, so independent
+    # branches such as the analysis figures and model training run at the same time
+    stage_workers = args.jobs or run_config.get("stage_workers", 1)
+    try:
+        sch.run_stages(st.STAGES, run, stage_workers, done)
+        # Upload the remaining files, such as the config and profile
+        sink.upload(artifacts)
+    finally:
+        # Wait for every pending write and upload, and report those that failed
+        sink.close()
+
 
-    # Create structured dataset from raw data; save to disk
-    data = cd.create_dataset(artifacts / "clouds.data", config["create_dataset"])
-    cd.save_dataset(data, artifacts / "clouds.csv")
+def run_command(args: argparse.Namespace) -> None:
+    """Runs the stage of a subcommand in a run directory holding the artifacts it reads
 
-    # Enrich dataset with features for model training; save to disk
-    features = gf.generate_features(data, config["generate_features"])
-    gf.save_dataframe(features, artifacts / "features.csv")
+    Acquisition starts a new run directory unless one is given; the other stages run in
+    the given or the most recent run, whose earlier stages must have produced their inputs.
+    """
+    stage = next(stage for stage in st.STAGES if stage.name == COMMANDS[args.command])
+    config = load_config(args.config)
+    output = Path(config.get("run_config", {}).get("output", "artifacts"))
+    if args.run_dir is not None:
+        artifacts = args.run_dir
+    elif stage.inputs:
+        artifacts = latest_run(output)
+    else:
+        artifacts = new_run(output)
+    logger.info("Running stage %s in %s", stage.name, artifacts)
 
-    # Generate statistics and visualizations for summarizing the data; save to disk
-    figures = artifacts / "figures"
-    figures.mkdir()
-    eda.save_figures(features,config["analysis"],figures)
+    ctx, cache, sink = open_run(artifacts, config, args.no_cache)
+    producers = {name: other.name for other in st.STAGES for name in other.outputs}
+    missing = [name for name in stage.inputs if not ctx.path(name).exists()]
+    if missing:
+        commands = {command for command, name in COMMANDS.items() if name in {producers[m] for m in missing}}
+        raise FileNotFoundError(f"{artifacts} has no {', '.join(missing)}; "
+                                f"run `pipeline.py {' '.join(sorted(commands))}` first")
 
-    # Split data into train/test set and train model based on config; save each to disk
-    tmo, train, test = tm.train_model(features, config["train_model"])
-    tm.save_data(train, test, artifacts)
-    tm.save_model(tmo, artifacts / "trained_model_object.pkl")
+    profile = prof.load_profile(artifacts / prof.PROFILE_FILE)
+    profile_path = artifacts / "profile" / f"{stage.name}.prof" if args.profile else None
+    try:
+        profile[stage.name] = st.run_profiled(stage, ctx, cache, st.load_state(artifacts), profile_path)
+        prof.save_profile(profile, artifacts / prof.PROFILE_FILE)
+        sink.upload(artifacts / prof.PROFILE_FILE)
+        sink.upload(artifacts / "config.yaml")
+    finally:
+        sink.close()
 
-    # Score model on test set; save scores to disk
-    scores = sm.score_model(test, tmo, config["score_model"])
-    sm.save_scores(scores, artifacts / "scores.csv")
 
-    # Evaluate model performance metrics; save metrics to disk
-    metrics = ep.evaluate_performance(test, scores, config["evaluate_performance"])
-    ep.save_metrics(metrics, artifacts / "metrics.yaml")
+def run_sweep(args: argparse.Namespace) -> None:
+    """Runs the pipeline for several configurations, computing stages they share only once
 
-    # Upload all artifacts to S3
-    aws_config = config.get("aws")
-    if aws_config.get("upload", True):
-        aws.upload_artifacts(artifacts, aws_config)
+    Each configuration gets its own run directory, named after the configuration file,
+    in a sweep-<timestamp> directory under its output directory.
+    """
+    now = int(datetime.datetime.now().timestamp())
+    contexts, caches, sinks = [], [], []
+    labels: Dict[str, int] = {}
+    try:
+        for config_path in args.configs:
+            config = load_config(config_path)
+            label = Path(config_path).stem
+            labels[label] = labels.get(label, 0) + 1
+            if labels[label] > 1:
+                label = f"{label}-{labels[label]}"
+            sweep_dir = Path(config.get("run_config", {}).get("output", "artifacts")) / f"sweep-{now}"
+            artifacts = sweep_dir / label
+            artifacts.mkdir(parents=True)
+            # Each run uploads below its own prefix, through its own manifest
+            config = sw.run_config(config, sweep_dir, label)
+            ctx, cache, sink = open_run(artifacts, config, args.no_cache)
+            contexts.append(ctx)
+            caches.append(cache)
+            sinks.append(sink)
+        sw.run_sweep(contexts, caches, args.workers or len(contexts))
+        for ctx in contexts:
+            logger.info("Artifacts saved to %s", ctx.run_dir)
+            # Files already queued, i.e. every stage output, are not queued again
+            ctx.sink.upload(ctx.run_dir)
+    finally:
+        errors = []
+        for sink in sinks:
+            try:
+                sink.close()
+            except asink.ArtifactSinkError as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    """Parses the command line; without a subcommand, the whole pipeline runs"""
+    parser = argparse.ArgumentParser(
+        description="Acquire, clean, and create features from clouds data, train and evaluate models"
+    )
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "--config", default="config/default-config.yaml", help="Path to configuration file"
+    )
+    common.add_argument(
+        "--no-cache", action="store_true", help="Run every stage instead of using the stage cache"
+    )
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+
+    run = commands.add_parser("run", parents=[common], help="Run every stage (the default)")
+    run.add_argument(
+        "--resume", action="store_true",
+        help="Continue the most recent run after the last stage that completed"
+    )
+    run.add_argument(
+        "--jobs", type=int,
+        help="Most stages running at the same time (default: run_config.stage_workers)"
+    )
+    run.add_argument(
+        "--profile", metavar="STAGE", choices=[stage.name for stage in st.STAGES],
+        help="Run this stage under cProfile; statistics are saved to profile/<STAGE>.prof"
+    )
+
+    for command, name in COMMANDS.items():
+        stage = commands.add_parser(command, parents=[common], help=f"Run only the {name} stage")
+        stage.add_argument(
+            "--run-dir", type=Path,
+            help="Run directory to work in (default: a new run for acquire, else the most recent run)"
+        )
+        stage.add_argument(
+            "--profile", action="store_true",
+            help=f"Run the stage under cProfile; statistics are saved to profile/{name}.prof"
+        )
+
+    sweep = commands.add_parser(
+        "sweep", help="Run every stage for several configurations, computing shared stages once"
+    )
+    sweep.add_argument("configs", nargs="+", help="Paths to the configuration files")
+    sweep.add_argument(
+        "--no-cache", action="store_true", help="Run every stage instead of using the stage cache"
+    )
+    sweep.add_argument(
+        "--workers", type=int,
+        help="Most shared stages or per-configuration worker processes running at the same time "
+             "(default: one per configuration)"
+    )
+
+    # The whole pipeline runs when no subcommand is given, as before subcommands existed
+    if not argv or (argv[0] not in commands.choices and argv[0] not in ("-h", "--help")):
+        argv = ["run"] + argv
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    if args.command == "run":
+        run_pipeline(args)
+    elif args.command == "sweep":
+        run_sweep(args)
+    else:
+        run_command(args)
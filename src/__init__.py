@@ -1,20 +1,8 @@
 import warnings
 import datetime
-import json
-from cycler import cycler
 
-# basic plotting and data manipulation
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
-import seaborn as sns
-
-# For modeling
-import sklearn
-import sklearn.ensemble
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import roc_auc_score, confusion_matrix, accuracy_score, classification_report
+# Plotting and modeling libraries are imported where they are used, so importing the
+# package, e.g. for one pipeline stage, stays fast
 
 
 # Update matplotlib defaults to something nicer
@@ -22,6 +10,10 @@ def init_notebook() -> None:
     """
     Initializes the notebook with updated matplotlib defaults.
     """
+    # pylint: disable=import-outside-toplevel
+    import matplotlib as mpl
+    from cycler import cycler
+
     warnings.filterwarnings('ignore')
     mpl_update = {
         'font.size': 16,
@@ -1,12 +1,22 @@
+import hashlib
+import json
 import logging
+import os
+import shutil
 import sys
 import time
 from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
 
 import requests
 
+import src.stage_cache as sc
+
 logger = logging.getLogger(__name__)
 
+# Bytes written to disk per read from the response stream
+CHUNK_SIZE = 1 << 20
+
 def get_data(url: str, attempts: int = 4, wait: int = 3, wait_multiple: int = 2) -> bytes:
     """Acquires data from URL
 
@@ -47,24 +57,176 @@ def write_data(data: bytes, save_path: Path) -> None:
     except Exception as e:  # pylint: disable=broad-except
         print(f"An error occurred while writing data to {save_path}: {e}")
 
-def acquire_data(url: str, save_path: Path) -> None:
+def _read_json(path: Path) -> Optional[Dict[str, Any]]:
+    if not path.is_file():
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_json(value: Dict[str, Any], path: Path) -> None:
+    with open(path, "w") as f:
+        json.dump(value, f, indent=2)
+
+
+def download(url: str, save_path: Path, validators: Optional[Dict[str, Any]] = None,
+             attempts: int = 4, wait: int = 3, wait_multiple: int = 2,
+             chunk_size: int = CHUNK_SIZE, timeout: int = 5) -> Optional[Dict[str, Any]]:
+    """Streams data from URL to a file, resuming interrupted transfers
+
+    The body is written in chunks to `<save_path>.part` and renamed into place once
+    complete. After a failure, the next attempt asks only for the missing bytes with a
+    Range request, guarded by If-Range so a changed source is downloaded again from the
+    start. A partial file left by an earlier process is resumed the same way. The body
+    is requested without content encoding, so the partial file holds the bytes the
+    ranges count; a body the server compresses anyway is downloaded from the start.
+
+    Args:
+        url: The URL from which data is to be acquired
+        save_path: The local file path to which the data is to be written
+        validators: The `etag` and `last_modified` of a copy already held; the server
+            is asked to send the data only if it has changed since
+        attempts: The number of attempts to make to acquire the data
+        wait: The initial wait time between attempts
+        wait_multiple: The multiple by which the wait time increases with each attempt
+        chunk_size: The number of bytes written per read from the response
+        timeout: The connect and read timeout in seconds
+
+    Returns:
+        The `etag`, `last_modified`, `sha256` and `size` of the downloaded data, or None
+        if the server reported it unchanged from `validators`
+    """
+    save_path = Path(save_path)
+    part_path = save_path.with_name(save_path.name + ".part")
+    # The validators of the partial download, which a resumed range must match
+    resume_path = save_path.with_name(save_path.name + ".part.json")
+    partial = _read_json(resume_path) if part_path.is_file() else None
+
+    for attempt in range(attempts):
+        # Ranges count bytes of the encoded body, so the body must be written as sent
+        headers = {"Accept-Encoding": "identity"}
+        if validators:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        resumable = partial and partial.get("resumable", True) and part_path.is_file()
+        offset = part_path.stat().st_size if resumable else 0
+        if offset and (partial.get("etag") or partial.get("last_modified")):
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = partial.get("etag") or partial["last_modified"]
+        else:
+            offset = 0
+
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 304:
+                    logger.info("Data at %s is unchanged", url)
+                    return None
+                if response.status_code == 416:
+                    # The partial file does not fit the source; start over
+                    part_path.unlink()
+                response.raise_for_status()
+                if response.status_code != 206:
+                    offset = 0
+                partial = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    # A server may compress the body anyway; the file then holds the
+                    # decoded bytes, whose offsets mean nothing to a Range request
+                    "resumable": response.headers.get("Content-Encoding", "identity") == "identity",
+                }
+                _write_json(partial, resume_path)
+                if offset:
+                    logger.info("Resuming download of %s at byte %d", url, offset)
+                with open(part_path, "ab" if offset else "wb") as file:
+                    for chunk in response.iter_content(chunk_size):
+                        file.write(chunk)
+            break
+        except requests.exceptions.RequestException as e:
+            if attempt < attempts - 1:
+                wait_time = wait * (wait_multiple ** attempt)
+                logger.warning("Download failed (%s). Retrying in %s seconds...", e, wait_time)
+                time.sleep(wait_time)
+            else:
+                logger.error("Download failed after %d attempts. Error: %s", attempts, e)
+                raise
+
+    metadata = {"etag": partial["etag"], "last_modified": partial["last_modified"],
+                "sha256": sc.digest_file(part_path), "size": part_path.stat().st_size}
+    part_path.replace(save_path)
+    resume_path.unlink()
+    return metadata
+
+
+def cached_download(url: str, cache_dir: Path, **kwargs: Any) -> Tuple[Path, Dict[str, Any]]:
+    """Returns a local copy of the data at URL, downloading it only if it has changed
+
+    Each URL has an entry in the cache directory holding the data and its metadata. A
+    cached copy is revalidated with one conditional request and reused when the server
+    reports it unchanged; a copy whose checksum no longer matches is downloaded again.
+
+    Args:
+        url: The URL from which data is to be acquired
+        cache_dir: The download cache directory
+        kwargs: Options passed on to `download`
+
+    Returns:
+        The path of the cached data and its metadata (`url`, `etag`, `last_modified`,
+        `sha256` and `size`)
+    """
+    entry = Path(cache_dir) / hashlib.sha256(url.encode()).hexdigest()[:32]
+    entry.mkdir(parents=True, exist_ok=True)
+    data_path, meta_path = entry / "data", entry / "meta.json"
+
+    metadata = _read_json(meta_path) if data_path.is_file() else None
+    if metadata is not None and (data_path.stat().st_size != metadata["size"]
+                                 or sc.digest_file(data_path) != metadata["sha256"]):
+        logger.warning("Cached copy of %s is corrupt; downloading it again", url)
+        metadata = None
+
+    fresh = download(url, data_path, validators=metadata, **kwargs)
+    if fresh is None:
+        return data_path, metadata
+    metadata = dict(fresh, url=url)
+    _write_json(metadata, meta_path)
+    return data_path, metadata
+
+
+def acquire_data(url: str, save_path: Path, cache_dir: Optional[Path] = None, **kwargs: Any) -> str:
     """Acquires data from specified URL and saves it to a local file path
 
     Args:
         url: The URL from which data is to be acquired
         save_path: The local file path to which the acquired data is to be saved
+        cache_dir: A download cache directory; when given, the data is only downloaded
+            if it changed since the cached copy
+        kwargs: Options passed on to `download`
+
+    Returns:
+        The SHA-256 checksum of the acquired data
     """
-    url_contents = get_data(url)
-    if url_contents is not None:
-        try:
-            write_data(url_contents, save_path)
-            logger.info("Data written to %s", save_path)
-        except FileNotFoundError:
-            logger.error("Please provide a valid file location to save dataset to.")
-            sys.exit(1)
-        except IOError as e:
-            logger.error("Error occurred while trying to write dataset to file: %s", e)
-            sys.exit(1)
-    else:
+    save_path = Path(save_path)
+    try:
+        if cache_dir is None:
+            metadata = download(url, save_path, **kwargs)
+        else:
+            data_path, metadata = cached_download(url, cache_dir, **kwargs)
+            if save_path.exists():
+                save_path.unlink()
+            try:
+                os.link(data_path, save_path)
+            except OSError:
+                shutil.copyfile(data_path, save_path)
+    except requests.exceptions.RequestException:
         logger.error("Failed to download data from the URL.")
         sys.exit(1)
+    except FileNotFoundError:
+        logger.error("Please provide a valid file location to save dataset to.")
+        sys.exit(1)
+    except IOError as e:
+        logger.error("Error occurred while trying to write dataset to file: %s", e)
+        sys.exit(1)
+
+    logger.info("Data written to %s (sha256 %s)", save_path, metadata["sha256"])
+    return metadata["sha256"]
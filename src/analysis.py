@@ -1,15 +1,187 @@
+import json
 import logging
-from typing import List
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Dict, List, Sequence
 from pathlib import Path
-import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+# Rows binned per bincount call, bounding the temporaries of compute_histograms
+_BLOCK_ROWS = 1 << 16
+
+
+def compute_histograms(features: pd.DataFrame, target_name: str, columns: Sequence[str],
+                       classes: Sequence[float] = (0, 1), bins: int = 10) -> Dict[str, Any]:
+    """Computes per-class histograms of many columns in one vectorized pass
+
+    Every column gets `bins` equal-width bins spanning its finite values across all
+    classes, as Matplotlib does for a multi-dataset histogram. The values of all columns
+    are binned together and counted with a single bincount per block of rows. Non-finite
+    values and rows of other classes are left out.
+
+    Args:
+        features: The pandas dataframe containing the features
+        target_name: The name of the class column
+        columns: The columns to compute histograms for
+        classes: The class values, in plotting order
+        bins: The number of bins per column
+
+    Returns:
+        A dictionary with the `columns` and `classes`, the per-column bin `edges`
+        (columns x bins + 1) and the `counts` (columns x classes x bins)
+    """
+    values = features[list(columns)].to_numpy(dtype=np.float64)
+    target = features[target_name].to_numpy()
+    n_columns, n_classes = len(columns), len(classes)
+
+    class_index = np.full(len(target), -1, dtype=np.int64)
+    for i, value in enumerate(classes):
+        class_index[target == value] = i
+
+    finite = np.isfinite(values)
+    lo = np.where(finite, values, np.inf).min(axis=0, initial=np.inf)
+    hi = np.where(finite, values, -np.inf).max(axis=0, initial=-np.inf)
+    empty = ~np.isfinite(lo)
+    lo[empty], hi[empty] = 0.0, 1.0
+    # Like np.histogram, a column holding a single value spans [value - 0.5, value + 0.5]
+    single = lo == hi
+    lo[single], hi[single] = lo[single] - 0.5, hi[single] + 0.5
+    # The same edges as np.histogram, which bins by searching them rather than dividing
+    edges = np.linspace(lo, hi, bins + 1, axis=1)
+
+    counts = np.zeros(n_columns * n_classes * bins, dtype=np.int64)
+    offsets = np.arange(n_columns) * n_classes
+    for start in range(0, len(values), _BLOCK_ROWS):
+        block = values[start:start + _BLOCK_ROWS]
+        block_class = class_index[start:start + _BLOCK_ROWS, None]
+        keep = finite[start:start + _BLOCK_ROWS] & (block_class >= 0)
+        # Bins are closed on the left, except the last one, which also holds the maximum
+        bin_index = np.stack([np.searchsorted(edges[j], block[:, j], side='right') - 1
+                              for j in range(n_columns)], axis=1)
+        np.clip(bin_index, 0, bins - 1, out=bin_index)
+        flat = ((offsets + block_class) * bins + bin_index)[keep]
+        counts += np.bincount(flat, minlength=len(counts))
+
+    return {
+        'columns': list(columns),
+        'classes': list(classes),
+        'edges': edges,
+        'counts': counts.reshape(n_columns, n_classes, bins),
+    }
+
+
+def save_histograms(histograms: Dict[str, Any], save_path: Path) -> None:
+    """Saves histograms from compute_histograms as JSON, which is small and diffable
+
+    Args:
+        histograms: The histograms to save
+        save_path: The path of the JSON file
+    """
+    with open(save_path, 'w') as f:
+        json.dump({
+            'columns': histograms['columns'],
+            'classes': [float(value) for value in histograms['classes']],
+            'edges': np.asarray(histograms['edges']).tolist(),
+            'counts': np.asarray(histograms['counts']).tolist(),
+        }, f)
+
+
+def load_histograms(save_path: Path) -> Dict[str, Any]:
+    """Loads histograms saved by save_histograms
+
+    Args:
+        save_path: The path of the JSON file
+
+    Returns:
+        The histograms, with `edges` and `counts` as arrays
+    """
+    with open(save_path, 'r') as f:
+        histograms = json.load(f)
+    histograms['edges'] = np.asarray(histograms['edges'])
+    histograms['counts'] = np.asarray(histograms['counts'])
+    return histograms
+
+
+def render_histogram(feature: str, edges: np.ndarray, counts: np.ndarray, fig_path: Path) -> Path:
+    """Renders one histogram from precomputed bin counts and writes it to disk
+
+    The figure is drawn with the Agg backend and not registered with pyplot, so it is
+    freed as soon as it is saved.
+
+    Args:
+        feature: The feature name, used for the x-axis label
+        edges: The bin edges
+        counts: The bin counts, one row per class
+        fig_path: The file path to save the figure to
+
+    Returns:
+        The file path of the saved figure
+    """
+    fig = Figure(figsize=(12, 8))
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    # Weighting each bin's midpoint by its count draws the same bars as the raw values
+    centers = (edges[:-1] + edges[1:]) / 2
+    ax.hist([centers] * len(counts), bins=edges, weights=list(counts))
+    ax.set_xlabel(' '.join(feature.split('_')).capitalize())
+    ax.set_ylabel('Number of observations')
+    fig.savefig(fig_path)
+    return fig_path
+
+
+def plot_histograms(histograms: Dict[str, Any], names: Sequence[str], save_dir: Path,
+                    n_jobs: int = 1) -> List[Path]:
+    """Renders one figure per column of precomputed histograms
+
+    Figures are rendered one at a time, or across `n_jobs` worker processes. At most two
+    tasks per worker are queued at once.
+
+    Args:
+        histograms: The histograms from compute_histograms or load_histograms
+        names: The file name of each column's figure
+        save_dir: The directory in which to save the figures
+        n_jobs: The number of worker processes (-1 for one per core)
+
+    Returns:
+        The file paths of the saved figures, in column order
+    """
+    n_jobs = os.cpu_count() if n_jobs in (None, -1) else n_jobs
+    tasks = (
+        (feat, histograms['edges'][i], histograms['counts'][i], save_dir / names[i])
+        for i, feat in enumerate(histograms['columns'])
+    )
+    if n_jobs == 1:
+        return [render_histogram(*task) for task in tasks]
+
+    fig_paths = []
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=n_jobs, mp_context=context) as pool:
+        pending = set()
+        for task in tasks:
+            if len(pending) >= 2 * n_jobs:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                fig_paths.extend(future.result() for future in done)
+            pending.add(pool.submit(render_histogram, *task))
+        fig_paths.extend(future.result() for future in wait(pending).done)
+    order = {save_dir / name: i for i, name in enumerate(names)}
+    return sorted(fig_paths, key=order.__getitem__)
+
 
 def save_figures(features: pd.DataFrame, config: dict, save_dir: Path) -> List[Path]:
     """Creates and saves histogram figures for each feature in a pandas dataframe
 
+    Per-class histograms of all plotted columns are computed in one pass, saved to
+    `histograms.json` in save_dir, and the figures are drawn from those counts.
+
     Args:
         features: The pandas dataframe containing the features to be plotted
-        config: The configuration dictionary
+        config: The configuration dictionary; `features` optionally lists the columns
+            to plot (all by default), `bins` sets the bins per histogram and `n_jobs`
+            the number of worker processes (-1 for one per core)
         save_dir: The directory in which to save the figures
 
     Returns:
@@ -17,27 +189,18 @@ def save_figures(features: pd.DataFrame, config: dict, save_dir: Path) -> List[P
     """
     fig_paths = []
     target_name = config['target_name']
-    target = features[target_name]
+    selected = set(config.get('features') or features.columns)
+    columns = [feat for feat in features.columns if feat in selected]
+    # Figures keep the index of their column in the dataframe, whatever the selection
+    names = ['histogram_' + str(i) + '.png' for i, feat in enumerate(features.columns) if feat in selected]
 
     try:
         logging.info('Creating and saving figures')
-        figs = []
-        for feat in features.columns:
-            fig, ax = plt.subplots(figsize=(12, 8))
-            ax.hist([
-                features[target == 0][feat].values, features[target == 1][feat].values
-            ])
-            ax.set_xlabel(' '.join(feat.split('_')).capitalize())
-            ax.set_ylabel('Number of observations')
-            figs.append(fig)
-
-        # Save figures to specified directory
         save_dir.mkdir(parents=True, exist_ok=True)
-        for i, fig in enumerate(figs):
-            fig_path = save_dir / ('histogram_' + str(i) + '.png')
-            fig.savefig(fig_path)
-            fig_paths.append(fig_path)
-
+        histograms = compute_histograms(
+            features, target_name, columns, config.get('classes', (0, 1)), config.get('bins', 10))
+        save_histograms(histograms, save_dir / 'histograms.json')
+        fig_paths = plot_histograms(histograms, names, save_dir, config.get('n_jobs', 1))
         logging.info('Figures saved successfully')
     except Exception as e:
         logging.error('Failed to create and save figures: %s', e)
@@ -0,0 +1,339 @@
+import json
+import logging
+import shutil
+import struct
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# File suffix used for each supported artifact format. The npy format is a directory
+# holding one .npy file per column plus a schema listing the column names in order.
+SUFFIXES = {
+    'csv': '.csv',
+    'parquet': '.parquet',
+    'feather': '.feather',
+    'npy': '.npy.d',
+}
+SCHEMA_FILE = 'schema.json'
+
+# Fixed .npy header size for streamed columns, so the row count can be filled in on close
+_NPY_HEADER_LEN = 128
+
+
+def artifact_path(path: Path, fmt: str) -> Path:
+    """Returns the path an artifact is stored at for a given format
+
+    Args:
+        path: The artifact path, with or without a suffix (e.g. artifacts/features.csv)
+        fmt: One of the keys of SUFFIXES
+
+    Returns:
+        The path with its suffix replaced by the one for `fmt`
+    """
+    if fmt not in SUFFIXES:
+        raise ValueError(f'Unsupported artifact format {fmt!r}; expected one of {list(SUFFIXES)}')
+    path = Path(path)
+    for suffix in SUFFIXES.values():
+        if path.name.endswith(suffix):
+            path = path.with_name(path.name[:-len(suffix)])
+            break
+    return path.with_name(path.name + SUFFIXES[fmt])
+
+
+def infer_format(path: Path) -> str:
+    """Returns the artifact format of a path from its suffix
+
+    Args:
+        path: The path of an existing artifact
+
+    Returns:
+        The format name, one of the keys of SUFFIXES
+    """
+    for fmt, suffix in SUFFIXES.items():
+        if Path(path).name.endswith(suffix):
+            return fmt
+    raise ValueError(f'Cannot infer artifact format of {path}')
+
+
+def write_frame(df: pd.DataFrame, path: Path, fmt: str = 'csv') -> Path:
+    """Writes a DataFrame to disk in the given artifact format
+
+    The index is not stored, matching `to_csv(index=False)`. Feather files are written
+    uncompressed and npy columns as plain arrays so that both can be memory-mapped back.
+
+    Args:
+        df: The DataFrame to be saved
+        path: The artifact path; its suffix is replaced by the one for `fmt`
+        fmt: One of the keys of SUFFIXES
+
+    Returns:
+        The path the artifact was written to
+    """
+    save_path = artifact_path(path, fmt)
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    if fmt == 'csv':
+        df.to_csv(save_path, index=False)
+    elif fmt == 'parquet':
+        df.to_parquet(save_path, index=False)
+    elif fmt == 'feather':
+        df.reset_index(drop=True).to_feather(save_path, compression='uncompressed')
+    else:
+        if save_path.exists():
+            shutil.rmtree(save_path)
+        save_path.mkdir()
+        for i, column in enumerate(df.columns):
+            np.save(save_path / f'{i}.npy', np.ascontiguousarray(df[column].to_numpy()))
+        with open(save_path / SCHEMA_FILE, 'w') as f:
+            json.dump({'columns': [str(column) for column in df.columns], 'rows': len(df)}, f)
+    logger.debug('Wrote %s artifact to %s', fmt, save_path)
+    return save_path
+
+
+def read_frame(path: Path, fmt: Optional[str] = None, mmap: bool = True) -> pd.DataFrame:
+    """Reads a DataFrame artifact written by `write_frame`
+
+    With `mmap` set, feather and npy artifacts are memory-mapped and the returned
+    DataFrame's columns are read-only views of the file pages rather than copies.
+
+    Args:
+        path: The artifact path
+        fmt: The artifact format; inferred from the suffix when omitted
+        mmap: Whether to memory-map the artifact instead of reading it into memory
+
+    Returns:
+        The DataFrame stored in the artifact
+    """
+    fmt = fmt or infer_format(path)
+    if fmt == 'csv':
+        return pd.read_csv(path)
+    if fmt == 'parquet':
+        return pd.read_parquet(path, memory_map=mmap)
+    if fmt == 'feather':
+        # pylint: disable=import-outside-toplevel
+        import pyarrow.feather as feather
+        table = feather.read_table(path, memory_map=mmap)
+        return table.to_pandas(split_blocks=True, self_destruct=not mmap)
+
+    with open(Path(path) / SCHEMA_FILE, 'r') as f:
+        schema = json.load(f)
+    mmap_mode = 'r' if mmap else None
+    columns = {
+        name: np.load(Path(path) / f'{i}.npy', mmap_mode=mmap_mode)
+        for i, name in enumerate(schema['columns'])
+    }
+    return pd.DataFrame(columns, copy=False)
+
+
+def count_rows(path: Path, fmt: Optional[str] = None) -> int:
+    """Returns the number of rows of a DataFrame artifact without loading its values
+
+    Args:
+        path: The artifact path
+        fmt: The artifact format; inferred from the suffix when omitted
+
+    Returns:
+        The number of rows stored in the artifact
+    """
+    fmt = fmt or infer_format(path)
+    if fmt == 'csv':
+        lines, last = 0, b'\n'
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                lines += block.count(b'\n')
+                last = block[-1:]
+        # The header is not a row, and the last line may lack its newline
+        return max(lines - 1 + (last != b'\n'), 0)
+    if fmt == 'parquet':
+        # pylint: disable=import-outside-toplevel
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    if fmt == 'feather':
+        # pylint: disable=import-outside-toplevel
+        import pyarrow as pa
+        with pa.memory_map(str(path)) as source:
+            reader = pa.ipc.open_file(source)
+            return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+    with open(Path(path) / SCHEMA_FILE, 'r') as f:
+        return json.load(f)['rows']
+
+
+def iter_frame(path: Path, chunk_rows: int, fmt: Optional[str] = None) -> Iterator[pd.DataFrame]:
+    """Reads a DataFrame artifact in chunks of at most `chunk_rows` rows
+
+    Args:
+        path: The artifact path
+        chunk_rows: The maximum number of rows per chunk
+        fmt: The artifact format; inferred from the suffix when omitted
+
+    Yields:
+        Consecutive row ranges of the stored DataFrame, each with a default index
+    """
+    # Chunks are read with plain file reads rather than memory maps, so pages of rows
+    # already processed do not stay resident
+    fmt = fmt or infer_format(path)
+    if fmt == 'csv':
+        for chunk in pd.read_csv(path, chunksize=chunk_rows):
+            yield chunk.reset_index(drop=True)
+    elif fmt == 'parquet':
+        # pylint: disable=import-outside-toplevel
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    elif fmt == 'feather':
+        # pylint: disable=import-outside-toplevel
+        import pyarrow as pa
+        reader = pa.ipc.open_file(pa.OSFile(str(path)))
+        pending, rows = [], 0
+        for i in range(reader.num_record_batches):
+            pending.append(reader.get_batch(i))
+            rows += pending[-1].num_rows
+            while rows >= chunk_rows:
+                table = pa.Table.from_batches(pending)
+                yield table.slice(0, chunk_rows).to_pandas()
+                pending, rows = table.slice(chunk_rows).to_batches(), rows - chunk_rows
+        if rows:
+            yield pa.Table.from_batches(pending).to_pandas()
+    else:
+        with open(Path(path) / SCHEMA_FILE, 'r') as f:
+            schema = json.load(f)
+        files = [open(Path(path) / f'{i}.npy', 'rb') for i in range(len(schema['columns']))]
+        try:
+            dtypes = []
+            for f in files:
+                if np.lib.format.read_magic(f) == (1, 0):
+                    _, _, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    _, _, dtype = np.lib.format.read_array_header_2_0(f)
+                dtypes.append(dtype)
+            for start in range(0, schema['rows'], chunk_rows):
+                count = min(chunk_rows, schema['rows'] - start)
+                yield pd.DataFrame({
+                    name: np.fromfile(f, dtype=dtype, count=count)
+                    for name, f, dtype in zip(schema['columns'], files, dtypes)
+                }, copy=False)
+        finally:
+            for f in files:
+                f.close()
+
+
+def _npy_header(dtype: np.dtype, rows: int) -> bytes:
+    """Builds a version 1.0 .npy header padded to a fixed length"""
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+        np.lib.format.dtype_to_descr(dtype), rows)
+    header = header.ljust(_NPY_HEADER_LEN - 11) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class FrameWriter:
+    """Appends DataFrame chunks to an artifact without keeping earlier chunks in memory
+
+    The artifact is readable by `read_frame` and `iter_frame` once the writer is closed.
+    Use as a context manager, or call `close` after the last chunk; a block that raises,
+    or a call to `abort`, deletes the partial artifact instead.
+    """
+
+    def __init__(self, path: Path, fmt: str = 'csv'):
+        self.fmt = fmt
+        self.path = artifact_path(path, fmt)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.rows = 0
+        self._columns = None
+        self._sink = None
+
+    def _open(self, df: pd.DataFrame) -> None:
+        self._columns = list(df.columns)
+        if self.fmt == 'csv':
+            self._sink = open(self.path, 'w', newline='')
+            df.iloc[:0].to_csv(self._sink, index=False)
+        elif self.fmt in ('parquet', 'feather'):
+            # pylint: disable=import-outside-toplevel
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            schema = pa.Schema.from_pandas(df, preserve_index=False)
+            if self.fmt == 'parquet':
+                self._sink = pq.ParquetWriter(self.path, schema)
+            else:
+                options = pa.ipc.IpcWriteOptions(compression=None)
+                self._sink = pa.ipc.new_file(str(self.path), schema, options=options)
+        else:
+            if self.path.exists():
+                shutil.rmtree(self.path)
+            self.path.mkdir()
+            self._sink = []
+            for i, column in enumerate(df.columns):
+                f = open(self.path / f'{i}.npy', 'wb')
+                f.write(_npy_header(df[column].dtype, 0))
+                self._sink.append((f, df[column].dtype))
+
+    def write(self, df: pd.DataFrame) -> None:
+        """Appends a chunk of rows to the artifact
+
+        Args:
+            df: The chunk to append; its columns must match those of the first chunk
+        """
+        if self._sink is None:
+            self._open(df)
+        elif list(df.columns) != self._columns:
+            raise ValueError(f'Chunk columns {list(df.columns)} do not match {self._columns}')
+
+        if self.fmt == 'csv':
+            df.to_csv(self._sink, index=False, header=False)
+        elif self.fmt in ('parquet', 'feather'):
+            # pylint: disable=import-outside-toplevel
+            import pyarrow as pa
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            self._sink.write_table(table)
+        else:
+            for (f, dtype), column in zip(self._sink, df.columns):
+                np.ascontiguousarray(df[column].to_numpy(), dtype=dtype).tofile(f)
+        self.rows += len(df)
+
+    def close(self) -> Path:
+        """Finalizes the artifact
+
+        Returns:
+            The path the artifact was written to
+        """
+        if self._sink is None:
+            raise ValueError(f'No rows were written to {self.path}')
+        if self.fmt == 'npy':
+            for f, dtype in self._sink:
+                f.seek(0)
+                f.write(_npy_header(dtype, self.rows))
+                f.close()
+            with open(self.path / SCHEMA_FILE, 'w') as f:
+                json.dump({'columns': [str(column) for column in self._columns], 'rows': self.rows}, f)
+        else:
+            self._sink.close()
+        self._sink = None
+        logger.debug('Wrote %d rows as %s artifact to %s', self.rows, self.fmt, self.path)
+        return self.path
+
+    def abort(self) -> None:
+        """Closes the artifact without finalizing it and deletes what was written"""
+        if self._sink is None:
+            return
+        if self.fmt == 'npy':
+            for f, _ in self._sink:
+                f.close()
+        else:
+            self._sink.close()
+        self._sink = None
+        if self.path.is_dir():
+            shutil.rmtree(self.path)
+        else:
+            self.path.unlink(missing_ok=True)
+        logger.debug('Discarded partial %s artifact %s', self.fmt, self.path)
+
+    def __enter__(self) -> 'FrameWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.abort()
+        elif self._sink is not None:
+            self.close()
@@ -0,0 +1,127 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Optional, Sequence, Union
+
+if TYPE_CHECKING:
+    # boto3 is only imported by the pipeline when it uploads
+    import src.aws_utils as aws
+
+logger = logging.getLogger(__name__)
+
+
+class ArtifactSinkError(Exception):
+    """Raised when artifacts handed to an ArtifactSink could not be written or uploaded"""
+
+    def __init__(self, errors: Dict[str, BaseException]):
+        self.errors = errors
+        super().__init__('; '.join(f'{path}: {error}' for path, error in errors.items()))
+
+
+class ArtifactSink:
+    """Writes artifacts on background threads and uploads each one as soon as it is done
+
+    Stages hand over an artifact with `write`, passing the function that writes it, and
+    continue computing while a pool of `max_workers` threads writes it to disk. Once
+    written, every file of the artifact is queued on the uploader, if there is one, so
+    disk and network transfers overlap with the remaining stages. Artifacts written in
+    the foreground are queued with `upload`. `close` waits for every write and upload
+    and raises an ArtifactSinkError listing the failures.
+    """
+
+    def __init__(self, max_workers: int = 2, uploader: Optional['aws.S3Uploader'] = None):
+        self.uploader = uploader
+        self._pool = ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix='artifact-writer')
+        self._lock = threading.Lock()
+        self._writes: Dict[Path, Future] = {}
+
+    def write(self, paths: Union[Path, Sequence[Path]], writer: Callable[..., Any], *args: Any,
+              **kwargs: Any) -> 'Future[Any]':
+        """Writes artifacts in the background
+
+        Args:
+            paths: The file or directory the writer creates, or a list of them
+            writer: The function writing the artifact, called with args and kwargs
+            *args: Positional arguments of writer
+            **kwargs: Keyword arguments of writer
+
+        Returns:
+            A future resolving to the result of writer
+        """
+        paths = [Path(paths)] if isinstance(paths, (str, Path)) else [Path(p) for p in paths]
+
+        def run() -> Any:
+            result = writer(*args, **kwargs)
+            for path in paths:
+                self.upload(path)
+            return result
+
+        with self._lock:
+            future = self._pool.submit(run)
+            for path in paths:
+                self._writes[path] = future
+        return future
+
+    def upload(self, path: Path) -> None:
+        """Queues the files of a complete artifact for upload; a no-op without an uploader"""
+        if self.uploader is None:
+            return
+        path = Path(path)
+        files = sorted(p for p in path.rglob('*') if p.is_file()) if path.is_dir() else [path]
+        for file_path in files:
+            self.uploader.submit(file_path)
+
+    def flush(self, paths: Optional[Iterable[Path]] = None) -> None:
+        """Waits until artifacts are written, raising the first write error
+
+        Args:
+            paths: The artifacts to wait for, including those written inside these
+                directories, or None for every artifact handed over
+        """
+        targets = None if paths is None else [Path(p) for p in paths]
+        with self._lock:
+            futures = [
+                future for path, future in self._writes.items()
+                if targets is None or any(path == t or t in path.parents for t in targets)
+            ]
+        for future in futures:
+            future.result()
+
+    def close(self) -> None:
+        """Waits for every write and upload, then reports the failures"""
+        with self._lock:
+            writes = dict(self._writes)
+        wait(writes.values())
+        self._pool.shutdown()
+        errors: Dict[str, BaseException] = {
+            str(path): future.exception() for path, future in writes.items() if future.exception()
+        }
+        if self.uploader is not None:
+            try:
+                self.uploader.close()
+            except Exception as e:  # pylint: disable=broad-except
+                errors['upload'] = e
+        for path, error in errors.items():
+            logger.error('Artifact %s failed: %s', path, error)
+        if errors:
+            raise ArtifactSinkError(errors)
+
+
+def open_sink(run_dir: Path, config: Dict[str, Any]) -> ArtifactSink:
+    """Creates the artifact sink of a run, uploading to S3 when aws.upload is enabled
+
+    Args:
+        run_dir: The run directory, whose files are uploaded relative to it
+        config: The pipeline configuration
+
+    Returns:
+        A sink writing on run_config.write_workers threads
+    """
+    aws_config = config.get('aws') or {}
+    uploader = None
+    if aws_config.get('upload', True):
+        # boto3 is only imported when the run uploads
+        import src.aws_utils as aws  # pylint: disable=import-outside-toplevel,redefined-outer-name
+        uploader = aws.artifact_uploader(run_dir, aws_config)
+    return ArtifactSink(config.get('run_config', {}).get('write_workers', 2), uploader)
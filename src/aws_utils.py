@@ -1,35 +1,382 @@
+import json
 import logging
-from typing import List
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
 from pathlib import Path
 import boto3
-from botocore.exceptions import ClientError
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 
+import src.stage_cache as sc
 
-def upload_files_recursive(s3_client: boto3.client, base_dir: Path, bucket_name: str) -> List[str]:
+MB = 1024 * 1024
+# Local record of the content hash behind each uploaded object's ETag, kept across runs
+MANIFEST_FILE = '.s3-manifest.json'
+
+
+def transfer_config(config: dict) -> TransferConfig:
+    """Builds the multipart transfer settings for uploads from the aws config section
+
+    Args:
+        config (dict): The aws config; `multipart_threshold_mb`, `multipart_chunksize_mb`
+            and `max_concurrency` (threads per multipart file) are optional.
+
+    Returns:
+        A TransferConfig for `upload_file`.
+    """
+    return TransferConfig(
+        multipart_threshold=int(config.get('multipart_threshold_mb', 64) * MB),
+        multipart_chunksize=int(config.get('multipart_chunksize_mb', 16) * MB),
+        max_concurrency=config.get('max_concurrency', 4),
+    )
+
+
+def object_key(relative_path: Path, prefix: str = '') -> str:
+    """Returns the S3 key of a file given its path relative to the uploaded directory"""
+    key = str(relative_path).replace('\\', '/')
+    prefix = (prefix or '').strip('/')
+    return f'{prefix}/{key}' if prefix else key
+
+
+def upload_file(s3_client: boto3.client, file_path: Path, bucket_name: str, key: str,
+                config: Optional[TransferConfig] = None, retries: int = 3,
+                backoff: float = 1.0) -> str:
+    """Uploads one file to S3, retrying failed attempts with exponential backoff.
+
+    Args:
+        s3_client (boto3.client): A Boto3 client for interacting with S3.
+        file_path (Path): The file to upload.
+        bucket_name (str): The name of the S3 bucket to upload the file to.
+        key (str): The object key to upload the file to.
+        config (TransferConfig): The multipart transfer settings.
+        retries (int): The number of attempts after the first one fails.
+        backoff (float): The delay in seconds before the first retry; doubled on each retry.
+
+    Returns:
+        The S3 URI of the uploaded file.
+    """
+    _retry(lambda: s3_client.upload_file(str(file_path), bucket_name, key, Config=config),
+           f'Upload of {file_path}', retries, backoff)
+    return f's3://{bucket_name}/{key}'
+
+
+def copy_object(s3_client: boto3.client, bucket_name: str, source_key: str, key: str,
+                config: Optional[TransferConfig] = None, retries: int = 3,
+                backoff: float = 1.0) -> str:
+    """Copies an object within a bucket server-side, without downloading it.
+
+    Args:
+        s3_client (boto3.client): A Boto3 client for interacting with S3.
+        bucket_name (str): The name of the S3 bucket holding both objects.
+        source_key (str): The key of the object to copy.
+        key (str): The key to copy the object to.
+        config (TransferConfig): The multipart transfer settings, used for large objects.
+        retries (int): The number of attempts after the first one fails.
+        backoff (float): The delay in seconds before the first retry; doubled on each retry.
+
+    Returns:
+        The S3 URI of the copy.
+    """
+    source = {'Bucket': bucket_name, 'Key': source_key}
+    _retry(lambda: s3_client.copy(source, bucket_name, key, Config=config),
+           f'Copy of s3://{bucket_name}/{source_key}', retries, backoff)
+    return f's3://{bucket_name}/{key}'
+
+
+def _retry(action: Callable[[], Any], description: str, retries: int, backoff: float) -> None:
+    """Calls `action`, retrying S3 errors with exponential backoff"""
+    for attempt in range(retries + 1):
+        try:
+            action()
+            return
+        except (ClientError, BotoCoreError, S3UploadFailedError) as e:
+            if attempt == retries:
+                raise
+            logging.warning('%s failed (attempt %d of %d): %s',
+                            description, attempt + 1, retries + 1, e)
+            time.sleep(backoff * 2 ** attempt)
+
+
+def upload_files_recursive(s3_client: boto3.client, base_dir: Path, bucket_name: str,
+                           prefix: str = '', max_workers: int = 8,
+                           config: Optional[TransferConfig] = None, retries: int = 3,
+                           backoff: float = 1.0) -> List[str]:
     """Recursively uploads all files in a directory to an S3 bucket.
 
+    Files are uploaded concurrently by a pool of `max_workers` threads sharing the
+    client; large files are additionally split into multipart uploads per `config`.
+
     Args:
         s3_client (boto3.client): A Boto3 client for interacting with S3.
         base_dir (Path): The directory containing the files to upload.
         bucket_name (str): The name of the S3 bucket to upload the files to.
+        prefix (str): A key prefix under which the directory is uploaded.
+        max_workers (int): The number of files uploaded at once.
+        config (TransferConfig): The multipart transfer settings.
+        retries (int): The number of retries per file.
+        backoff (float): The delay in seconds before a file's first retry.
 
     Returns:
         List of S3 URIs for each file that was uploaded.
     """
-    s3_uris = []
-    for file_path in base_dir.rglob('*'):
+    uploader = S3Uploader(s3_client, base_dir, bucket_name, prefix=prefix, max_workers=max_workers,
+                          config=config, retries=retries, backoff=backoff)
+    for file_path in sorted(base_dir.rglob('*')):
         if file_path.is_file():
-            # Get the relative path of the file with respect to the base directory
-            relative_path = file_path.relative_to(base_dir)
+            uploader.submit(file_path)
+    return uploader.close()
 
-            # Upload the file to S3
-            object_key = str(relative_path).replace('\\', '/')
-            s3_client.upload_file(str(file_path), bucket_name, object_key)
 
-            # Append the S3 URI to the list of uploaded files
-            s3_uris.append(f's3://{bucket_name}/{object_key}')
+def list_objects(s3_client: boto3.client, bucket_name: str, prefix: str = '') -> Dict[str, str]:
+    """Lists the objects under a prefix of an S3 bucket.
+
+    Args:
+        s3_client (boto3.client): A Boto3 client for interacting with S3.
+        bucket_name (str): The name of the S3 bucket.
+        prefix (str): The key prefix to list.
+
+    Returns:
+        A dictionary mapping each object key to its ETag.
+    """
+    prefix = (prefix or '').strip('/')
+    paginator = s3_client.get_paginator('list_objects_v2')
+    etags = {}
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f'{prefix}/' if prefix else ''):
+        for obj in page.get('Contents', []):
+            etags[obj['Key']] = obj['ETag']
+    return etags
+
+
+def load_manifest(manifest_path: Path) -> Dict[str, Dict[str, str]]:
+    """Loads the sync manifest, mapping S3 URIs to the `sha256` and `etag` of their content"""
+    if not Path(manifest_path).is_file():
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: Dict[str, Dict[str, str]], manifest_path: Path) -> None:
+    """Saves the sync manifest, replacing the previous one atomically"""
+    manifest_path = Path(manifest_path)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = manifest_path.with_name(manifest_path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    tmp_path.replace(manifest_path)
+
+
+class S3Uploader:
+    """Transfers files of a directory to S3 in the background as they are handed over
+
+    Files submitted with `submit` are uploaded by a pool of `max_workers` threads under
+    their path relative to `base_dir`, prefixed with `prefix`. With a manifest (see
+    sync_files), only new or changed content is transferred: a file whose key already
+    holds its content is skipped, and one whose content is held under another key, or
+    was submitted earlier under another key, is copied server-side. A key is no longer
+    copied from once a file with new content is submitted for it, and is overwritten
+    only after the copies reading its old content are done. `close` waits for every
+    transfer, records the manifest and raises the first failure.
+    """
+
+    def __init__(self, s3_client: boto3.client, base_dir: Path, bucket_name: str, prefix: str = '',
+                 manifest_path: Optional[Path] = None, max_workers: int = 8,
+                 config: Optional[TransferConfig] = None, retries: int = 3, backoff: float = 1.0):
+        self.s3_client = s3_client
+        self.base_dir = Path(base_dir)
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.manifest_path = manifest_path
+        self.config = config
+        self.retries = retries
+        self.backoff = backoff
+        self.counts = {'uploaded': 0, 'copied': 0, 'unchanged': 0}
+        self._pool = ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix='s3-upload')
+        self._lock = threading.Lock()
+        self._futures: Dict[str, Future] = {}
+        self._digests: Dict[str, str] = {}
+        # Copies in progress from each key already in the bucket, which is overwritten
+        # with new content only once no copy reads its old content any more
+        self._copies: Dict[str, int] = {}
+        self._copied = threading.Condition(self._lock)
+
+        # Content known to be in the bucket: key -> hash, and hash -> a key holding it
+        self._manifest: Dict[str, Dict[str, str]] = {}
+        self._stored: Dict[str, str] = {}
+        if manifest_path is not None:
+            self._manifest = load_manifest(manifest_path)
+            for key, etag in list_objects(s3_client, bucket_name, prefix).items():
+                entry = self._manifest.get(f's3://{bucket_name}/{key}')
+                if entry is not None and entry['etag'] == etag:
+                    self._stored[key] = entry['sha256']
+        self._sources = {digest: key for key, digest in self._stored.items()}
+
+    def submit(self, file_path: Path) -> 'Future[str]':
+        """Queues a file below base_dir for transfer; a file already queued is not queued again
+
+        Args:
+            file_path (Path): The file to transfer, complete and no longer written to.
+
+        Returns:
+            A future resolving to the S3 URI of the file.
+        """
+        key = object_key(Path(file_path).relative_to(self.base_dir), self.prefix)
+        with self._lock:
+            if key not in self._futures:
+                self._futures[key] = self._pool.submit(self._transfer, Path(file_path), key)
+            return self._futures[key]
+
+    def _transfer(self, file_path: Path, key: str) -> str:
+        if self.manifest_path is None:
+            self._count('uploaded')
+            return upload_file(self.s3_client, file_path, self.bucket_name, key,
+                               self.config, self.retries, self.backoff)
+
+        digest = sc.digest_file(file_path)
+        with self._lock:
+            self._digests[key] = digest
+            stored = self._stored.get(key)
+            if stored is not None and stored != digest:
+                # The key's old content can no longer be copied from it
+                if self._sources.get(stored) == key:
+                    del self._sources[stored]
+                del self._stored[key]
+                self._copied.wait_for(lambda: not self._copies.get(key))
+            source = self._sources.get(digest) if stored != digest else key
+            if source is None:
+                # Later files with the same content are copied from this one
+                self._sources[digest] = key
+            # Copies from a key already in the bucket hold off overwriting it
+            reading = source in self._stored and source != key
+            if reading:
+                self._copies[source] = self._copies.get(source, 0) + 1
+            pending = self._futures.get(source) if source not in self._stored else None
+        if stored == digest:
+            self._count('unchanged')
+            return f's3://{self.bucket_name}/{key}'
+        if source is None:
+            self._count('uploaded')
+            return upload_file(self.s3_client, file_path, self.bucket_name, key,
+                               self.config, self.retries, self.backoff)
+        if pending is not None:
+            # The source is being uploaded by another worker; copy once it is in the bucket
+            pending.result()
+        self._count('copied')
+        try:
+            return copy_object(self.s3_client, self.bucket_name, source, key,
+                               self.config, self.retries, self.backoff)
+        finally:
+            if reading:
+                with self._lock:
+                    self._copies[source] -= 1
+                    self._copied.notify_all()
+
+    def _count(self, outcome: str) -> None:
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def close(self) -> List[str]:
+        """Waits for every queued transfer and saves the manifest
+
+        Returns:
+            List of S3 URIs for every submitted file, in submission order.
+        """
+        with self._lock:
+            futures = dict(self._futures)
+        wait(futures.values())
+        self._pool.shutdown()
+        logging.info('Transferred %d files to s3://%s/%s: %d uploaded, %d copied, %d unchanged',
+                     len(futures), self.bucket_name, self.prefix, self.counts['uploaded'],
+                     self.counts['copied'], self.counts['unchanged'])
+
+        failed = {key: future.exception() for key, future in futures.items() if future.exception()}
+        for key, error in failed.items():
+            logging.error('Transfer to s3://%s/%s failed: %s', self.bucket_name, key, error)
+        if self.manifest_path is not None:
+            # Record the ETags S3 assigned to the transferred objects
+            remote = list_objects(self.s3_client, self.bucket_name, self.prefix) \
+                if self.counts['uploaded'] or self.counts['copied'] else {}
+            for key in futures:
+                if key in failed:
+                    continue
+                uri = f's3://{self.bucket_name}/{key}'
+                etag = remote.get(key)
+                if etag is None and self._stored.get(key) == self._digests[key]:
+                    # Unchanged, so the manifest holds the ETag it was checked against
+                    etag = self._manifest[uri]['etag']
+                elif etag is None:
+                    # Transferred, but not (yet) in the listing
+                    etag = self.s3_client.head_object(Bucket=self.bucket_name, Key=key)['ETag']
+                self._manifest[uri] = {'sha256': self._digests[key], 'etag': etag}
+            save_manifest(self._manifest, self.manifest_path)
+        if failed:
+            raise next(iter(failed.values()))
+        return [future.result() for future in futures.values()]
+
+
+def sync_files(s3_client: boto3.client, base_dir: Path, bucket_name: str, manifest_path: Path,
+               prefix: str = '', max_workers: int = 8, config: Optional[TransferConfig] = None,
+               retries: int = 3, backoff: float = 1.0) -> List[str]:
+    """Uploads only the files of a directory whose content is not already in the bucket.
+
+    The manifest records the content hash of every object this function has put in the
+    bucket, together with the object's ETag. An entry is trusted only while a
+    `list_objects_v2` listing still reports the same ETag, so objects changed or deleted
+    by anyone else are uploaded again. A file whose key already holds its content is
+    skipped, and one whose content is held under another key is copied server-side.
+
+    Args:
+        s3_client (boto3.client): A Boto3 client for interacting with S3.
+        base_dir (Path): The directory containing the files to sync.
+        bucket_name (str): The name of the S3 bucket to sync the files to.
+        manifest_path (Path): The local manifest file, created if missing.
+        prefix (str): A key prefix under which the directory is synced.
+        max_workers (int): The number of files transferred at once.
+        config (TransferConfig): The multipart transfer settings.
+        retries (int): The number of retries per file.
+        backoff (float): The delay in seconds before a file's first retry.
+
+    Returns:
+        List of S3 URIs for every file of the directory, whether transferred or not.
+    """
+    uploader = S3Uploader(s3_client, base_dir, bucket_name, prefix, manifest_path, max_workers,
+                          config, retries, backoff)
+    for file_path in sorted(base_dir.rglob('*')):
+        if file_path.is_file():
+            uploader.submit(file_path)
+    return uploader.close()
+
+def artifact_uploader(artifacts: Path, config: dict) -> S3Uploader:
+    """Creates the uploader of a run's artifacts from the aws config section.
+
+    Args:
+        artifacts (Path): The directory containing the artifacts to upload.
+        config (dict): A dictionary containing the configuration details for uploading to S3.
+
+    Returns:
+        An S3Uploader for the directory, syncing through the manifest if `sync` is set.
+    """
+    # Set the log level for the s3transfer logger to suppress DEBUG messages
+    s3transfer_logger = logging.getLogger('s3transfer')
+    s3transfer_logger.setLevel(logging.WARNING)
+
+    # Create a Boto3 session and client, with a connection for every concurrent transfer
+    max_workers = config.get('max_workers', 8)
+    session = boto3.Session()
+    s3_client = session.client('s3', config=Config(
+        max_pool_connections=max(10, max_workers * config.get('max_concurrency', 4))))
+
+    # Only transfer files whose content is not already in the bucket when syncing
+    manifest_path = None
+    if config.get('sync', False):
+        manifest_path = config.get('manifest') or Path(artifacts).parent / MANIFEST_FILE
+    return S3Uploader(s3_client, artifacts, config['bucket_name'], prefix=config.get('prefix', ''),
+                      manifest_path=manifest_path, max_workers=max_workers,
+                      config=transfer_config(config), retries=config.get('retries', 3))
 
-    return s3_uris
 
 def upload_artifacts(artifacts: Path, config: dict) -> List[str]:
     """Uploads all the artifacts in the specified directory to an S3 bucket.
@@ -44,23 +391,16 @@ def upload_artifacts(artifacts: Path, config: dict) -> List[str]:
     # Configure logging
     logging.basicConfig(level=logging.INFO)
 
-    # Set the log level for the s3transfer logger to suppress DEBUG messages
-    s3transfer_logger = logging.getLogger('s3transfer')
-    s3transfer_logger.setLevel(logging.WARNING)
-
-    # Create a Boto3 session and client
-    session = boto3.Session()
-    s3_client = session.client('s3')
-
-    # Get the S3 bucket name from the config
-    bucket_name = config['bucket_name']
     try:
-        # Call the function to upload all files in the directory and its subdirectories
-        s3_uris = upload_files_recursive(s3_client, artifacts, bucket_name)
-    except ClientError as e:
+        uploader = artifact_uploader(artifacts, config)
+        for file_path in sorted(Path(artifacts).rglob('*')):
+            if file_path.is_file():
+                uploader.submit(file_path)
+        s3_uris = uploader.close()
+    except (ClientError, BotoCoreError, S3UploadFailedError) as e:
         logging.error('Error occurred during S3 upload: %s', e)
         raise
 
     # Log the S3 URIs
-    logging.info('Uploaded artifacts to S3 successfully')
+    logging.info('Uploaded %d artifacts to S3 successfully', len(s3_uris))
     return s3_uris
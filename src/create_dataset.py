@@ -1,14 +1,135 @@
+import io
 import logging
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Iterator, List, Tuple
 
 import pandas as pd
 import numpy as np
 
+import src.artifact_io as aio
+
+# Bytes that may open a numeric token; anything at or below a space separates tokens
+_NUMERIC_LEAD = np.zeros(256, dtype=bool)
+_NUMERIC_LEAD[np.frombuffer(b'0123456789+-.', dtype=np.uint8)] = True
+_SPACE = ord(' ')
+_NEWLINE = ord('\n')
+
+# Approximate bytes per data line and bounds on the read window of the chunked parser;
+# scanning a window needs several times its size in temporaries, so windows stay small
+_ROW_BYTES_HINT = 128
+_MIN_WINDOW_BYTES = 1 << 16
+_MAX_WINDOW_BYTES = 1 << 22
+
+# A clouds file holds one block of data lines per class
+N_BLOCKS = 2
+
+
+def scan_layout(buf: np.ndarray, n_columns: int, first_block: int = 0,
+                continues: bool = False) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Locates the data lines of a raw clouds file and the class block each belongs to
+
+    A data line holds exactly `n_columns` whitespace separated tokens, each starting with
+    a numeric character. Consecutive data lines form a block; blocks are separated by the
+    blank and comment (';') header lines in between, and are numbered in file order.
+
+    Args:
+        buf: The raw file contents, or a window of whole lines of it, as a uint8 array
+        n_columns: The number of values on each data line
+        first_block: The number of blocks opened before this window
+        continues: Whether the line before this window was a data line, so that data
+            lines at the start of the window extend the last block
+
+    Returns:
+        The start offsets, end offsets (exclusive, without newline) and block number of
+        every data line, as three arrays of equal length
+    """
+    if len(buf) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+
+    newlines = np.flatnonzero(buf == _NEWLINE)
+    starts = np.concatenate(([0], newlines + 1))
+    starts = starts[starts < len(buf)]
+    ends = np.concatenate((starts[1:] - 1, [len(buf) - int(buf[-1] == _NEWLINE)]))
+
+    # A token starts on a non-blank byte that follows a blank byte (or the start of file)
+    blank = buf <= _SPACE
+    token_start = ~blank
+    token_start[1:] &= blank[:-1]
+    del blank
+
+    token_pos = np.flatnonzero(token_start)
+    del token_start
+    n_tokens = np.diff(np.searchsorted(token_pos, np.append(starts, len(buf))))
+    bad_pos = token_pos[~_NUMERIC_LEAD[buf[token_pos]]]
+    has_bad = np.zeros(len(starts), dtype=bool)
+    has_bad[np.searchsorted(starts, bad_pos, side='right') - 1] = True
+
+    is_data = (n_tokens == n_columns) & ~has_bad
+    opens_block = is_data.copy()
+    opens_block[1:] &= ~is_data[:-1]
+    opens_block[0] &= not continues
+    block = first_block + np.cumsum(opens_block) - 1
+
+    return starts[is_data], ends[is_data], block[is_data]
+
+
+def _check_blocks(n_blocks: int, complete: bool = True) -> None:
+    """Checks the number of data blocks found in a raw clouds file
+
+    Args:
+        n_blocks: The number of blocks found
+        complete: Whether the whole file was parsed, so that fewer blocks are an error too
+
+    Raises:
+        ValueError: If the file does not hold exactly N_BLOCKS blocks
+    """
+    if n_blocks > N_BLOCKS or (complete and n_blocks < N_BLOCKS):
+        raise ValueError(f'Expected {N_BLOCKS} blocks of data lines, one per class, '
+                         f'but found {"" if complete else "at least "}{n_blocks}')
+
+
+def parse_blocks(raw: bytes, columns: List[str], first_block: int = 0,
+                 continues: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """Parses the numeric blocks of a raw clouds file into typed arrays
+
+    Args:
+        raw: The raw file contents, or a window of whole lines of it
+        columns: The names of the values on each data line
+        first_block: The number of blocks opened before this window
+        continues: Whether the line before this window was a data line
+
+    Returns:
+        A (rows, columns) float64 array of values and the block number of each row
+
+    Raises:
+        ValueError: If a data line belongs to a block beyond the N_BLOCKS of the file
+    """
+    buf = np.frombuffer(raw, dtype=np.uint8)
+    starts, ends, block = scan_layout(buf, len(columns), first_block, continues)
+    if len(block) == 0:
+        return np.empty((0, len(columns))), np.empty(0, dtype=np.int64)
+    _check_blocks(int(block[-1]) + 1, complete=False)
+
+    # Each block is a contiguous byte range, so only one slice per block is copied out
+    edges = np.flatnonzero(np.diff(block)) + 1
+    first = np.concatenate(([0], edges))
+    last = np.concatenate((edges, [len(block)])) - 1
+    body = b'\n'.join(raw[starts[i]:ends[j]] for i, j in zip(first, last))
+
+    values = pd.read_csv(
+        io.BytesIO(body), sep=r'\s+', header=None, names=columns,
+        dtype=np.float64, engine='c'
+    ).to_numpy()
+    return values, block
+
 
 def create_dataset(data_path: Path, config: Dict) -> pd.DataFrame:
     """Creates a pandas dataframe from the data in a specified file path
 
+    Class blocks are located by scanning the file's header and separator lines, and
+    each block's position in the file is used as its class label.
+
     Args:
         data_path: The file path of the data to be read
         config: The configuration dictionary
@@ -18,26 +139,15 @@ def create_dataset(data_path: Path, config: Dict) -> pd.DataFrame:
     """
     try:
         logging.info('Creating dataset')
-        with open(data_path, 'r') as f:
-            data = [[s for s in line.split(' ') if s!=''] for line in f.readlines()]
-
         # Get column names from config
         columns = config['load_data']['names']
 
-        # Get first cloud class
-        first_cloud = data[53:1077]
-        first_cloud = [[float(s.replace('/n', '')) for s in cloud] for cloud in first_cloud]
-        first_cloud = pd.DataFrame(first_cloud, columns=columns)
-        first_cloud['class'] = np.zeros(len(first_cloud))
+        values, block = parse_blocks(Path(data_path).read_bytes(), columns)
+        _check_blocks(int(block[-1]) + 1 if len(block) else 0)
+        logging.info('Found %d rows in %d class blocks', len(block), len(np.unique(block)))
 
-        # Get second cloud class
-        second_cloud = data[1082:2105]
-        second_cloud = [[float(s.replace('/n', '')) for s in cloud] for cloud in second_cloud]
-        second_cloud = pd.DataFrame(second_cloud, columns=columns)
-        second_cloud['class'] = np.ones(len(second_cloud))
-
-        # Concatenate dataframes for training
-        dataset = pd.concat([first_cloud, second_cloud])
+        dataset = pd.DataFrame(values, columns=columns)
+        dataset['class'] = block.astype(np.float64)
 
         logging.info('Dataset created successfully')
         return dataset
@@ -46,17 +156,79 @@ def create_dataset(data_path: Path, config: Dict) -> pd.DataFrame:
         raise
 
 
-def save_dataset(df: pd.DataFrame, save_path: Path) -> None:
+def iter_dataset(data_path: Path, config: Dict, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """Parses a raw clouds file into dataframes of a fixed number of rows
+
+    The file is read in windows of whole lines sized from `chunk_rows`, so memory use
+    depends on the chunk size rather than on the size of the file. Class labels are
+    assigned as in `create_dataset`.
+
+    Args:
+        data_path: The file path of the data to be read
+        config: The configuration dictionary
+        chunk_rows: The number of rows per chunk; the last chunk may be shorter
+
+    Yields:
+        Consecutive chunks of the dataset
+    """
+    columns = config['load_data']['names']
+    window_bytes = min(max(chunk_rows * _ROW_BYTES_HINT, _MIN_WINDOW_BYTES), _MAX_WINDOW_BYTES)
+    blocks_seen, continues = 0, False
+    pending_values, pending_block, pending_rows = [], [], 0
+
+    def take(n_rows: int) -> pd.DataFrame:
+        nonlocal pending_values, pending_block, pending_rows
+        values, block = np.concatenate(pending_values), np.concatenate(pending_block)
+        pending_values, pending_block = [values[n_rows:]], [block[n_rows:]]
+        pending_rows -= n_rows
+        chunk = pd.DataFrame(values[:n_rows], columns=columns)
+        chunk['class'] = block[:n_rows].astype(np.float64)
+        return chunk
+
+    with open(data_path, 'rb') as f:
+        tail = b''
+        while True:
+            read = f.read(window_bytes)
+            window = tail + read
+            if read:
+                # Only parse whole lines; the partial last line is carried into the next window
+                cut = window.rfind(b'\n') + 1
+                window, tail = window[:cut], window[cut:]
+            if window:
+                values, block = parse_blocks(window, columns, blocks_seen, continues)
+                if len(block):
+                    blocks_seen = int(block[-1]) + 1
+                    pending_values.append(values)
+                    pending_block.append(block)
+                    pending_rows += len(block)
+                last_line = window[window.rfind(b'\n', 0, len(window) - 1) + 1:]
+                continues = len(scan_layout(np.frombuffer(last_line, dtype=np.uint8), len(columns))[0]) > 0
+            while pending_rows >= chunk_rows:
+                yield take(chunk_rows)
+            if not read:
+                break
+    _check_blocks(blocks_seen)
+    if pending_rows:
+        yield take(pending_rows)
+
+
+def save_dataset(df: pd.DataFrame, save_path: Path, fmt: str = 'csv') -> Path:
     """Saves a DataFrame to a specified file.
 
     Args:
         df: The DataFrame to be saved
-        filename: The name of the file to save the DataFrame to
+        save_path: The path to save the DataFrame to; its suffix is set by `fmt`
+        fmt: The artifact format, one of csv, parquet, feather or npy
+
+    Returns:
+        The path the DataFrame was saved to
     """
     try:
         logging.info('Saving DataFrame to %s', save_path)
-        df.to_csv(save_path, index=False)
+        save_path = aio.write_frame(df, save_path, fmt)
         logging.info('DataFrame saved successfully')
     except Exception as e:
         logging.error('Failed to save DataFrame: %s', e)
         raise
+
+    return save_path
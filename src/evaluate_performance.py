@@ -1,6 +1,7 @@
 import logging
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Iterable, Sequence, Tuple
+import numpy as np
 import pandas as pd
 import yaml
 from sklearn.metrics import roc_auc_score, confusion_matrix, accuracy_score, classification_report
@@ -48,6 +49,171 @@ def evaluate_performance(test_data: pd.DataFrame, scores: pd.DataFrame, config:
     return metrics
 
 
+class MetricsAccumulator:
+    """Streaming, mergeable evaluation of a binary classifier's scores
+
+    Chunks of labels and scores are folded into a confusion matrix and, per true class,
+    a histogram of the predicted probability over `bins` equal-width bins on [0, 1].
+    Accumulators of different chunks or workers are combined with `merge`, and `result`
+    derives the metrics of evaluate_performance from the counts alone.
+
+    The AUC is computed from the histograms, counting scores that share a bin as ties,
+    so it matches the exact AUC when no bin holds two distinct scores of different
+    classes and is otherwise off by at most the share of such pairs.
+    """
+
+    def __init__(self, classes: Sequence[Any], bins: int = 10000):
+        self.classes = np.asarray(classes)
+        if len(self.classes) != 2:
+            raise ValueError(f'Only binary classifiers can be evaluated, got classes {list(self.classes)}')
+        self.bins = bins
+        self.confusion = np.zeros((2, 2), dtype=np.int64)
+        self.histogram = np.zeros((2, bins), dtype=np.int64)
+
+    def _index(self, labels: Any) -> np.ndarray:
+        labels = np.asarray(labels)
+        index = np.searchsorted(self.classes, labels).clip(0, 1)
+        unknown = self.classes[index] != labels
+        if unknown.any():
+            raise ValueError(f'Unknown labels {np.unique(labels[unknown]).tolist()}, '
+                             f'expected {self.classes.tolist()}')
+        return index
+
+    def update(self, y_true: Any, scores: pd.DataFrame) -> 'MetricsAccumulator':
+        """Adds a chunk of true labels and their scores
+
+        Args:
+            y_true: The true labels of the chunk
+            scores: The DataFrame containing the chunk's 'ypred_proba' and 'ypred_bin' columns
+
+        Returns:
+            The accumulator itself
+        """
+        true = self._index(y_true)
+        predicted = self._index(scores['ypred_bin'])
+        self.confusion += np.bincount(2 * true + predicted, minlength=4).reshape(2, 2)
+        score_bins = np.clip((np.asarray(scores['ypred_proba']) * self.bins).astype(np.int64),
+                             0, self.bins - 1)
+        self.histogram += np.bincount(true * self.bins + score_bins,
+                                      minlength=2 * self.bins).reshape(2, self.bins)
+        return self
+
+    def merge(self, other: 'MetricsAccumulator') -> 'MetricsAccumulator':
+        """Adds the counts of another accumulator over the same classes and bins
+
+        Args:
+            other: The accumulator to merge into this one
+
+        Returns:
+            The accumulator itself
+        """
+        if not np.array_equal(self.classes, other.classes) or self.bins != other.bins:
+            raise ValueError('Only accumulators with the same classes and bins can be merged')
+        self.confusion += other.confusion
+        self.histogram += other.histogram
+        return self
+
+    def auc(self) -> float:
+        """Returns the area under the ROC curve of the binned scores"""
+        negatives, positives = self.histogram
+        # Each positive outranks the negatives of lower bins and ties those of its own
+        below = np.cumsum(negatives) - negatives
+        pairs = negatives.sum() * positives.sum()
+        if pairs == 0:
+            raise ValueError('The AUC needs samples of both classes')
+        return float((positives * (below + 0.5 * negatives)).sum() / pairs)
+
+    def result(self) -> Dict[str, Any]:
+        """Derives the metrics of evaluate_performance from the accumulated counts
+
+        Returns:
+            A dictionary containing the auc, confusion, accuracy and classification_report
+        """
+        confusion = self.confusion
+        total = int(confusion.sum())
+        correct = np.diag(confusion)
+        support = confusion.sum(axis=1)
+        predicted = confusion.sum(axis=0)
+        precision = np.divide(correct, predicted, out=np.zeros(2), where=predicted > 0)
+        recall = np.divide(correct, support, out=np.zeros(2), where=support > 0)
+        f1_score = np.divide(2 * precision * recall, precision + recall, out=np.zeros(2),
+                             where=precision + recall > 0)
+        accuracy = float(correct.sum() / total)
+
+        report = {}
+        for i, label in enumerate(self.classes):
+            report[str(label)] = {'precision': float(precision[i]), 'recall': float(recall[i]),
+                                  'f1-score': float(f1_score[i]), 'support': float(support[i])}
+        report['accuracy'] = accuracy
+        for name, weights in (('macro avg', np.ones(2)), ('weighted avg', support)):
+            report[name] = {
+                'precision': float(np.average(precision, weights=weights)),
+                'recall': float(np.average(recall, weights=weights)),
+                'f1-score': float(np.average(f1_score, weights=weights)),
+                'support': float(total),
+            }
+        return {
+            'auc': self.auc(),
+            'confusion': confusion.tolist(),
+            'accuracy': accuracy,
+            'classification_report': report,
+        }
+
+    def save(self, save_path: Path) -> Path:
+        """Saves the counts to an .npz file, e.g. to merge the results of separate jobs
+
+        Args:
+            save_path: The file path to save the accumulator to
+
+        Returns:
+            The file path the accumulator was saved to
+        """
+        save_path = Path(save_path)
+        with open(save_path, 'wb') as f:
+            np.savez(f, classes=self.classes, confusion=self.confusion, histogram=self.histogram)
+        return save_path
+
+
+def load_accumulator(load_path: Path) -> MetricsAccumulator:
+    """Loads an accumulator saved by MetricsAccumulator.save
+
+    Args:
+        load_path: The .npz file to load
+
+    Returns:
+        The loaded accumulator
+    """
+    with np.load(load_path, allow_pickle=False) as arrays:
+        accumulator = MetricsAccumulator(arrays['classes'], bins=arrays['histogram'].shape[1])
+        accumulator.confusion += arrays['confusion']
+        accumulator.histogram += arrays['histogram']
+    return accumulator
+
+
+def accumulate_metrics(chunks: Iterable[Tuple[pd.DataFrame, pd.DataFrame]], classes: Sequence[Any],
+                       config: Dict[str, Any]) -> MetricsAccumulator:
+    """Evaluates a model's scores chunk by chunk
+
+    Args:
+        chunks: Pairs of test data and scores chunks, row-aligned
+        classes: The model's two classes, the second being the one 'ypred_proba' refers to
+        config: The dictionary containing the configuration parameters; `bins` sets the
+            resolution of the score histograms
+
+    Returns:
+        The accumulator holding the counts of every chunk
+    """
+    accumulator = MetricsAccumulator(classes, config.get('bins', 10000))
+    try:
+        logging.info('Accumulating model performance')
+        for test_data, scores in chunks:
+            accumulator.update(test_data[config['target_name']].values, scores)
+    except Exception as e:
+        logging.error('Failed to accumulate model performance: %s', e)
+        raise
+    return accumulator
+
+
 def save_metrics(metrics: Dict[str, Any], save_path: Path) -> None:
     """Saves the performance metrics to a specified file in YAML format.
 
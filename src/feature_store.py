@@ -0,0 +1,202 @@
+import json
+import logging
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+
+import src.artifact_io as aio
+import src.stage_cache as sc
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+
+# The config sections and modules that determine the features generated from raw data
+FEATURE_SECTIONS = ('create_dataset', 'generate_features')
+FEATURE_MODULES = ('src.create_dataset', 'src.generate_features')
+
+
+def feature_key(config: Dict[str, Any]) -> str:
+    """Computes the hash that keys the store, together with the raw data checksum
+
+    It covers the config sections parsing the raw data and generating the features,
+    and the code of the modules doing so, like the keys of the corresponding stages.
+
+    Args:
+        config: The pipeline configuration
+
+    Returns:
+        The hex digest of the sections and the code version
+    """
+    return sc.digest_value({
+        'config': {section: config.get(section) for section in FEATURE_SECTIONS},
+        'code': sc.digest_modules(FEATURE_MODULES),
+    })
+
+
+class FeatureSet:
+    """A memory-mapped feature matrix of the store
+
+    Rows are addressed by their position in the matrix, their row id, which is the row's
+    position in the parsed dataset. The returned DataFrames are indexed by row id and
+    their columns are read-only views of the file pages, except those of `take`, which
+    copies the requested rows.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path / aio.SCHEMA_FILE, 'r') as f:
+            schema = json.load(f)
+        with open(self.path / MANIFEST_FILE, 'r') as f:
+            self.manifest = json.load(f)
+        self.columns: List[str] = schema['columns']
+        self.rows: int = schema['rows']
+        self._arrays: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def _array(self, name: str) -> np.ndarray:
+        if name not in self._arrays:
+            self._arrays[name] = np.load(self.path / f'{self.columns.index(name)}.npy', mmap_mode='r')
+        return self._arrays[name]
+
+    def range(self, start: int = 0, stop: Optional[int] = None,
+              columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Returns the rows with ids from start up to, not including, stop
+
+        Args:
+            start: The first row id
+            stop: The row id after the last one, or None for the end of the matrix
+            columns: The columns to return, or None for all of them
+
+        Returns:
+            The rows, as views of the memory-mapped columns
+        """
+        start, stop, _ = slice(start, stop).indices(self.rows)
+        stop = max(start, stop)
+        return pd.DataFrame({name: self._array(name)[start:stop] for name in columns or self.columns},
+                            index=pd.RangeIndex(start, stop), copy=False)
+
+    def take(self, row_ids: Iterable[int], columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Returns the rows with the given ids, in the given order
+
+        Args:
+            row_ids: The row ids
+            columns: The columns to return, or None for all of them
+
+        Returns:
+            A copy of the rows
+        """
+        ids = np.asarray(list(row_ids), dtype=np.intp)
+        if ids.size and (ids.min() < 0 or ids.max() >= self.rows):
+            raise IndexError(f'Row ids must be between 0 and {self.rows - 1}')
+        return pd.DataFrame({name: self._array(name)[ids] for name in columns or self.columns},
+                            index=pd.Index(ids))
+
+    def frame(self, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Returns every row, as views of the memory-mapped columns"""
+        return self.range(columns=columns)
+
+    def iter_chunks(self, chunk_rows: int, columns: Optional[Sequence[str]] = None) -> Iterator[pd.DataFrame]:
+        """Yields consecutive ranges of at most chunk_rows rows"""
+        for start in range(0, self.rows, chunk_rows):
+            yield self.range(start, start + chunk_rows, columns)
+
+
+class FeatureStore:
+    """A local store of feature matrices, shared by pipeline runs, batch scoring and the app
+
+    Each entry holds the features generated from one raw data file with one
+    configuration, under `<root>/<raw data checksum>/<feature key>` (see feature_key)
+    in the npy artifact layout: one memory-mappable .npy file per column, a schema and a
+    manifest. Entries are written to a temporary directory and renamed into place, so
+    readers never see a partial entry, and they are never changed once written.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, checksum: str, config: Dict[str, Any]) -> Path:
+        """Returns the directory of the entry for a raw data checksum and configuration"""
+        return aio.artifact_path(self.root / checksum / feature_key(config), 'npy')
+
+    def get(self, checksum: str, config: Dict[str, Any]) -> Optional[FeatureSet]:
+        """Returns the features of a raw data checksum and configuration, or None on a miss
+
+        Args:
+            checksum: The SHA-256 digest of the raw data file
+            config: The pipeline configuration
+
+        Returns:
+            The stored features, or None if they are not in the store
+        """
+        path = self.path(checksum, config)
+        if not (path / MANIFEST_FILE).is_file():
+            return None
+        return FeatureSet(path)
+
+    def latest(self, config: Dict[str, Any]) -> Optional[FeatureSet]:
+        """Returns the most recently stored features of a configuration, of any raw data
+
+        Args:
+            config: The pipeline configuration
+
+        Returns:
+            The stored features, or None if no raw data was stored with this configuration
+        """
+        name = feature_key(config) + aio.SUFFIXES['npy']
+        entries = [FeatureSet(path.parent) for path in self.root.glob(f'*/{name}/{MANIFEST_FILE}')]
+        if not entries:
+            return None
+        return max(entries, key=lambda entry: entry.manifest['created'])
+
+    def put(self, checksum: str, config: Dict[str, Any],
+            features: Union[pd.DataFrame, Iterable[pd.DataFrame]]) -> FeatureSet:
+        """Stores the features of a raw data checksum and configuration
+
+        Args:
+            checksum: The SHA-256 digest of the raw data file
+            config: The pipeline configuration
+            features: The features, as one DataFrame or as consecutive chunks of rows;
+                every column must be numeric or boolean, so it can be memory-mapped
+
+        Returns:
+            The stored features; if another process stored them first, its entry
+        """
+        path = self.path(checksum, config)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        chunks = [features] if isinstance(features, pd.DataFrame) else features
+        staging = Path(tempfile.mkdtemp(prefix=f'.{path.name}.', suffix=aio.SUFFIXES['npy'], dir=path.parent))
+        try:
+            with aio.FrameWriter(staging, 'npy') as writer:
+                for chunk in chunks:
+                    columns = [name for name in chunk.columns
+                               if not (is_numeric_dtype(chunk[name]) or is_bool_dtype(chunk[name]))]
+                    if columns:
+                        raise ValueError(f'Columns {columns} are not numeric and cannot be stored')
+                    writer.write(chunk)
+            if not (staging / aio.SCHEMA_FILE).is_file():
+                raise ValueError('No features to store')
+            with open(staging / MANIFEST_FILE, 'w') as f:
+                json.dump({'checksum': checksum, 'feature_key': feature_key(config),
+                           'config': {section: config.get(section) for section in FEATURE_SECTIONS},
+                           'rows': writer.rows, 'created': time.time()}, f, indent=2)
+            try:
+                staging.rename(path)
+            except OSError:
+                if not (path / MANIFEST_FILE).is_file():
+                    raise
+                logger.debug('Features %s were stored concurrently', path)
+        finally:
+            if staging.exists():
+                shutil.rmtree(staging)
+        logger.info('Stored %d rows of features in %s', writer.rows, path)
+        return FeatureSet(path)
@@ -0,0 +1,163 @@
+"""A fitted random forest flattened into NumPy arrays, and an evaluator for it
+
+This module depends on NumPy only: the exporter reads the public `tree_` attributes of a
+fitted forest without importing scikit-learn, and the evaluator never needs it.
+"""
+from pathlib import Path
+from typing import Any, Union
+
+import numpy as np
+
+# Array names stored in an exported forest, in save order
+FIELDS = ('feature', 'threshold', 'left', 'right', 'missing_left', 'value', 'roots', 'classes')
+
+
+class ArrayForest:
+    """The nodes of every tree of a forest in contiguous arrays
+
+    Node i of the concatenated trees splits on column `feature[i]`: rows with a value
+    at most `threshold[i]` continue to node `left[i]`, the others to `right[i]`, and
+    rows with a missing value go left when `missing_left[i]` is set. Leaves point to
+    themselves, so every row can be advanced the same number of steps, `depth`, and ends
+    on its leaf in each tree. `value[i]` holds the class probabilities of a leaf.
+    """
+
+    def __init__(self, feature: np.ndarray, threshold: np.ndarray, left: np.ndarray,
+                 right: np.ndarray, missing_left: np.ndarray, value: np.ndarray,
+                 roots: np.ndarray, classes: np.ndarray):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.classes_ = classes
+        self.depth = self._depth()
+        # Node i's children at 2i (left) and 2i + 1 (right), so one take picks the branch
+        self._children = np.stack([left, right], axis=1).ravel()
+
+    def _depth(self) -> int:
+        """Returns the number of steps after which every root has reached a leaf"""
+        node, depth = self.roots.copy(), 0
+        while True:
+            # Following both children of every node reaches the deepest leaf last
+            children = np.unique(np.concatenate([self.left[node], self.right[node]]))
+            if np.array_equal(children, np.unique(node)):
+                return depth
+            node, depth = children, depth + 1
+
+    def apply(self, features: np.ndarray) -> np.ndarray:
+        """Returns the leaf each row reaches in each tree
+
+        Args:
+            features: A (rows, features) array in the column order the forest was fit on
+
+        Returns:
+            A (rows, trees) array of node indices
+        """
+        # Trees split float32 values, as scikit-learn does
+        x = np.ascontiguousarray(features, dtype=np.float32)
+        n_rows, n_features = x.shape
+        flat = x.ravel()
+        row_offsets = (np.arange(n_rows) * n_features)[:, None]
+        has_missing = bool(np.isnan(flat).any())
+        node = np.broadcast_to(self.roots, (n_rows, len(self.roots))).copy()
+        for _ in range(self.depth):
+            values = flat.take(row_offsets + self.feature.take(node))
+            go_right = ~(values <= self.threshold.take(node))
+            if has_missing:
+                go_right &= ~(np.isnan(values) & self.missing_left.take(node))
+            node = self._children.take(2 * node + go_right)
+        return node
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        """Returns the class probabilities of each row, averaged over the trees
+
+        Args:
+            features: A (rows, features) array in the column order the forest was fit on
+
+        Returns:
+            A (rows, classes) array of probabilities
+        """
+        leaves = self.apply(features)
+        # Summing the trees in order, as predict_proba does, gives the same floats
+        proba = self.value[leaves].sum(axis=1)
+        proba /= leaves.shape[1]
+        return proba
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """Returns the most probable class of each row"""
+        return self.classes_.take(np.argmax(self.predict_proba(features), axis=1))
+
+    def save(self, save_path: Path) -> Path:
+        """Saves the arrays to an uncompressed .npz file
+
+        Args:
+            save_path: The file path to save the forest to
+
+        Returns:
+            The file path the forest was saved to
+        """
+        save_path = Path(save_path)
+        with open(save_path, 'wb') as f:
+            np.savez(f, feature=self.feature, threshold=self.threshold, left=self.left,
+                     right=self.right, missing_left=self.missing_left, value=self.value,
+                     roots=self.roots, classes=self.classes_)
+        return save_path
+
+
+def export_forest(model: Any) -> ArrayForest:
+    """Flattens a fitted RandomForestClassifier into an ArrayForest
+
+    Args:
+        model: A fitted single-output RandomForestClassifier (or another ensemble of
+            decision tree classifiers exposing `estimators_` and `classes_`)
+
+    Returns:
+        The forest's trees as arrays
+    """
+    trees = [estimator.tree_ for estimator in model.estimators_]
+    if any(tree.n_outputs != 1 for tree in trees):
+        raise ValueError('Only single-output forests can be exported')
+
+    offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+    feature, threshold, left, right, missing_left, value = [], [], [], [], [], []
+    for tree, offset in zip(trees, offsets):
+        leaf = tree.children_left == -1
+        own = np.arange(tree.node_count) + offset
+        feature.append(np.where(leaf, 0, tree.feature))
+        threshold.append(np.where(leaf, np.inf, tree.threshold))
+        left.append(np.where(leaf, own, tree.children_left + offset))
+        right.append(np.where(leaf, own, tree.children_right + offset))
+        missing = getattr(tree, 'missing_go_to_left', None)
+        missing_left.append(np.zeros(tree.node_count, dtype=bool) if missing is None
+                            else missing.astype(bool) & ~leaf)
+        # Leaf values become class probabilities, normalized as predict_proba does
+        counts = tree.value[:, 0, :]
+        total = counts.sum(axis=1, keepdims=True)
+        value.append(counts / np.where(total == 0, 1, total))
+
+    return ArrayForest(
+        feature=np.concatenate(feature).astype(np.intp),
+        threshold=np.concatenate(threshold).astype(np.float64),
+        left=np.concatenate(left).astype(np.intp),
+        right=np.concatenate(right).astype(np.intp),
+        missing_left=np.concatenate(missing_left),
+        value=np.ascontiguousarray(np.concatenate(value), dtype=np.float64),
+        roots=offsets[:-1].astype(np.intp),
+        classes=np.asarray(model.classes_),
+    )
+
+
+def load_forest(load_path: Union[str, Path]) -> ArrayForest:
+    """Loads a forest saved by ArrayForest.save
+
+    Args:
+        load_path: The .npz file to load
+
+    Returns:
+        The loaded forest
+    """
+    with np.load(load_path, allow_pickle=False) as arrays:
+        return ArrayForest(**{name: arrays[name] for name in FIELDS})
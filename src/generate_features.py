@@ -1,34 +1,188 @@
+import functools
+import json
 import logging
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional, Tuple, Union
 import pandas as pd
 import numpy as np
+from pandas.api.types import is_numeric_dtype
+
+import src.artifact_io as aio
 
 # Set up logging
 logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
 
-def generate_features(features: pd.DataFrame, config: Dict) -> pd.DataFrame:
+# Operands are ('input', i) for the i-th raw column or ('feature', j) for the j-th output
+Operand = Tuple[str, int]
+
+
+class FeaturePlan:
+    """A feature config compiled into an ordered list of vectorized array operations
+
+    Each step writes one feature into a column of a preallocated, column-major output
+    array. Steps are ordered so that features built from other features run after them,
+    and every operation writes in place (`out=`) so no temporary columns are allocated.
+    A plan holds no per-call state and can be shared by the pipeline, batch scoring and
+    the app, or pickled to worker processes.
+    """
+
+    def __init__(self, inputs: List[str], outputs: List[str],
+                 steps: List[Tuple[str, int, Tuple[Operand, ...]]]):
+        self.inputs = inputs
+        self.outputs = outputs
+        self.steps = steps
+
+    def input_arrays(self, data: pd.DataFrame) -> List[np.ndarray]:
+        """Extracts the plan's raw input columns as float64 arrays
+
+        Args:
+            data: The input data as a Pandas DataFrame
+
+        Returns:
+            One array per name in `inputs`, without copying columns that are already float64
+        """
+        arrays = []
+        for name in self.inputs:
+            column = data[name]
+            if not is_numeric_dtype(column.dtype):
+                raise TypeError(f'Column {name} must be numeric, got {column.dtype}')
+            arrays.append(column.to_numpy(dtype=np.float64))
+        return arrays
+
+    def execute(self, arrays: List[np.ndarray], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Runs the plan over raw input arrays
+
+        Args:
+            arrays: One array per name in `inputs`, all of the same length
+            out: An optional (rows, len(outputs)) float64 array to write the features into
+
+        Returns:
+            The (rows, len(outputs)) array of features, column-major
+        """
+        n_rows = len(arrays[0]) if arrays else 0
+        if out is None:
+            out = np.empty((n_rows, len(self.outputs)), dtype=np.float64, order='F')
+
+        def operand(ref: Operand) -> np.ndarray:
+            kind, index = ref
+            return arrays[index] if kind == 'input' else out[:, index]
+
+        for op, target, operands in self.steps:
+            dst = out[:, target]
+            if op == 'log':
+                np.log(operand(operands[0]), out=dst)
+            elif op == 'multiply':
+                np.multiply(operand(operands[0]), operand(operands[1]), out=dst)
+            else:  # norm_range: (max - min) / mean
+                np.subtract(operand(operands[0]), operand(operands[1]), out=dst)
+                np.divide(dst, operand(operands[2]), out=dst)
+        return out
+
+    def __call__(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Returns a new DataFrame with the input columns followed by the generated features
+
+        Args:
+            data: The input data as a Pandas DataFrame; it is not modified
+
+        Returns:
+            A Pandas DataFrame containing the input data and the generated features
+        """
+        features = pd.DataFrame(
+            self.execute(self.input_arrays(data)), columns=self.outputs, index=data.index, copy=False)
+        replaced = [name for name in self.outputs if name in data.columns]
+        if replaced:
+            data = data.drop(columns=replaced)
+        return pd.concat([data, features], axis=1)
+
+
+def compile_plan(config: Dict) -> FeaturePlan:
+    """Compiles a generate_features config into a FeaturePlan
+
+    Args:
+        config: A dictionary with `log_transform`, `multiply` and `calculate_norm_range` sections
+
+    Returns:
+        The compiled plan
+    """
+    definitions = {}
+    for key, value in config.get('log_transform', {}).items():
+        definitions[key] = ('log', (value,))
+    for key, value in config.get('multiply', {}).items():
+        definitions[key] = ('multiply', (value['col_a'], value['col_b']))
+    for key, value in config.get('calculate_norm_range', {}).items():
+        definitions[key] = ('norm_range', (value['max_col'], value['min_col'], value['mean_col']))
+
+    # A feature may be built from another feature; order the steps so dependencies run first
+    outputs = list(definitions)
+    order: List[str] = []
+    visiting = set()
+
+    def visit(name: str) -> None:
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f'Feature {name} depends on itself')
+        visiting.add(name)
+        for column in definitions[name][1]:
+            if column in definitions and column != name:
+                visit(column)
+        visiting.discard(name)
+        order.append(name)
+
+    for name in outputs:
+        visit(name)
+
+    inputs: List[str] = []
+    steps = []
+    for name in order:
+        op, columns = definitions[name]
+        operands = []
+        for column in columns:
+            if column in definitions and column != name:
+                operands.append(('feature', outputs.index(column)))
+            else:
+                if column not in inputs:
+                    inputs.append(column)
+                operands.append(('input', inputs.index(column)))
+        steps.append((op, outputs.index(name), tuple(operands)))
+
+    return FeaturePlan(inputs, outputs, steps)
+
+
+@functools.lru_cache(maxsize=32)
+def _compile_canonical(canonical: str) -> FeaturePlan:
+    return compile_plan(json.loads(canonical))
+
+
+def get_plan(config: Dict) -> FeaturePlan:
+    """Returns the compiled plan for a config, compiling it only on first use
+
+    Args:
+        config: A generate_features config dictionary
+
+    Returns:
+        The compiled plan, shared by every caller with an equal config
+    """
+    return _compile_canonical(json.dumps(config, sort_keys=True))
+
+
+def generate_features(features: pd.DataFrame, config: Union[Dict, FeaturePlan]) -> pd.DataFrame:
     """Generates features based on input data using specified configurations.
 
     Args:
-        data: The input data as a Pandas DataFrame
-        config: A dictionary containing the configuration
+        features: The input data as a Pandas DataFrame; it is not modified
+        config: A dictionary containing the configuration, or a compiled FeaturePlan
 
     Returns:
-        A Pandas DataFrame containing the generated features
+        A Pandas DataFrame containing the input data and the generated features
     """
 
     # Generate additional features based on configuration
     try:
         logging.info('Generating features')
-        for key, value in config['log_transform'].items():
-            features[key] = features[value].apply(np.log)
-        for key, value in config['multiply'].items():
-            features[key] = features[value['col_a']].multiply(features[value['col_b']])
-        for key, value in config['calculate_norm_range'].items():
-            features[key] = features[value['max_col']] - features[value['min_col']]
-            features[key] = features[key].divide(features[value['mean_col']])
+        plan = config if isinstance(config, FeaturePlan) else get_plan(config)
+        features = plan(features)
         logging.info('Feature generation completed')
     except Exception as e:
         logging.error('Failed to generate features: %s', e)
@@ -37,17 +191,23 @@ def generate_features(features: pd.DataFrame, config: Dict) -> pd.DataFrame:
     return features
 
 
-def save_dataframe(df: pd.DataFrame, save_path: Path) -> None:
+def save_dataframe(df: pd.DataFrame, save_path: Path, fmt: str = 'csv') -> Path:
     """Saves a DataFrame to a specified file.
 
     Args:
         df: The DataFrame to be saved
-        filename: The name of the file to save the DataFrame to
+        save_path: The path to save the DataFrame to; its suffix is set by `fmt`
+        fmt: The artifact format, one of csv, parquet, feather or npy
+
+    Returns:
+        The path the DataFrame was saved to
     """
     try:
         logging.info('Saving DataFrame to %s', save_path)
-        df.to_csv(save_path, index=False)
+        save_path = aio.write_frame(df, save_path, fmt)
         logging.info('DataFrame saved successfully')
     except Exception as e:
         logging.error('Failed to save DataFrame: %s', e)
         raise
+
+    return save_path
@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Optional
+
+import boto3
+import joblib
+from botocore.exceptions import BotoCoreError, ClientError
+
+import src.forest_arrays as fa
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE = 'model.joblib'
+
+
+class ModelCache:
+    """A local on-disk cache of model artifacts stored in S3, keyed by S3 key and ETag
+
+    Each cached version is stored in `<root>/<hash of bucket and key>/<etag>/`. Before a
+    model is loaded, one HEAD request fetches the object's current ETag; the object is
+    downloaded only if that version is not cached yet. If S3 cannot be reached, the most
+    recently cached version is used.
+
+    Cached models are re-saved with `joblib.dump`, which stores NumPy arrays as raw
+    page-aligned buffers, and loaded with `mmap_mode='r'`, so processes loading the same
+    version share the arrays' pages instead of holding private copies. Exported forests
+    (`.npz`, see src.forest_arrays) are mapped entirely; scikit-learn trees copy their
+    nodes when unpickled, so only their other arrays are shared.
+    """
+
+    def __init__(self, root: Path, s3_client: Optional[Any] = None):
+        self.root = Path(root)
+        self.s3_client = s3_client if s3_client is not None else boto3.client('s3')
+
+    def _entry(self, bucket_name: str, key: str) -> Path:
+        return self.root / hashlib.sha256(f'{bucket_name}/{key}'.encode()).hexdigest()[:32]
+
+    def etag(self, bucket_name: str, key: str) -> Optional[str]:
+        """Returns the current ETag of an object, or None if S3 cannot be reached
+
+        Args:
+            bucket_name: The name of the S3 bucket
+            key: The object key of the model
+
+        Returns:
+            The ETag without quotes, or None
+        """
+        try:
+            return self.s3_client.head_object(Bucket=bucket_name, Key=key)['ETag'].strip('"')
+        except (ClientError, BotoCoreError) as e:
+            logger.warning('Could not check s3://%s/%s: %s', bucket_name, key, e)
+            return None
+
+    def path(self, bucket_name: str, key: str, etag: Optional[str] = None) -> Path:
+        """Returns the local path of a model version, downloading it on a cache miss
+
+        Args:
+            bucket_name: The name of the S3 bucket
+            key: The object key of the model
+            etag: The version to return; looked up with a HEAD request when omitted
+
+        Returns:
+            The path of the cached model, saved with joblib
+        """
+        entry = self._entry(bucket_name, key)
+        etag = etag or self.etag(bucket_name, key)
+        if etag is None:
+            # Staging directories start with a dot and hold no complete version
+            cached = sorted((p for p in entry.glob(f'*/{MODEL_FILE}') if not p.parent.name.startswith('.')),
+                            key=lambda p: p.stat().st_mtime)
+            if not cached:
+                raise FileNotFoundError(f'No cached copy of s3://{bucket_name}/{key}')
+            logger.info('Using cached %s of s3://%s/%s', cached[-1].parent.name, bucket_name, key)
+            return cached[-1]
+
+        model_path = entry / etag / MODEL_FILE
+        if model_path.is_file():
+            logger.info('Model s3://%s/%s (%s) found in cache', bucket_name, key, etag)
+            return model_path
+
+        # Download and convert in a temporary directory, then rename it into place so
+        # concurrent processes never see a partial entry; each one stages in its own
+        # directory, and the first rename wins
+        entry.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(prefix=f'.{etag}.', suffix='.tmp', dir=entry))
+        try:
+            download_path = tmp_dir / Path(key).name
+            self.s3_client.download_file(bucket_name, key, str(download_path))
+            logger.info('Model downloaded successfully from s3://%s/%s', bucket_name, key)
+            if download_path.suffix == '.npz':
+                model = fa.load_forest(download_path)
+            else:
+                model = joblib.load(download_path)
+            joblib.dump(model, tmp_dir / MODEL_FILE)
+            download_path.unlink()
+            tmp_dir.rename(entry / etag)
+        except OSError:
+            if not model_path.is_file():
+                raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return model_path
+
+    def load(self, bucket_name: str, key: str, etag: Optional[str] = None,
+             mmap_mode: Optional[str] = 'r') -> Any:
+        """Loads a model version through the cache
+
+        Args:
+            bucket_name: The name of the S3 bucket
+            key: The object key of the model
+            etag: The version to load; looked up with a HEAD request when omitted
+            mmap_mode: The joblib memory-map mode for the model's arrays, or None to
+                read them into memory
+
+        Returns:
+            The loaded model
+        """
+        return joblib.load(self.path(bucket_name, key, etag), mmap_mode=mmap_mode)
@@ -0,0 +1,259 @@
+import argparse
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Coalesces concurrent prediction requests into batches for one model call
+
+    Requests are queued and a single worker thread takes them off the queue. A batch is
+    closed when it holds `max_batch_size` rows or `max_wait_ms` after its first request
+    arrived, whichever comes first, so an idle service answers a lone request after at
+    most `max_wait_ms` and a busy one pays per-call overhead once per batch.
+    """
+
+    def __init__(self, predict: Callable[[pd.DataFrame], Dict[str, np.ndarray]],
+                 max_batch_size: int = 64, max_wait_ms: float = 5):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batch_sizes: List[int] = []
+        self._queue: 'queue.Queue[Optional[tuple]]' = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, rows: pd.DataFrame) -> 'Future[Dict[str, np.ndarray]]':
+        """Queues rows for prediction
+
+        Args:
+            rows: The rows to score
+
+        Returns:
+            A future resolving to the predictions for these rows
+        """
+        future: 'Future[Dict[str, np.ndarray]]' = Future()
+        self._queue.put((rows, future))
+        return future
+
+    def close(self) -> None:
+        """Stops the worker once the queued requests are answered"""
+        self._queue.put(None)
+        self._worker.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch, size = [item], len(item[0])
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while size < self.max_batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self._predict(batch)
+            if stop:
+                return
+
+    def _predict(self, batch: List[tuple]) -> None:
+        try:
+            results = self.predict(pd.concat([rows for rows, _ in batch], ignore_index=True))
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error('Failed to predict batch of %d requests: %s', len(batch), e)
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.batch_sizes.append(sum(len(rows) for rows, _ in batch))
+        start = 0
+        for rows, future in batch:
+            future.set_result({key: value[start:start + len(rows)] for key, value in results.items()})
+            start += len(rows)
+
+
+def model_predictor(model: Any) -> Callable[[pd.DataFrame], Dict[str, np.ndarray]]:
+    """Wraps a fitted classifier into a batch prediction function
+
+    The ensemble is traversed once per batch: labels are the most probable class of the
+    `predict_proba` result, as `predict` would return.
+
+    Args:
+        model: A fitted scikit-learn classifier
+
+    Returns:
+        A function mapping a DataFrame of rows to their `proba` and `labels`
+    """
+    columns = list(getattr(model, 'feature_names_in_', []))
+
+    def predict(rows: pd.DataFrame) -> Dict[str, np.ndarray]:
+        features = rows[columns] if columns else rows
+        proba = model.predict_proba(features)
+        return {'proba': proba, 'labels': model.classes_.take(np.argmax(proba, axis=1))}
+
+    return predict
+
+
+class PredictionServer(ThreadingHTTPServer):
+    """An HTTP server answering `POST /predict/<model>` from per-model micro-batchers
+
+    The request body is a JSON object `{"rows": [{feature: value, ...}, ...]}` and the
+    response holds the model's `classes` and, per row, the class `proba` and `labels`.
+    Rows must hold exactly the features the model was fitted on, otherwise the request
+    is answered with status 400 before it joins a batch. `GET /health` lists the served
+    models.
+    """
+    daemon_threads = True
+    # Concurrent clients are the point of batching; queue their connections
+    request_queue_size = 128
+
+    def __init__(self, address: tuple, models: Dict[str, Any], max_batch_size: int = 64,
+                 max_wait_ms: float = 5):
+        super().__init__(address, PredictionHandler)
+        self.classes = {name: np.asarray(model.classes_).tolist() for name, model in models.items()}
+        self.features = {name: list(getattr(model, 'feature_names_in_', [])) for name, model in models.items()}
+        self.batchers = {
+            name: MicroBatcher(model_predictor(model), max_batch_size, max_wait_ms)
+            for name, model in models.items()
+        }
+
+    def server_close(self) -> None:
+        super().server_close()
+        for batcher in self.batchers.values():
+            batcher.close()
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """Request handler of PredictionServer"""
+    server: PredictionServer
+    # Keep connections open between a client's requests
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        if self.path != '/health':
+            self._send(404, {'error': f'Unknown path {self.path}'})
+            return
+        self._send(200, {'models': list(self.server.batchers)})
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        name = self.path[len('/predict/'):] if self.path.startswith('/predict/') else None
+        if name not in self.server.batchers:
+            self._send(404, {'error': f'Unknown model path {self.path}'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            rows = pd.DataFrame.from_records(body['rows'])
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {'error': f'Invalid request: {e}'})
+            return
+        # A bad request must not reach the batch, where it would fail or skew the others
+        error = self._check_columns(rows, self.server.features[name])
+        if error:
+            self._send(400, {'error': f'Invalid request: {error}'})
+            return
+        try:
+            result = self.server.batchers[name].submit(rows).result()
+        except Exception as e:  # pylint: disable=broad-except
+            self._send(500, {'error': str(e)})
+            return
+        self._send(200, {
+            'classes': self.server.classes[name],
+            'proba': result['proba'].tolist(),
+            'labels': result['labels'].tolist(),
+        })
+
+    @staticmethod
+    def _check_columns(rows: pd.DataFrame, features: List[str]) -> Optional[str]:
+        if not len(rows):
+            return 'no rows'
+        if not features:
+            return None
+        missing = [name for name in features if name not in rows.columns]
+        extra = [name for name in rows.columns if name not in features]
+        if missing or extra:
+            return f'missing features {missing}, unexpected features {extra}'
+        return None
+
+    def _send(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+        logger.debug(format, *args)
+
+
+class RemoteModel:
+    """A client for one model of a prediction service, with the classifier interface
+
+    It can stand in for a local model wherever `predict` and `predict_proba` are called,
+    e.g. in the Streamlit app.
+    """
+
+    def __init__(self, url: str, name: str, timeout: float = 5):
+        self.url = f"{url.rstrip('/')}/predict/{name}"
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.classes_ = None
+
+    def _post(self, features: pd.DataFrame) -> Dict[str, Any]:
+        rows = pd.DataFrame(features).to_dict(orient='records')
+        response = self.session.post(self.url, json={'rows': rows}, timeout=self.timeout)
+        response.raise_for_status()
+        result = response.json()
+        self.classes_ = np.asarray(result['classes'])
+        return result
+
+    def predict_proba(self, features: pd.DataFrame) -> np.ndarray:
+        """Returns the class probabilities of the rows, computed by the service"""
+        return np.asarray(self._post(features)['proba'])
+
+    def predict(self, features: pd.DataFrame) -> np.ndarray:
+        """Returns the predicted labels of the rows, computed by the service"""
+        return np.asarray(self._post(features)['labels'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve trained models over HTTP with micro-batching')
+    parser.add_argument('models', nargs='+', help='Models to serve, as name=path/to/model.pkl')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    parser.add_argument('--max-batch-size', type=int, default=64, help='Most rows per model call')
+    parser.add_argument('--max-wait-ms', type=float, default=5,
+                        help='Longest a request waits for others to join its batch')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    served = {}
+    for spec in args.models:
+        model_name, model_path = spec.split('=', 1)
+        served[model_name] = joblib.load(model_path)
+    server = PredictionServer((args.host, args.port), served, args.max_batch_size, args.max_wait_ms)
+    logger.info('Serving %s on http://%s:%d', ', '.join(served), args.host, server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
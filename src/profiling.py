@@ -0,0 +1,166 @@
+import cProfile
+import json
+import logging
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FILE = 'profile.json'
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+MB = 1e6
+
+# Whether each measure block currently running, in any thread, overlapped another one
+_active_lock = threading.Lock()
+_active: Dict[int, Dict[str, bool]] = {}
+
+
+def current_rss() -> int:
+    """Returns the resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        # Without procfs, fall back to the peak so far, which only ever grows
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class PeakMemory:
+    """Samples the resident memory of this process while a block runs
+
+    `peak` holds the highest sampled resident set size above the one at entry, in bytes.
+    It covers the memory of every thread of the process, but not that of child
+    processes, e.g. of process pools.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name='peak-memory', daemon=True)
+        self._start = 0
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss() - self._start)
+
+    def __enter__(self) -> 'PeakMemory':
+        self._start = current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss() - self._start)
+
+
+def cpu_seconds() -> float:
+    """Returns the CPU time of this process and of its terminated, waited-for children"""
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+@contextmanager
+def measure(profile_path: Optional[Path] = None) -> Iterator[Dict[str, Any]]:
+    """Measures the resources used by a block of code
+
+    The yielded record is filled in when the block exits, with `wall_seconds`,
+    `thread_cpu_seconds`, the CPU time of the thread running the block, `cpu_seconds`
+    and `peak_rss_delta_mb`, the sampled peak resident memory above the level at entry.
+    `cpu_seconds` and `peak_rss_delta_mb` are process-wide: they cover every thread, and
+    `cpu_seconds` also child processes that ended within the block, so they include the
+    work of the block's thread and process pools but also that of any block running in
+    another thread at the same time. `overlapped` is True if another block was measured
+    at the same time, in which case these two figures are inflated by its work.
+
+    Args:
+        profile_path: If given, the block also runs under cProfile; the raw statistics
+            are saved to this path and a summary by cumulative time next to it as .txt
+
+    Yields:
+        The record of the block's measurements
+    """
+    record: Dict[str, Any] = {}
+    profiler = cProfile.Profile() if profile_path is not None else None
+    with _active_lock:
+        overlap = {'overlapped': bool(_active)}
+        for other in _active.values():
+            other['overlapped'] = True
+        _active[id(overlap)] = overlap
+    try:
+        with PeakMemory() as memory:
+            wall, thread_cpu, cpu = time.perf_counter(), time.thread_time(), cpu_seconds()
+            if profiler is not None:
+                profiler.enable()
+            try:
+                yield record
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                record['wall_seconds'] = time.perf_counter() - wall
+                record['thread_cpu_seconds'] = time.thread_time() - thread_cpu
+                record['cpu_seconds'] = cpu_seconds() - cpu
+        record['peak_rss_delta_mb'] = memory.peak / MB
+    finally:
+        with _active_lock:
+            del _active[id(overlap)]
+    record['overlapped'] = overlap['overlapped']
+    if profiler is not None:
+        save_cprofile(profiler, Path(profile_path))
+
+
+def save_cprofile(profiler: cProfile.Profile, save_path: Path, limit: int = 50) -> None:
+    """Saves cProfile statistics, plus their top functions by cumulative time as text
+
+    Args:
+        profiler: The profiler holding the statistics
+        save_path: The path of the raw statistics, readable with pstats or snakeviz
+        limit: The number of functions listed in the text summary
+    """
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(save_path)
+    with open(save_path.with_suffix('.txt'), 'w') as f:
+        pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(limit)
+    logger.info('Profile saved to %s', save_path)
+
+
+def path_bytes(path: Path) -> int:
+    """Returns the size of a file, or of every file below a directory, in bytes"""
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_size
+    if not path.is_dir():
+        return 0
+    return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+
+
+def load_profile(load_path: Path) -> Dict[str, Dict[str, Any]]:
+    """Loads the stage records saved by save_profile, if any"""
+    if not Path(load_path).is_file():
+        return {}
+    with open(load_path, 'r') as f:
+        return json.load(f)
+
+
+def save_profile(profile: Dict[str, Dict[str, Any]], save_path: Path) -> None:
+    """Saves the stage records of a run as JSON
+
+    Args:
+        profile: The record of each stage by name
+        save_path: The path where the profile will be saved
+    """
+    tmp_path = Path(save_path).with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(profile, f, indent=2)
+    tmp_path.replace(save_path)
@@ -0,0 +1,107 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Protocol, Sequence, Set, TypeVar
+
+logger = logging.getLogger(__name__)
+
+
+class Node(Protocol):
+    """A unit of work of the scheduler, such as a pipeline stage (see src.stages.Stage)
+
+    Nodes are ordered by the artifacts they consume and produce, named by their inputs
+    and outputs.
+    """
+
+    @property
+    def name(self) -> str: ...
+
+    @property
+    def inputs(self) -> Sequence[str]: ...
+
+    @property
+    def outputs(self) -> Sequence[str]: ...
+
+
+N = TypeVar('N', bound=Node)
+
+
+def dependencies(stages: Sequence[Node]) -> Dict[str, Set[str]]:
+    """Returns the stages each stage depends on, i.e. those producing its inputs
+
+    Inputs that no stage produces are expected to exist already and add no dependency.
+
+    Args:
+        stages: The stages of the graph
+
+    Returns:
+        The names of the stages each stage depends on, by stage name
+    """
+    producers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            if output in producers:
+                raise ValueError(f'Artifact {output} is produced by both {producers[output]} and {stage.name}')
+            producers[output] = stage.name
+    graph = {stage.name: {producers[name] for name in stage.inputs if name in producers} for stage in stages}
+
+    # Every stage must be reachable by repeatedly running stages whose dependencies ran
+    done: Set[str] = set()
+    while len(done) < len(graph):
+        ready = {name for name, needs in graph.items() if name not in done and needs <= done}
+        if not ready:
+            raise ValueError(f'Stages {sorted(set(graph) - done)} depend on each other')
+        done |= ready
+    return graph
+
+
+def run_stages(stages: Sequence[N], run: Callable[[N], Any], max_workers: int = 1,
+               on_done: Optional[Callable[[N, Any, List[N]], None]] = None) -> Dict[str, Any]:
+    """Runs stages as soon as the stages they depend on are done, several at a time
+
+    Ready stages start in the order they are listed, on up to `max_workers` threads; with
+    one worker the stages run in list order. Stages share the process, and with it the
+    in-memory results of the run context, and parallelize their own work through the
+    process and thread pools of the modules they call. After a failure no further stage
+    is started; the running ones are awaited and the first error is raised.
+
+    Args:
+        stages: The stages to run
+        run: The function running one stage
+        max_workers: The most stages running at the same time
+        on_done: Called in the scheduling thread after each stage completes, with the
+            stage, the result of `run` and the stages not yet completed
+
+    Returns:
+        The result of `run` for each stage by name
+    """
+    graph = dependencies(stages)
+    max_workers = max(max_workers, 1)
+    pending = list(stages)
+    running: Dict[Future, N] = {}
+    results: Dict[str, Any] = {}
+    error: Optional[BaseException] = None
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='stage') as pool:
+        while pending or running:
+            if error is None:
+                for stage in [s for s in pending if graph[s.name] <= results.keys()]:
+                    if len(running) >= max_workers:
+                        break
+                    pending.remove(stage)
+                    running[pool.submit(run, stage)] = stage
+                    logger.debug('Started stage %s', stage.name)
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    results[stage.name] = future.result()
+                except BaseException as e:  # pylint: disable=broad-except
+                    logger.error('Stage %s failed: %s', stage.name, e)
+                    error = error or e
+                    continue
+                if on_done is not None:
+                    on_done(stage, results[stage.name], pending + list(running.values()))
+    if error is not None:
+        raise error
+    return results
@@ -1,51 +1,188 @@
 import logging
-from typing import Dict, Any
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Iterable, Iterator, Optional, Sequence
 from pathlib import Path
+import numpy as np
 import pandas as pd
 from sklearn.ensemble import RandomForestClassifier
 
+import src.artifact_io as aio
+from src.feature_store import FeatureSet
+from src.generate_features import FeaturePlan
+
 
 # Set up logging
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
 
-def score_model(test_data: pd.DataFrame, model: RandomForestClassifier, config: Dict[str, Any]) -> pd.DataFrame:
+# The model held by each scoring worker process, sent once when the worker starts
+_worker_model = None
+
+
+def predict_scores(model: RandomForestClassifier, features: pd.DataFrame,
+                   threshold: Optional[float] = None) -> pd.DataFrame:
+    """Scores rows with a single traversal of the ensemble
+
+    The labels are derived from the probabilities rather than from a second call to
+    `predict`. Without a threshold they are the most probable class, as `predict`
+    returns; with one, a row is labelled as the second class when its probability of
+    that class exceeds the threshold.
+
+    Args:
+        model: The trained model
+        features: The model's input features
+        threshold: An optional decision threshold for binary models
+
+    Returns:
+        A Pandas DataFrame with the probability of the second class and the predicted label
+    """
+    proba = model.predict_proba(features)
+    if threshold is None:
+        labels = model.classes_.take(np.argmax(proba, axis=1))
+    elif len(model.classes_) == 2:
+        labels = model.classes_.take((proba[:, 1] > threshold).astype(np.intp))
+    else:
+        raise ValueError(f'A threshold needs a binary model, got classes {model.classes_}')
+    return pd.DataFrame({'ypred_proba': proba[:, 1], 'ypred_bin': labels})
+
+
+def _init_worker(model: RandomForestClassifier) -> None:
+    global _worker_model  # pylint: disable=global-statement
+    _worker_model = model
+
+
+def _score_chunk(features: pd.DataFrame, threshold: Optional[float]) -> pd.DataFrame:
+    return predict_scores(_worker_model, features, threshold)
+
+
+def iter_scores(chunks: Iterable[pd.DataFrame], model: RandomForestClassifier, config: Dict[str, Any],
+                plan: Optional[FeaturePlan] = None) -> Iterator[pd.DataFrame]:
+    """Scores chunks of rows as they arrive, yielding the scores of each chunk in order
+
+    With `n_jobs` above one in the config, chunks are scored in worker processes that
+    each receive the model once. At most two chunks per worker are in flight, so memory
+    stays bounded however many chunks there are.
+
+    Args:
+        chunks: The chunks of test data
+        model: The trained model to be scored
+        config: The dictionary containing the configuration parameters; `threshold` and
+            `n_jobs` (-1 for one per core) are optional
+        plan: An optional compiled feature plan, applied first to chunks holding raw columns
+
+    Yields:
+        One DataFrame of scores per chunk
+    """
+    initial_features = config['initial_features']
+    threshold = config.get('threshold')
+    n_jobs = config.get('n_jobs', 1)
+    n_jobs = multiprocessing.cpu_count() if n_jobs in (None, -1) else n_jobs
+
+    def features(chunk: pd.DataFrame) -> pd.DataFrame:
+        return (plan(chunk) if plan is not None else chunk)[initial_features]
+
+    if n_jobs == 1:
+        for chunk in chunks:
+            yield predict_scores(model, features(chunk), threshold)
+        return
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=n_jobs, mp_context=context,
+                             initializer=_init_worker, initargs=(model,)) as pool:
+        pending = deque()
+        for chunk in chunks:
+            if len(pending) >= 2 * n_jobs:
+                yield pending.popleft().result()
+            pending.append(pool.submit(_score_chunk, features(chunk), threshold))
+        while pending:
+            yield pending.popleft().result()
+
+
+def score_model(test_data: pd.DataFrame, model: RandomForestClassifier, config: Dict[str, Any],
+                plan: Optional[FeaturePlan] = None) -> pd.DataFrame:
     """Scores the model on the test data
 
     Args:
         test_data: The test data as a Pandas DataFrame
         model: The trained model to be scored
-        config: The dictionary containing the configuration parameters
+        config: The dictionary containing the configuration parameters; `chunk_rows`
+            bounds the rows scored per call, and `threshold` and `n_jobs` are passed
+            on to iter_scores
+        plan: An optional compiled feature plan, applied first when test_data holds raw columns
 
     Returns:
         A Pandas DataFrame containing the predicted probabilities and binary predictions for the test data
     """
-    initial_features = config['initial_features']
+    chunk_rows = config.get('chunk_rows') or max(len(test_data), 1)
 
     try:
         logging.info('Scoring the model')
-        ypred_proba_test = model.predict_proba(test_data[initial_features])[:, 1]
-        ypred_bin_test = model.predict(test_data[initial_features])
+        chunks = (test_data.iloc[start:start + chunk_rows]
+                  for start in range(0, len(test_data), chunk_rows))
+        results = pd.concat(list(iter_scores(chunks, model, config, plan)), ignore_index=True)
+        logging.info('Model scored successfully')
+    except Exception as e:
+        logging.error('Failed to score model: %s', e)
+        raise
+
+    return results
+
+
+def score_features(features: FeatureSet, model: RandomForestClassifier, config: Dict[str, Any],
+                   row_ids: Optional[Sequence[int]] = None) -> pd.DataFrame:
+    """Scores rows of a feature set of the feature store, without generating their features
 
-        results = pd.DataFrame(
-            {'ypred_proba': ypred_proba_test, 'ypred_bin': ypred_bin_test})
+    Rows are read from the memory-mapped store in chunks of `chunk_rows`, so only the
+    chunks being scored are resident.
+
+    Args:
+        features: The stored features
+        model: The trained model to be scored
+        config: The dictionary containing the configuration parameters, as for score_model
+        row_ids: The ids of the rows to score, or None for every row
+
+    Returns:
+        A Pandas DataFrame of the predicted probabilities and binary predictions, indexed by row id
+    """
+    total = len(features) if row_ids is None else len(row_ids)
+    chunk_rows = config.get('chunk_rows') or max(total, 1)
+    columns = config['initial_features']
+    if row_ids is None:
+        chunks = features.iter_chunks(chunk_rows, columns)
+    else:
+        chunks = (features.take(row_ids[start:start + chunk_rows], columns)
+                  for start in range(0, total, chunk_rows))
+
+    try:
+        logging.info('Scoring %d stored rows', total)
+        results = pd.concat(list(iter_scores(chunks, model, config)), ignore_index=True)
         logging.info('Model scored successfully')
     except Exception as e:
         logging.error('Failed to score model: %s', e)
         raise
 
+    results.index = pd.RangeIndex(total) if row_ids is None else pd.Index(np.asarray(row_ids, dtype=np.intp))
     return results
 
-def save_scores(scores: pd.DataFrame, save_path: Path) -> None:
+
+def save_scores(scores: pd.DataFrame, save_path: Path, fmt: str = 'csv') -> Path:
     """Saves the scores to a specified file.
 
     Args:
         scores: The DataFrame to be saved
-        save_path: The path where the scores will be saved
+        save_path: The path where the scores will be saved; its suffix is set by `fmt`
+        fmt: The artifact format, one of csv, parquet, feather or npy
+
+    Returns:
+        The path the scores were saved to
     """
     try:
         logging.info('Saving scores')
-        scores.to_csv(save_path, index=False)
+        save_path = aio.write_frame(scores, save_path, fmt)
         logging.info('Scores saved successfully')
     except Exception as e:
         logging.error('Failed to save scores: %s', e)
         raise
+
+    return save_path
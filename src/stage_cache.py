@@ -0,0 +1,192 @@
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import shutil
+import stat
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+_CHUNK_SIZE = 1 << 20
+
+
+def digest_file(path: Path) -> str:
+    """Computes the SHA-256 digest of a file's contents
+
+    Args:
+        path: The file to hash
+
+    Returns:
+        The hex digest of the file
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def digest_path(path: Path) -> str:
+    """Computes a content digest of a file, or of every file below a directory
+
+    Args:
+        path: The file or directory to hash
+
+    Returns:
+        The hex digest of the path's contents
+    """
+    path = Path(path)
+    if path.is_file():
+        return digest_file(path)
+    sha = hashlib.sha256()
+    for file_path in sorted(p for p in path.rglob('*') if p.is_file()):
+        sha.update(file_path.relative_to(path).as_posix().encode())
+        sha.update(digest_file(file_path).encode())
+    return sha.hexdigest()
+
+
+def digest_value(value: Any) -> str:
+    """Computes a stable digest of a JSON-serializable value such as a config section
+
+    Args:
+        value: The value to hash
+
+    Returns:
+        The hex digest of the value's canonical JSON form
+    """
+    canonical = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def digest_modules(modules: Iterable[str]) -> str:
+    """Computes a code version from the source files of the given modules
+
+    Args:
+        modules: Dotted module names, e.g. 'src.train_model'
+
+    Returns:
+        The hex digest of the modules' source code
+    """
+    sha = hashlib.sha256()
+    for name in sorted(modules):
+        spec = importlib.util.find_spec(name)
+        sha.update(name.encode())
+        sha.update(digest_file(Path(spec.origin)).encode())
+    return sha.hexdigest()
+
+
+def remove_path(path: Path) -> None:
+    """Deletes a file, symlink or directory tree if it exists"""
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    elif path.exists() or path.is_symlink():
+        path.unlink()
+
+
+def link_or_copy(src: Path, dst: Path) -> None:
+    """Hard-links src to dst when possible and copies it otherwise"""
+    if src.is_dir():
+        dst.mkdir(parents=True, exist_ok=True)
+        for child in src.iterdir():
+            link_or_copy(child, dst / child.name)
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _make_read_only(path: Path) -> None:
+    """Removes write permission from every file below path so hard links cannot alter the cache"""
+    files = [path] if path.is_file() else [p for p in path.rglob('*') if p.is_file()]
+    for file_path in files:
+        mode = file_path.stat().st_mode
+        file_path.chmod(mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+class StageCache:
+    """A local, content-addressed store of stage outputs
+
+    Each entry is a directory named by a stage key holding copies of the stage's output
+    artifacts and a manifest of their digests. Entries are written to a temporary
+    directory and renamed into place, so an interrupted store never leaves a partial
+    entry behind.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def lookup(self, key: str) -> Optional[Dict[str, str]]:
+        """Returns the output digests stored under a key, or None on a cache miss
+
+        Args:
+            key: The stage key
+
+        Returns:
+            A mapping of output name to digest, or None if the key is not cached
+        """
+        manifest = self.root / key / MANIFEST_FILE
+        if not manifest.is_file():
+            return None
+        with open(manifest, 'r') as f:
+            return json.load(f)['digests']
+
+    def restore(self, key: str, outputs: Dict[str, Path]) -> Optional[Dict[str, str]]:
+        """Materializes the cached outputs of a key at the given paths
+
+        Args:
+            key: The stage key
+            outputs: A mapping of output name to the path it should be restored to
+
+        Returns:
+            A mapping of output name to digest, or None if the key is not cached
+        """
+        digests = self.lookup(key)
+        if digests is None or set(digests) != set(outputs):
+            return None
+        for name, path in outputs.items():
+            remove_path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            link_or_copy(self.root / key / name, path)
+        logger.debug('Restored %s from stage cache', key)
+        return digests
+
+    def store(self, key: str, outputs: Dict[str, Path]) -> Dict[str, str]:
+        """Copies a stage's outputs into the cache under a key
+
+        Args:
+            key: The stage key
+            outputs: A mapping of output name to the path the stage wrote it to
+
+        Returns:
+            A mapping of output name to digest
+        """
+        digests = {name: digest_path(path) for name, path in outputs.items()}
+        if self.lookup(key) is not None:
+            return digests
+
+        staging = Path(tempfile.mkdtemp(prefix=f'.{key}.', dir=self.root))
+        try:
+            for name, path in outputs.items():
+                target = staging / name
+                target.parent.mkdir(parents=True, exist_ok=True)
+                if path.is_dir():
+                    shutil.copytree(path, target)
+                else:
+                    shutil.copy2(path, target)
+                _make_read_only(target)
+            with open(staging / MANIFEST_FILE, 'w') as f:
+                json.dump({'digests': digests}, f, indent=2)
+            os.rename(staging, self.root / key)
+        except OSError:
+            # Another process stored the same key first; its entry is equivalent
+            shutil.rmtree(staging, ignore_errors=True)
+            if self.lookup(key) is None:
+                raise
+        return digests
@@ -0,0 +1,564 @@
+import inspect
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+import src.artifact_sink as asink
+import src.artifact_io as aio
+import src.create_dataset as cd
+import src.feature_store as fs
+import src.forest_arrays as fa
+import src.generate_features as gf
+import src.profiling as prof
+import src.stage_cache as sc
+
+# The modules pulling in requests, matplotlib, joblib and scikit-learn are imported by
+# the stages that use them, so running or inspecting one stage does not load them all
+# pylint: disable=import-outside-toplevel
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = 'pipeline_state.json'
+
+# Guards the completed-stage record when stages run concurrently
+_state_lock = threading.Lock()
+
+# Artifacts stored as DataFrames; their file suffix follows run_config.artifact_format
+FRAME_ARTIFACTS = {'clouds', 'features', 'train', 'test'}
+
+
+class RunContext:
+    """The artifacts directory, configuration and in-memory results of one pipeline run
+
+    Stages exchange results through artifacts on disk. Results produced earlier in the
+    same process are also kept in memory, so a stage only re-reads an artifact when its
+    producer was served from the cache or completed in a previous run.
+    """
+
+    def __init__(self, run_dir: Path, config: Dict[str, Any], sink: Optional[asink.ArtifactSink] = None):
+        self.run_dir = Path(run_dir)
+        self.config = config
+        self.sink = sink
+        self.fmt = config.get('run_config', {}).get('artifact_format', 'csv')
+        self.digests: Dict[str, str] = {}
+        self._objects: Dict[str, Any] = {}
+
+    def path(self, name: str) -> Path:
+        """Returns the path of a named artifact in the run directory"""
+        if name in FRAME_ARTIFACTS:
+            return aio.artifact_path(self.run_dir / name, self.fmt)
+        return self.run_dir / name
+
+    @property
+    def chunk_rows(self) -> Optional[int]:
+        """The chunk size of the out-of-core mode, or None to process whole frames"""
+        return self.config.get('run_config', {}).get('chunk_rows')
+
+    def write(self, paths: Any, writer: Callable[..., Any], *args: Any) -> None:
+        """Writes artifacts through the sink in the background, or right away without one"""
+        if self.sink is None:
+            writer(*args)
+        else:
+            self.sink.write(paths, writer, *args)
+
+    def flush(self, paths: Iterable[Path]) -> None:
+        """Waits until the artifacts at these paths handed to the sink are written"""
+        if self.sink is not None:
+            self.sink.flush(paths)
+
+    def upload(self, paths: Iterable[Path]) -> None:
+        """Queues complete artifacts for upload, if the sink has an uploader"""
+        if self.sink is not None:
+            for path in paths:
+                if path.exists():
+                    self.sink.upload(path)
+
+    def adopt(self, source: 'RunContext', names: Iterable[str]) -> None:
+        """Takes over complete artifacts of another run, hard-linked, with their results and digests"""
+        for name in names:
+            sc.remove_path(self.path(name))
+            sc.link_or_copy(source.path(name), self.path(name))
+            if name in source._objects:
+                self._objects[name] = source._objects[name]
+            self.digests[name] = source.digests[name]
+
+    def has(self, name: str) -> bool:
+        """Whether a result is held in memory"""
+        return name in self._objects
+
+    def keep(self, name: str, value: Any) -> None:
+        """Keeps a stage result in memory for the stages that consume it"""
+        self._objects[name] = value
+
+    def retain(self, names: Iterable[str]) -> None:
+        """Drops the in-memory results that are not in `names`, e.g. once no stage needs them"""
+        names = set(names)
+        for name in list(self._objects):
+            if name not in names:
+                del self._objects[name]
+
+    def frame(self, name: str) -> pd.DataFrame:
+        """Returns a DataFrame artifact, from memory if it was produced in this process"""
+        if name not in self._objects:
+            self._objects[name] = aio.read_frame(self.path(name), self.fmt)
+        return self._objects[name]
+
+    def frames(self, name: str) -> Dict[str, pd.DataFrame]:
+        """Returns a directory of DataFrame artifacts by name, e.g. the scores of each model"""
+        if name not in self._objects:
+            suffix = aio.SUFFIXES[self.fmt]
+            self._objects[name] = {
+                path.name[:-len(suffix)]: aio.read_frame(path, self.fmt)
+                for path in sorted(self.path(name).iterdir()) if path.name.endswith(suffix)
+            }
+        return self._objects[name]
+
+    def rows(self, name: str) -> Optional[int]:
+        """Returns the number of rows of a DataFrame artifact, or of a directory of them
+
+        Returns:
+            The row count, or None if the artifact holds no DataFrames
+        """
+        value = self._objects.get(name)
+        if isinstance(value, pd.DataFrame):
+            return len(value)
+        if isinstance(value, dict) and value and all(isinstance(v, pd.DataFrame) for v in value.values()):
+            return sum(len(v) for v in value.values())
+        path = self.path(name)
+        if name in FRAME_ARTIFACTS:
+            return aio.count_rows(path, self.fmt) if path.exists() else None
+        suffix = aio.SUFFIXES[self.fmt]
+        frames = [p for p in path.iterdir() if p.name.endswith(suffix)] if path.is_dir() else []
+        return sum(aio.count_rows(p, self.fmt) for p in frames) if frames else None
+
+    def models(self, name: str = 'models') -> Dict[str, Any]:
+        """Returns a directory of saved models by name, from memory if produced in this process"""
+        if name not in self._objects:
+            import joblib
+            self._objects[name] = {
+                path.stem: joblib.load(path, mmap_mode='r') for path in sorted(self.path(name).glob('*.pkl'))
+            }
+        return self._objects[name]
+
+
+@dataclass(frozen=True)
+class Stage:
+    """A pipeline step and the artifacts, config sections and code that determine its outputs"""
+    name: str
+    run: Callable[[RunContext], None]
+    inputs: Tuple[str, ...] = ()
+    outputs: Tuple[str, ...] = ()
+    config_keys: Tuple[str, ...] = ()
+    modules: Tuple[str, ...] = ()
+    # Whether outputs may be served from the stage cache, i.e. depend only on the key
+    cacheable: bool = True
+    # Paths outside the run directory that the stage reads, by name; part of the key
+    external_inputs: Optional[Callable[['RunContext'], Dict[str, Path]]] = None
+
+
+def _config_value(config: Dict[str, Any], dotted_key: str) -> Any:
+    value = config
+    for part in dotted_key.split('.'):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def stage_config(stage: Stage, config: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns the values of the config sections a stage depends on, by dotted key"""
+    return {key: _config_value(config, key) for key in stage.config_keys}
+
+
+def stage_key(stage: Stage, ctx: RunContext) -> str:
+    """Computes the cache key of a stage from its inputs, config sections and code version
+
+    Args:
+        stage: The stage to key
+        ctx: The run context holding the config and the digests of produced artifacts
+
+    Returns:
+        The hex digest identifying the stage's outputs
+    """
+    inputs = {}
+    for name in stage.inputs:
+        if name not in ctx.digests:
+            ctx.digests[name] = sc.digest_path(ctx.path(name))
+        inputs[name] = ctx.digests[name]
+    if stage.external_inputs is not None:
+        for name, path in stage.external_inputs(ctx).items():
+            inputs[name] = sc.digest_path(path)
+    return sc.digest_value({
+        'stage': stage.name,
+        'inputs': inputs,
+        'config': stage_config(stage, ctx.config),
+        'format': ctx.fmt,
+        'code': sc.digest_modules(stage.modules),
+        'runner': sc.digest_value(inspect.getsource(stage.run)),
+    })
+
+
+def load_state(run_dir: Path) -> Dict[str, Any]:
+    """Loads the record of completed stages of a run directory"""
+    state_path = Path(run_dir) / STATE_FILE
+    if not state_path.is_file():
+        return {}
+    with open(state_path, 'r') as f:
+        return json.load(f)
+
+
+def save_state(run_dir: Path, state: Dict[str, Any]) -> None:
+    """Saves the record of completed stages of a run directory"""
+    with open(Path(run_dir) / STATE_FILE, 'w') as f:
+        json.dump(state, f, indent=2)
+
+
+def run_stage(stage: Stage, ctx: RunContext, cache: Optional[sc.StageCache],
+              state: Dict[str, Any]) -> str:
+    """Runs a stage unless its outputs are already complete or cached
+
+    Args:
+        stage: The stage to run
+        ctx: The run context
+        cache: The stage cache, or None to always run the stage
+        state: The completed-stage record of the run directory; updated in place
+
+    Returns:
+        How the outputs were obtained: 'resumed', 'cached' or 'ran'
+    """
+    key = stage_key(stage, ctx)
+    outputs = {name: ctx.path(name) for name in stage.outputs}
+
+    done = state.get(stage.name)
+    if done and done['key'] == key and all(path.exists() for path in outputs.values()):
+        logger.info('Stage %s already complete in %s; skipping', stage.name, ctx.run_dir)
+        ctx.digests.update(done['digests'])
+        ctx.upload(outputs.values())
+        return 'resumed'
+
+    with _state_lock:
+        state.pop(stage.name, None)
+    if not stage.cacheable:
+        cache = None
+    digests = cache.restore(key, outputs) if cache is not None else None
+    if digests is not None:
+        logger.info('Stage %s served from cache (%s)', stage.name, key[:12])
+        status = 'cached'
+    else:
+        for path in outputs.values():
+            sc.remove_path(path)
+        logger.info('Running stage %s', stage.name)
+        stage.run(ctx)
+        ctx.flush(outputs.values())
+        if cache is not None:
+            digests = cache.store(key, outputs)
+        else:
+            digests = {name: sc.digest_path(path) for name, path in outputs.items()}
+        status = 'ran'
+
+    ctx.digests.update(digests)
+    ctx.upload(outputs.values())
+    with _state_lock:
+        state[stage.name] = {'key': key, 'digests': digests}
+        save_state(ctx.run_dir, state)
+    return status
+
+
+def adopt_stage(stage: Stage, source: RunContext, ctx: RunContext, state: Dict[str, Any]) -> None:
+    """Completes a stage in a run with the outputs it produced in another run
+
+    The outputs are hard-linked into the run directory and the in-memory results are
+    shared, so runs computing the same stage, e.g. those of a sweep, hold one copy.
+
+    Args:
+        stage: The stage completed in the source run
+        source: The run context in which the stage ran
+        ctx: The run context of the run adopting the outputs
+        state: The completed-stage record of ctx's run directory; updated in place
+    """
+    outputs = {name: ctx.path(name) for name in stage.outputs}
+    ctx.adopt(source, outputs)
+    key = stage_key(stage, ctx)
+    ctx.upload(outputs.values())
+    with _state_lock:
+        state[stage.name] = {'key': key, 'digests': {name: ctx.digests[name] for name in outputs}}
+        save_state(ctx.run_dir, state)
+
+
+def run_profiled(stage: Stage, ctx: RunContext, cache: Optional[sc.StageCache],
+                 state: Dict[str, Any], profile_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Runs a stage with run_stage and records the resources it used
+
+    Args:
+        stage: The stage to run
+        ctx: The run context
+        cache: The stage cache, or None to always run the stage
+        state: The completed-stage record of the run directory; updated in place
+        profile_path: If given, the stage runs under cProfile and its statistics are
+            saved to this path
+
+    Returns:
+        How the outputs were obtained, the time, CPU time and peak memory growth (see
+        src.profiling.measure), the rows of each DataFrame input and output, and the
+        bytes of outputs written
+    """
+    with prof.measure(profile_path) as measured:
+        status = run_stage(stage, ctx, cache, state)
+    record = {'status': status, **measured}
+    for key, names in (('rows_in', stage.inputs), ('rows_out', stage.outputs)):
+        rows = {name: ctx.rows(name) for name in names}
+        record[key] = {name: count for name, count in rows.items() if count is not None}
+    record['bytes_written'] = 0 if status == 'resumed' else sum(
+        prof.path_bytes(ctx.path(name)) for name in stage.outputs)
+    return record
+
+
+def acquire(ctx: RunContext) -> None:
+    """Acquires data from online repository and saves it to disk"""
+    import src.acquire_data as ad
+
+    run_config = ctx.config['run_config']
+    ad.acquire_data(run_config['data_source'], ctx.path('clouds.data'), run_config.get('download_cache'))
+
+
+def create_dataset(ctx: RunContext) -> None:
+    """Creates structured dataset from raw data; saves it to disk"""
+    if ctx.chunk_rows:
+        # Stream parsed chunks straight to the artifact without building the whole frame
+        with aio.FrameWriter(ctx.path('clouds'), ctx.fmt) as writer:
+            for chunk in cd.iter_dataset(ctx.path('clouds.data'), ctx.config['create_dataset'], ctx.chunk_rows):
+                writer.write(chunk)
+        return
+    data = cd.create_dataset(ctx.path('clouds.data'), ctx.config['create_dataset'])
+    ctx.write(ctx.path('clouds'), cd.save_dataset, data, ctx.path('clouds'), ctx.fmt)
+    ctx.keep('clouds', data)
+
+
+def feature_store(ctx: RunContext) -> Optional[fs.FeatureStore]:
+    """Returns the feature store of run_config.feature_store, or None if it is not set"""
+    root = ctx.config.get('run_config', {}).get('feature_store')
+    return fs.FeatureStore(root) if root else None
+
+
+def raw_checksum(ctx: RunContext) -> str:
+    """Returns the SHA-256 digest of the raw data of the run"""
+    return ctx.digests.get('clouds.data') or sc.digest_file(ctx.path('clouds.data'))
+
+
+def stored_features(ctx: RunContext) -> Optional[fs.FeatureSet]:
+    """Returns the stored features of this run's raw data, parsing and feature config, if any"""
+    store = feature_store(ctx)
+    if store is None or not ctx.path('clouds.data').is_file():
+        return None
+    return store.get(raw_checksum(ctx), ctx.config)
+
+
+def features_frame(ctx: RunContext) -> pd.DataFrame:
+    """Returns the features, memory-mapped from the feature store unless already in memory"""
+    if not ctx.has('features'):
+        stored = stored_features(ctx)
+        if stored is not None:
+            ctx.keep('features', stored.frame())
+    return ctx.frame('features')
+
+
+def generate_features(ctx: RunContext) -> None:
+    """Enriches dataset with features for model training; saves it to disk
+
+    With a feature store, features already generated from the same raw data, with the
+    same create_dataset and generate_features sections and code, are read from the store
+    instead, and new ones are stored.
+    """
+    config = ctx.config['generate_features']
+    stored = stored_features(ctx)
+    if stored is not None:
+        logger.info('Features read from the feature store (%s)', stored.path)
+        if ctx.fmt == 'npy':
+            sc.link_or_copy(stored.path, ctx.path('features'))
+        elif ctx.chunk_rows:
+            with aio.FrameWriter(ctx.path('features'), ctx.fmt) as writer:
+                for chunk in stored.iter_chunks(ctx.chunk_rows):
+                    writer.write(chunk)
+        else:
+            ctx.write(ctx.path('features'), gf.save_dataframe, stored.frame(), ctx.path('features'), ctx.fmt)
+        if not ctx.chunk_rows:
+            ctx.keep('features', stored.frame())
+        return
+
+    plan = gf.get_plan(config)
+    store = feature_store(ctx)
+    if ctx.chunk_rows:
+        with aio.FrameWriter(ctx.path('features'), ctx.fmt) as writer:
+            for chunk in aio.iter_frame(ctx.path('clouds'), ctx.chunk_rows, ctx.fmt):
+                writer.write(plan(chunk))
+        if store is not None:
+            store.put(raw_checksum(ctx), ctx.config, aio.iter_frame(ctx.path('features'), ctx.chunk_rows, ctx.fmt))
+        return
+    features = gf.generate_features(ctx.frame('clouds'), plan)
+    ctx.write(ctx.path('features'), gf.save_dataframe, features, ctx.path('features'), ctx.fmt)
+    if store is not None:
+        store.put(raw_checksum(ctx), ctx.config, features)
+    ctx.keep('features', features)
+
+
+def analysis(ctx: RunContext) -> None:
+    """Generates statistics and visualizations for summarizing the data; saves them to disk"""
+    import src.analysis as eda
+
+    figures = ctx.path('figures')
+    figures.mkdir()
+    eda.save_figures(features_frame(ctx), ctx.config['analysis'], figures)
+
+
+def base_models(ctx: RunContext) -> Dict[str, Path]:
+    """Returns the models directory that incremental training updates, if enabled
+
+    The directory is `train_model.incremental.base_models`, or by default the models of
+    the most recent earlier run whose train_model stage completed. For a timestamped run
+    directory, that is an earlier timestamped run in the same output directory; for a run
+    of a sweep, the run with the same name in an earlier sweep, since the other runs of
+    its own sweep train other configurations.
+    """
+    incremental = ctx.config['train_model'].get('incremental') or {}
+    if not incremental.get('enabled'):
+        return {}
+    if incremental.get('base_models'):
+        return {'base_models': Path(incremental['base_models'])}
+    parent = ctx.run_dir.parent
+    if parent.name.startswith('sweep-') and parent.name[len('sweep-'):].isdigit():
+        output, started = parent.parent, int(parent.name[len('sweep-'):])
+        runs = {int(p.name[len('sweep-'):]): p / ctx.run_dir.name for p in output.glob('sweep-*')
+                if p.name[len('sweep-'):].isdigit()}
+    else:
+        output, started = parent, int(ctx.run_dir.name) if ctx.run_dir.name.isdigit() else None
+        runs = {int(p.name): p for p in output.iterdir() if p.name.isdigit()}
+    earlier = [
+        (time, run) for time, run in runs.items()
+        if run != ctx.run_dir and (started is None or time <= started)
+        and (run / 'models').is_dir() and 'train_model' in load_state(run)
+    ]
+    if not earlier:
+        raise FileNotFoundError(f'No previous models to update in {output}')
+    return {'base_models': max(earlier)[1] / 'models'}
+
+
+def train_model(ctx: RunContext) -> None:
+    """Splits data into train/test set and trains the configured models; saves each to disk
+
+    With incremental training enabled, the previous version of each model absorbs the
+    data instead, and its metrics before and after the update are recorded.
+    """
+    import joblib
+    import src.train_model as tm
+
+    config = ctx.config['train_model']
+    base_dir = base_models(ctx).get('base_models')
+    if base_dir is None:
+        models, train, test, search_results = tm.train_model(features_frame(ctx), config)
+        versions = {name: {'version': 1, 'base': None, 'rows': len(train)} for name in models}
+    else:
+        logger.info('Updating the models in %s', base_dir)
+        previous = {path.stem: joblib.load(path) for path in sorted(base_dir.glob('*.pkl'))}
+        models, train, test, updates = tm.retrain_model(features_frame(ctx), previous, config)
+        search_results = pd.DataFrame(columns=tm.SEARCH_COLUMNS)
+        base_versions = tm.load_versions(base_dir / 'versions.yaml')
+        versions = {
+            name: {'version': base_versions.get(name, {}).get('version', 1) + 1,
+                   'base': str(base_dir), **update}
+            for name, update in updates.items()
+        }
+    ctx.write([ctx.path('train'), ctx.path('test')], tm.save_data, train, test, ctx.run_dir, ctx.fmt)
+    ctx.write(ctx.path('search_results.csv'), tm.save_search_results, search_results, ctx.path('search_results.csv'))
+    ctx.path('models').mkdir()
+    tm.save_versions(versions, ctx.path('models') / 'versions.yaml')
+    for name, model in models.items():
+        ctx.write(ctx.path('models') / f'{name}.pkl', tm.save_model, model, ctx.path('models') / f'{name}.pkl')
+        if hasattr(model, 'estimators_'):
+            # Forests are also saved as NumPy arrays, for serving without scikit-learn
+            fa.export_forest(model).save(ctx.path('models') / f'{name}.npz')
+    ctx.keep('test', test)
+    ctx.keep('models', models)
+
+
+def score_model(ctx: RunContext) -> None:
+    """Scores each model on test set; saves scores to disk"""
+    import src.score_model as sm
+
+    models = ctx.models()
+    ctx.path('scores').mkdir()
+    if ctx.chunk_rows:
+        # Write the scores of each chunk of the test set as soon as it is scored
+        for name, model in models.items():
+            chunks = aio.iter_frame(ctx.path('test'), ctx.chunk_rows, ctx.fmt)
+            with aio.FrameWriter(ctx.path('scores') / name, ctx.fmt) as writer:
+                for scores in sm.iter_scores(chunks, model, ctx.config['score_model']):
+                    writer.write(scores)
+        return
+    all_scores = {}
+    for name, model in models.items():
+        all_scores[name] = sm.score_model(ctx.frame('test'), model, ctx.config['score_model'])
+        # The scores of one model are written while the next one scores
+        ctx.write(aio.artifact_path(ctx.path('scores') / name, ctx.fmt),
+                  sm.save_scores, all_scores[name], ctx.path('scores') / name, ctx.fmt)
+    ctx.keep('scores', all_scores)
+
+
+def evaluate_performance(ctx: RunContext) -> None:
+    """Evaluates each model's performance metrics; saves metrics to disk"""
+    import src.evaluate_performance as ep
+
+    ctx.path('metrics').mkdir()
+    config = ctx.config['evaluate_performance']
+    if ctx.chunk_rows:
+        # Fold the scores into counts chunk by chunk instead of loading them whole
+        for name, model in ctx.models().items():
+            chunks = zip(aio.iter_frame(ctx.path('test'), ctx.chunk_rows, ctx.fmt),
+                         aio.iter_frame(aio.artifact_path(ctx.path('scores') / name, ctx.fmt),
+                                        ctx.chunk_rows, ctx.fmt))
+            accumulator = ep.accumulate_metrics(chunks, model.classes_, config)
+            ep.save_metrics(accumulator.result(), ctx.path('metrics') / f'{name}.yaml')
+        return
+    for name, scores in ctx.frames('scores').items():
+        metrics = ep.evaluate_performance(ctx.frame('test'), scores, config)
+        ep.save_metrics(metrics, ctx.path('metrics') / f'{name}.yaml')
+
+
+STAGES: List[Stage] = [
+    # The source can change under the same URL, so it is revalidated on every run; with a
+    # download cache an unchanged source costs one conditional request
+    Stage('acquire', acquire,
+          outputs=('clouds.data',),
+          config_keys=('run_config.data_source',),
+          modules=('src.acquire_data',),
+          cacheable=False),
+    Stage('create_dataset', create_dataset,
+          inputs=('clouds.data',), outputs=('clouds',),
+          config_keys=('create_dataset',),
+          modules=('src.create_dataset', 'src.artifact_io')),
+    Stage('generate_features', generate_features,
+          inputs=('clouds',), outputs=('features',),
+          config_keys=('generate_features',),
+          modules=('src.generate_features', 'src.artifact_io', 'src.feature_store')),
+    Stage('analysis', analysis,
+          inputs=('features',), outputs=('figures',),
+          config_keys=('analysis',),
+          modules=('src.analysis',)),
+    Stage('train_model', train_model,
+          inputs=('features',),
+          outputs=('train', 'test', 'models', 'search_results.csv'),
+          config_keys=('train_model',),
+          modules=('src.train_model', 'src.artifact_io', 'src.forest_arrays',
+                   'src.score_model', 'src.evaluate_performance'),
+          external_inputs=base_models),
+    Stage('score_model', score_model,
+          inputs=('test', 'models'), outputs=('scores',),
+          config_keys=('score_model',),
+          modules=('src.score_model', 'src.artifact_io')),
+    Stage('evaluate_performance', evaluate_performance,
+          inputs=('test', 'scores', 'models'), outputs=('metrics',),
+          config_keys=('evaluate_performance',),
+          modules=('src.evaluate_performance', 'src.artifact_io')),
+]
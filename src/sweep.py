@@ -0,0 +1,240 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import src.artifact_sink as asink
+import src.profiling as prof
+import src.scheduler as sch
+import src.stage_cache as sc
+import src.stages as st
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class SweepNode:
+    """A unit of work of a sweep
+
+    Either one stage computing the same outputs for several runs, which runs once in the
+    sweep process and is adopted by the other runs, or the stages only one run computes,
+    which run together in a worker process. For the scheduler (see src.scheduler.Node),
+    a node consumes the nodes it needs and produces itself.
+    """
+    name: str
+    stages: Tuple[str, ...]
+    # Indices of the runs whose outputs the node produces; the first one runs it
+    runs: Tuple[int, ...]
+    # Names of the nodes that must complete first
+    needs: Tuple[str, ...] = ()
+
+    @property
+    def shared(self) -> bool:
+        return len(self.runs) > 1
+
+    @property
+    def inputs(self) -> Tuple[str, ...]:
+        return self.needs
+
+    @property
+    def outputs(self) -> Tuple[str, ...]:
+        return (self.name,)
+
+
+def run_config(config: Dict[str, Any], sweep_dir: Path, label: str) -> Dict[str, Any]:
+    """Adapts the configuration of one run of a sweep to the sweep
+
+    The runs of a sweep upload at the same time, so each one uploads below its own
+    prefix, `<aws.prefix>/<sweep directory name>/<label>`, and syncs through its own
+    manifest, named after the configured or default manifest with the label appended.
+
+    Args:
+        config: The configuration of the run
+        sweep_dir: The sweep directory, holding the run directories
+        label: The name of the run, and of its run directory
+
+    Returns:
+        A copy of the configuration, with the aws section adapted
+    """
+    aws_config = dict(config.get('aws') or {})
+    aws_config['prefix'] = '/'.join(part for part in (
+        (aws_config.get('prefix') or '').strip('/'), sweep_dir.name, label) if part)
+    manifest = Path(aws_config.get('manifest') or sweep_dir / '.s3-manifest.json')
+    aws_config['manifest'] = str(manifest.with_name(f'{manifest.stem}-{label}{manifest.suffix}'))
+    return {**config, 'aws': aws_config}
+
+
+def stage_signatures(ctx: st.RunContext) -> Dict[str, str]:
+    """Identifies the outputs each stage would compute for a run, before anything runs
+
+    A stage's signature covers its config sections, the artifact format, the paths it
+    reads outside the run directory and the signatures of the stages producing its
+    inputs, so two runs with the same signature for a stage compute the same outputs.
+
+    Args:
+        ctx: The run context of the run
+
+    Returns:
+        The signature of each stage by name
+    """
+    graph = sch.dependencies(st.STAGES)
+    stages = {stage.name: stage for stage in st.STAGES}
+    signatures: Dict[str, str] = {}
+
+    def signature(name: str) -> str:
+        if name not in signatures:
+            stage = stages[name]
+            external = stage.external_inputs(ctx) if stage.external_inputs is not None else {}
+            signatures[name] = sc.digest_value({
+                'stage': name,
+                'config': st.stage_config(stage, ctx.config),
+                'format': ctx.fmt,
+                'external': {key: str(path) for key, path in external.items()},
+                'upstream': sorted(signature(upstream) for upstream in graph[name]),
+            })
+        return signatures[name]
+
+    for name in stages:
+        signature(name)
+    return signatures
+
+
+def plan_sweep(contexts: Sequence[st.RunContext]) -> List[SweepNode]:
+    """Combines the stage graphs of several runs into one graph of sweep nodes
+
+    Stages with the same signature in several runs become one shared node; the other
+    stages of each run are grouped into one node that depends on all of the run's shared
+    nodes.
+
+    Args:
+        contexts: The run context of each run
+
+    Returns:
+        The nodes of the sweep, shared nodes in stage order first
+    """
+    graph = sch.dependencies(st.STAGES)
+    signatures = [stage_signatures(ctx) for ctx in contexts]
+    nodes = []
+    node_names: Dict[str, str] = {}
+    own_stages: List[List[str]] = [[] for _ in contexts]
+    for stage in st.STAGES:
+        groups: Dict[str, List[int]] = {}
+        for index, run_signatures in enumerate(signatures):
+            groups.setdefault(run_signatures[stage.name], []).append(index)
+        for signature, runs in groups.items():
+            if len(runs) == 1:
+                own_stages[runs[0]].append(stage.name)
+                continue
+            # The upstream stages have the same signatures in every run of the group
+            needs = tuple(node_names[signatures[runs[0]][name]] for name in sorted(graph[stage.name]))
+            node_names[signature] = f'{stage.name}:{signature[:12]}'
+            nodes.append(SweepNode(node_names[signature], (stage.name,), tuple(runs), needs))
+
+    for index, names in enumerate(own_stages):
+        if names:
+            needs = tuple(node.name for node in nodes if index in node.runs)
+            nodes.append(SweepNode(f'run:{index}', tuple(names), (index,), needs))
+    return nodes
+
+
+def run_own_stages(run_dir: Path, config: Dict[str, Any], names: Sequence[str],
+                   cache_root: Optional[Path]) -> Dict[str, Dict[str, Any]]:
+    """Runs some stages of a run, e.g. in a worker process of a sweep
+
+    The stages read the artifacts of earlier stages from the run directory and run as
+    in the pipeline, up to run_config.stage_workers at a time. They do not upload their
+    outputs: the run's uploader, and with it its sync manifest, belongs to the caller.
+
+    Args:
+        run_dir: The run directory
+        config: The configuration of the run
+        names: The names of the stages to run
+        cache_root: The directory of the stage cache, or None to run every stage
+
+    Returns:
+        The record of each stage by name, see src.stages.run_profiled
+    """
+    sink = asink.open_sink(run_dir, {**config, 'aws': {**(config.get('aws') or {}), 'upload': False}})
+    ctx = st.RunContext(run_dir, config, sink)
+    cache = sc.StageCache(cache_root) if cache_root is not None else None
+    state = st.load_state(run_dir)
+    stages = [stage for stage in st.STAGES if stage.name in names]
+    records: Dict[str, Dict[str, Any]] = {}
+
+    def done(stage: st.Stage, record: Dict[str, Any], remaining: List[st.Stage]) -> None:
+        records[stage.name] = record
+        ctx.retain(name for later in remaining for name in later.inputs)
+
+    try:
+        sch.run_stages(stages, lambda stage: st.run_profiled(stage, ctx, cache, state),
+                       config.get('run_config', {}).get('stage_workers', 1), done)
+    finally:
+        sink.close()
+    return records
+
+
+def run_sweep(contexts: Sequence[st.RunContext], caches: Sequence[Optional[sc.StageCache]],
+              max_workers: int = 1) -> List[Dict[str, Dict[str, Any]]]:
+    """Runs the stages of several runs, computing each stage shared by runs only once
+
+    Shared stages run in this process, in threads like the stages of a single run, and
+    their results are kept in memory for the shared stages downstream. Each run adopts
+    the outputs of its shared stages, hard-linked into its own run directory. The stages
+    only one run computes then run in a worker process per run, which reads the shared
+    artifacts from its run directory. Their outputs are uploaded through the run's sink
+    once the worker is done, so each run has a single uploader and sync manifest. Each
+    run's profile.json records its stages; a stage adopted from another run has the
+    status 'shared'.
+
+    Args:
+        contexts: The run context of each run, each with its own run directory
+        caches: The stage cache of each run, or None entries to run every stage
+        max_workers: The most nodes, i.e. shared stages or worker processes, running at
+            the same time
+
+    Returns:
+        The stage records of each run, as saved to its profile.json
+    """
+    nodes = plan_sweep(contexts)
+    shared = sum(1 for node in nodes if node.shared)
+    logger.info('Sweep of %d runs: %d shared stages, %d runs with stages of their own',
+                len(contexts), shared, len(nodes) - shared)
+    states = [st.load_state(ctx.run_dir) for ctx in contexts]
+    profiles: List[Dict[str, Dict[str, Any]]] = [{} for _ in contexts]
+    stages = {stage.name: stage for stage in st.STAGES}
+
+    def run_shared(node: SweepNode) -> Dict[int, Dict[str, Dict[str, Any]]]:
+        stage = stages[node.stages[0]]
+        source, *others = node.runs
+        record = st.run_profiled(stage, contexts[source], caches[source], states[source])
+        records = {source: {stage.name: record}}
+        for index in others:
+            st.adopt_stage(stage, contexts[source], contexts[index], states[index])
+            records[index] = {stage.name: {**record, 'status': 'shared', 'source': str(contexts[source].run_dir)}}
+        return records
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max(max_workers, 1), mp_context=context) as pool:
+
+        def run(node: SweepNode) -> Dict[int, Dict[str, Dict[str, Any]]]:
+            if node.shared:
+                return run_shared(node)
+            index = node.runs[0]
+            ctx, cache = contexts[index], caches[index]
+            future = pool.submit(run_own_stages, ctx.run_dir, ctx.config, node.stages,
+                                 cache.root if cache is not None else None)
+            # The worker reads the shared artifacts from disk
+            ctx.retain(())
+            records = future.result()
+            ctx.upload(ctx.path(name) for stage in node.stages for name in stages[stage].outputs)
+            return {index: records}
+
+        def done(node: SweepNode, records: Dict[int, Dict[str, Dict[str, Any]]], remaining: list) -> None:
+            for index, run_records in records.items():
+                profiles[index].update(run_records)
+                prof.save_profile(profiles[index], contexts[index].run_dir / prof.PROFILE_FILE)
+
+        sch.run_stages(nodes, run, max_workers, done)
+    return profiles
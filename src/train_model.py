@@ -1,32 +1,272 @@
+import copy
+import json
 import logging
-import pickle
+import math
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Tuple, Dict, Any
+from typing import Tuple, Dict, Any, List
 
+import joblib
+import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
+import yaml
+from joblib import Parallel, delayed
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import ParameterGrid, ParameterSampler, train_test_split
 from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+
+import src.artifact_io as aio
+import src.evaluate_performance as ep
+import src.score_model as sm
 
 # Set up logging
 logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
 
 
+# Columns of the search results artifact; `params` holds each candidate's parameters as JSON
+SEARCH_COLUMNS = ['model', 'candidate', 'rung', 'n_estimators', 'n_samples', 'params', 'score']
+
+# Model classes a model spec can name
+MODELS = {
+    'RandomForestClassifier': RandomForestClassifier,
+    'LogisticRegression': LogisticRegression,
+    'SGDClassifier': SGDClassifier,
+}
+
+
+def _candidates(search: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Returns the parameter sets to search: the whole grid, or `n_candidates` samples of it"""
+    if search.get('n_candidates'):
+        return list(ParameterSampler(
+            search['param_grid'], n_iter=search['n_candidates'], random_state=search.get('random_state')))
+    return list(ParameterGrid(search['param_grid']))
+
+
+def _fit_and_score(model: RandomForestClassifier, resource: str, amount: int,
+                   fit_features: pd.DataFrame, fit_target: pd.Series,
+                   val_features: pd.DataFrame, val_target: pd.Series, scoring: str) -> float:
+    """Trains a candidate with `amount` of the resource and scores it on the validation set"""
+    if resource == 'n_estimators':
+        # With warm_start, only the trees beyond those of the previous rung are fitted
+        model.set_params(n_estimators=amount)
+        model.fit(fit_features, fit_target)
+    else:
+        model.fit(fit_features.iloc[:amount], fit_target.iloc[:amount])
+    return get_scorer(scoring)(model, val_features, val_target)
+
+
+def search_model(features: pd.DataFrame, target: pd.Series,
+                 config: Dict[str, Any]) -> Tuple[RandomForestClassifier, pd.DataFrame]:
+    """Searches random forest parameters with successive halving
+
+    A validation set is held out of the training data. Every candidate is trained with
+    a small amount of the resource (trees, or training rows) and scored; the best
+    `1 / factor` of them advance to the next rung with `factor` times as much, until the
+    full amount is reached. When the resource is the number of trees, candidates keep
+    their trees between rungs (`warm_start`) and only grow new ones. Candidates of a rung
+    are trained in parallel threads, since tree building releases the GIL.
+
+    Args:
+        features: The training features
+        target: The training target
+        config: The train_model configuration; its `search` section holds the
+            `param_grid`, the `resource`, `factor`, `min_resource`, `validation_size`,
+            `scoring`, `n_candidates`, `random_state`, `refit` and `n_jobs` settings
+
+    Returns:
+        The best model, refitted on all of `features` unless `refit` is False, and the
+        score of every candidate at every rung it reached
+    """
+    search = config['search']
+    resource = search.get('resource', 'n_estimators')
+    factor = search.get('factor', 3)
+    scoring = search.get('scoring', 'roc_auc')
+    random_state = search.get('random_state')
+    n_jobs = search.get('n_jobs', -1)
+    if resource not in ('n_estimators', 'n_samples'):
+        raise ValueError(f'Search resource must be n_estimators or n_samples, got {resource}')
+    if resource in search['param_grid']:
+        raise ValueError(f'{resource} is the search resource and cannot be searched over')
+
+    fit_features, val_features, fit_target, val_target = train_test_split(
+        features, target, test_size=search.get('validation_size', 0.25),
+        random_state=random_state, stratify=target)
+
+    candidates = _candidates(search)
+    max_resource = config['n_estimators'] if resource == 'n_estimators' else len(fit_features)
+    n_rungs = math.ceil(math.log(len(candidates), factor)) if len(candidates) > 1 else 0
+    amount = max(search.get('min_resource') or 1, max_resource // factor ** n_rungs, 1)
+
+    base = {'n_estimators': config['n_estimators'], 'max_depth': config['max_depth'],
+            'random_state': random_state, 'warm_start': resource == 'n_estimators'}
+    models = [RandomForestClassifier(**{**base, **params}) for params in candidates]
+
+    rows = []
+    alive = list(range(len(candidates)))
+    rung = 0
+    with Parallel(n_jobs=n_jobs, backend='threading') as parallel:
+        while True:
+            amount = min(amount, max_resource)
+            logging.info('Search rung %d: %d candidates with %s=%d', rung, len(alive), resource, amount)
+            scores = parallel(
+                delayed(_fit_and_score)(models[i], resource, amount, fit_features, fit_target,
+                                        val_features, val_target, scoring)
+                for i in alive)
+            for i, score in zip(alive, scores):
+                rows.append({
+                    'candidate': i, 'rung': rung,
+                    'n_estimators': amount if resource == 'n_estimators' else config['n_estimators'],
+                    'n_samples': amount if resource == 'n_samples' else len(fit_features),
+                    'params': json.dumps(candidates[i], sort_keys=True), 'score': score,
+                })
+            # Candidates are ranked by score; ties go to the earlier candidate
+            ranked = [alive[j] for j in np.argsort(-np.asarray(scores), kind='stable')]
+            if amount >= max_resource:
+                break
+            alive = ranked[:max(1, math.ceil(len(alive) / factor))]
+            # A last remaining candidate goes straight to the full resource
+            amount = max_resource if len(alive) == 1 else amount * factor
+            rung += 1
+
+    best = ranked[0]
+    logging.info('Best candidate %d: %s', best, candidates[best])
+    if search.get('refit', True):
+        model = RandomForestClassifier(**{**base, **candidates[best], 'warm_start': False,
+                                          'n_jobs': config.get('n_jobs')})
+        model.fit(features, target)
+    else:
+        model = models[best]
+        model.set_params(warm_start=False)
+    return model, pd.DataFrame(rows, columns=SEARCH_COLUMNS)
+
+
+def model_specs(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Returns the specs of the models to train
+
+    Each spec has a `name`, a `model` class name from MODELS, its `params` and an
+    optional `search` section. Random forests default to the `n_estimators`,
+    `max_depth`, `n_jobs` and `search` settings of the config, which the spec's own
+    `params` and `search` override. Without a `models` list, only that random forest
+    is trained.
+
+    Args:
+        config: The dictionary containing the configuration parameters
+
+    Returns:
+        The model specs, in config order
+    """
+    specs = []
+    for spec in config.get('models') or [{'name': 'random_forest', 'model': 'RandomForestClassifier'}]:
+        if spec['model'] not in MODELS:
+            raise ValueError(f"Unknown model {spec['model']}; expected one of {list(MODELS)}")
+        params = dict(spec.get('params') or {})
+        search = spec.get('search')
+        if spec['model'] == 'RandomForestClassifier':
+            params = {'n_estimators': config['n_estimators'], 'max_depth': config['max_depth'],
+                      'n_jobs': config.get('n_jobs'), **params}
+            search = search if 'search' in spec else config.get('search')
+        specs.append({'name': spec['name'], 'model': spec['model'], 'params': params, 'search': search})
+    return specs
+
+
+def fit_model(spec: Dict[str, Any], features: pd.DataFrame,
+              target: pd.Series) -> Tuple[Any, pd.DataFrame]:
+    """Trains the model of a spec, searching its parameters if the spec enables a search
+
+    Args:
+        spec: The model spec
+        features: The training features
+        target: The training target
+
+    Returns:
+        The trained model and its search results (empty without a search)
+    """
+    search = spec.get('search') or {}
+    params = spec.get('params', {})
+    if search.get('enabled', False):
+        if spec['model'] != 'RandomForestClassifier':
+            raise ValueError(f"Search is only supported for random forests, not {spec['model']}")
+        logging.info('Searching parameters of model %s', spec['name'])
+        model, results = search_model(features, target, {
+            'n_estimators': params.get('n_estimators', 100), 'max_depth': params.get('max_depth'),
+            'n_jobs': params.get('n_jobs'), 'search': search})
+        results['model'] = spec['name']
+        return model, results
+    logging.info('Training model %s', spec['name'])
+    model = MODELS[spec['model']](**params)
+    model.fit(features, target)
+    return model, pd.DataFrame(columns=SEARCH_COLUMNS)
+
+
+def _fit_shared(spec: Dict[str, Any], features_path: str, target_path: str,
+                columns: List[str]) -> Tuple[Any, pd.DataFrame]:
+    """Trains a model in a worker process from the memory-mapped training matrix"""
+    features = pd.DataFrame(np.load(features_path, mmap_mode='r'), columns=columns, copy=False)
+    target = pd.Series(np.load(target_path, mmap_mode='r'), copy=False)
+    return fit_model(spec, features, target)
+
+
+def train_models(features: pd.DataFrame, target: pd.Series, specs: List[Dict[str, Any]],
+                 n_workers: int = 1) -> Tuple[Dict[str, Any], pd.DataFrame]:
+    """Trains several models at the same time in a process pool
+
+    The training matrix is written once to .npy files that every worker memory-maps, so
+    the workers share its pages instead of each receiving a pickled copy.
+
+    Args:
+        features: The training features
+        target: The training target
+        specs: The model specs, see model_specs
+        n_workers: The number of worker processes (-1 for one per core)
+
+    Returns:
+        The trained models by name, in spec order, and their combined search results
+    """
+    n_workers = os.cpu_count() if n_workers in (None, -1) else n_workers
+    n_workers = min(n_workers, len(specs))
+    if n_workers <= 1:
+        fitted = [fit_model(spec, features, target) for spec in specs]
+    else:
+        with tempfile.TemporaryDirectory(prefix='train-') as shared:
+            features_path = os.path.join(shared, 'features.npy')
+            target_path = os.path.join(shared, 'target.npy')
+            np.save(features_path, features.to_numpy(dtype=np.float64))
+            np.save(target_path, target.to_numpy())
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=n_workers, mp_context=context) as pool:
+                futures = [
+                    pool.submit(_fit_shared, spec, features_path, target_path, list(features.columns))
+                    for spec in specs
+                ]
+                fitted = [future.result() for future in futures]
+
+    models = {spec['name']: model for spec, (model, _) in zip(specs, fitted)}
+    results = [result for _, result in fitted if not result.empty]
+    search_results = pd.concat(results, ignore_index=True) if results else pd.DataFrame(columns=SEARCH_COLUMNS)
+    return models, search_results
+
+
 def train_model(
     data: pd.DataFrame, config: Dict[str, Any]
-) -> Tuple[RandomForestClassifier, pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-    """Trains a random forest classifier on specified features and target labels
+) -> Tuple[Dict[str, Any], pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Trains the configured models on specified features and target labels
 
     Args:
         data: The pandas dataframe containing the data for training
-        config: The dictionary containing the configuration parameters
+        config: The dictionary containing the configuration parameters; `models` lists
+            the model specs (see model_specs) and `n_workers` the number of models
+            trained at the same time (-1 for one per core)
 
     Returns:
-        The trained random forest classifier, train features, test features, train target, and test target
+        The trained models by name, the train data, the test data and the search
+        results (empty without a search)
     """
     initial_features = config['initial_features']
-    n_estimators = config['n_estimators']
-    max_depth = config['max_depth']
     test_size = config['test_size']
     random_state = config['train_test_split']['random_state']
 
@@ -39,11 +279,9 @@ def train_model(
         train_features, test_features, train_target, test_target = train_test_split(
             features, target, test_size=test_size, random_state=random_state)
 
-        # Train the model
-        logging.info('Training the model')
-        rf_classifier = RandomForestClassifier(
-            n_estimators=n_estimators, max_depth=max_depth)
-        rf_classifier.fit(train_features, train_target)
+        # Train the models
+        models, search_results = train_models(
+            train_features, train_target, model_specs(config), config.get('n_workers', 1))
     except Exception as e:
         logging.error('Failed to train model: %s', e)
         raise
@@ -53,38 +291,183 @@ def train_model(
     test_data = test_features.copy()
     test_data[config['target_name']] = test_target
 
-    return rf_classifier, train_data, test_data
+    return models, train_data, test_data, search_results
+
 
+def update_model(model: Any, features: pd.DataFrame, target: pd.Series,
+                 config: Dict[str, Any]) -> Any:
+    """Absorbs a new batch of rows into a copy of a trained model
 
-def save_data(train: pd.DataFrame, test: pd.DataFrame, save_dir: Path) -> None:
+    Forests grow `n_estimators` new trees on the batch with `warm_start` and keep their
+    existing trees. Models with `partial_fit` take one more pass over the batch, and
+    other models with `warm_start` (e.g. LogisticRegression) refit on the batch starting
+    from their current coefficients.
+
+    Args:
+        model: The trained model; it is not modified
+        features: The new batch's features
+        target: The new batch's target
+        config: The `incremental` section of the train_model config
+
+    Returns:
+        The updated model
+    """
+    if set(np.unique(target)) != set(model.classes_):
+        raise ValueError(f'A batch must hold every class of the model {list(model.classes_)}, '
+                         f'got {sorted(np.unique(target))}')
+    model = copy.deepcopy(model)
+    if hasattr(model, 'estimators_'):
+        model.set_params(warm_start=True,
+                         n_estimators=len(model.estimators_) + config.get('n_estimators', 10))
+        model.fit(features, target)
+        model.set_params(warm_start=False)
+    elif hasattr(model, 'partial_fit'):
+        model.partial_fit(features, target, classes=model.classes_)
+    elif 'warm_start' in model.get_params():
+        model.set_params(warm_start=True)
+        model.fit(features, target)
+        model.set_params(warm_start=False)
+    else:
+        raise ValueError(f'{type(model).__name__} cannot be trained incrementally')
+    return model
+
+
+def retrain_model(
+    data: pd.DataFrame, base_models: Dict[str, Any], config: Dict[str, Any]
+) -> Tuple[Dict[str, Any], pd.DataFrame, pd.DataFrame, Dict[str, Dict[str, Any]]]:
+    """Updates previously trained models with a new batch of rows
+
+    The batch is split into train and test data as in train_model; every base model
+    absorbs the train rows (see update_model) and both versions are evaluated on the
+    test rows.
+
+    Args:
+        data: The pandas dataframe containing the new batch
+        base_models: The previously trained models by name
+        config: The dictionary containing the configuration parameters; the
+            `incremental` section configures update_model
+
+    Returns:
+        The updated models by name, the train data, the test data and, per model, its
+        `before` and `after` metrics and the number of `rows` absorbed
+    """
+    initial_features = config['initial_features']
+    target_name = config['target_name']
+    train_features, test_features, train_target, test_target = train_test_split(
+        data[initial_features], data[target_name], test_size=config['test_size'],
+        random_state=config['train_test_split']['random_state'])
+    test_data = test_features.copy()
+    test_data[target_name] = test_target
+
+    models, updates = {}, {}
+    try:
+        for spec in model_specs(config):
+            name = spec['name']
+            if name not in base_models:
+                raise ValueError(f'No previous version of model {name} to update')
+            logging.info('Updating model %s with %d rows', name, len(train_features))
+            models[name] = update_model(
+                base_models[name], train_features, train_target, config.get('incremental') or {})
+            updates[name] = {
+                'rows': len(train_features),
+                'before': ep.evaluate_performance(
+                    test_data, sm.predict_scores(base_models[name], test_features), config),
+                'after': ep.evaluate_performance(
+                    test_data, sm.predict_scores(models[name], test_features), config),
+            }
+    except Exception as e:
+        logging.error('Failed to update model: %s', e)
+        raise
+
+    train_data = train_features.copy()
+    train_data[target_name] = train_target
+    return models, train_data, test_data, updates
+
+
+def save_data(train: pd.DataFrame, test: pd.DataFrame, save_dir: Path, fmt: str = 'csv') -> Tuple[Path, Path]:
     """Saves train and test DataFrames to specified directory.
 
     Args:
         train: The train DataFrame to be saved
         test: The test DataFrame to be saved
         save_dir: The directory in which to save the DataFrames
+        fmt: The artifact format, one of csv, parquet, feather or npy
+
+    Returns:
+        The paths the train and test DataFrames were saved to
     """
     try:
         logging.info('Saving train and test data')
         save_dir.mkdir(parents=True, exist_ok=True)
-        train.to_csv(save_dir / 'train.csv', index=False)
-        test.to_csv(save_dir / 'test.csv', index=False)
+        train_path = aio.write_frame(train, save_dir / 'train', fmt)
+        test_path = aio.write_frame(test, save_dir / 'test', fmt)
     except Exception as e:
         logging.error('Failed to save data: %s', e)
         raise
 
+    return train_path, test_path
+
+
+def save_search_results(results: pd.DataFrame, save_path: Path) -> None:
+    """Saves the search results to a CSV file.
+
+    Args:
+        results: The search results from search_model
+        save_path: The path where the search results will be saved
+    """
+    try:
+        logging.info('Saving search results')
+        results.to_csv(save_path, index=False)
+    except Exception as e:
+        logging.error('Failed to save search results: %s', e)
+        raise
+
+
+def load_versions(load_path: Path) -> Dict[str, Dict[str, Any]]:
+    """Loads the model version records saved by save_versions, if any
+
+    Args:
+        load_path: The path of the version records
+
+    Returns:
+        The version record of each model by name; empty when the file does not exist
+    """
+    if not Path(load_path).is_file():
+        return {}
+    with open(load_path, 'r') as f:
+        return yaml.safe_load(f) or {}
+
+
+def save_versions(versions: Dict[str, Dict[str, Any]], save_path: Path) -> None:
+    """Saves the version record of each model in YAML format.
+
+    Args:
+        versions: The version record of each model by name
+        save_path: The path where the version records will be saved
+    """
+    try:
+        logging.info('Saving model versions')
+        with open(save_path, 'w') as f:
+            yaml.dump(versions, f)
+    except Exception as e:
+        logging.error('Failed to save model versions: %s', e)
+        raise
+
 
 def save_model(model: RandomForestClassifier, save_path: Path) -> None:
     """Saves a trained model to a specified file.
 
+    The model is saved with joblib, which stores its NumPy arrays as raw buffers, so it
+    can be loaded with `joblib.load(save_path, mmap_mode='r')` and its arrays shared by
+    every process that loads it.
+
     Args:
         model: The trained model to be saved
         save_path: The path where the trained model will be saved
     """
     try:
         logging.info('Saving model')
-        with open(save_path, 'wb') as f:
-            pickle.dump(model, f)
+        joblib.dump(model, save_path)
         logging.info('Model saved successfully')
     except Exception as e:
         logging.error('Failed to save model: %s', e)
@@ -0,0 +1,104 @@
+import gzip
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import src.acquire_data as ad
+
+PAYLOAD = bytes(range(256)) * 4096  # 1 MiB
+ETAG = '"v1"'
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves PAYLOAD with an ETag and Range support; `fail_after` cuts responses short
+
+    With `gzip` set to 'negotiated', the body is gzip-encoded for clients accepting it,
+    and with 'always', for every client; ranges then apply to the encoded body.
+    """
+    requests = []
+    fail_after = None
+    gzip = None
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        type(self).requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        payload = PAYLOAD
+        if type(self).gzip == 'always' or (
+                type(self).gzip == 'negotiated' and 'gzip' in self.headers.get('Accept-Encoding', '')):
+            payload = gzip.compress(PAYLOAD, mtime=0)
+        start = 0
+        byte_range = self.headers.get('Range')
+        if byte_range and self.headers.get('If-Range', ETAG) == ETAG:
+            start = int(byte_range.split('=')[1].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(payload) - 1}/{len(payload)}')
+        else:
+            self.send_response(200)
+        body = payload[start:]
+        if payload is not PAYLOAD:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if type(self).fail_after is not None:
+            body, type(self).fail_after = body[:type(self).fail_after], None
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def url():
+    Handler.requests, Handler.fail_after, Handler.gzip = [], None, None
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/cloud.data'
+    server.shutdown()
+    server.server_close()
+
+
+# Test 1: an interrupted download resumes from the bytes already written
+def test_download_resumes_with_range(url, tmp_path):
+    Handler.fail_after = 300_000
+    save_path = tmp_path / 'cloud.data'
+    metadata = ad.download(url, save_path, wait=0, chunk_size=1 << 16)
+
+    assert save_path.read_bytes() == PAYLOAD
+    assert metadata['sha256'] == hashlib.sha256(PAYLOAD).hexdigest()
+    # Only whole chunks reach the disk: the four before the cut
+    assert [r.get('Range') for r in Handler.requests] == [None, 'bytes=262144-']
+    assert not (tmp_path / 'cloud.data.part').exists()
+
+
+# Test 2: an unchanged source costs one conditional request and no body
+def test_acquire_data_uses_download_cache(url, tmp_path):
+    cache_dir = tmp_path / 'downloads'
+    first = ad.acquire_data(url, tmp_path / 'first.data', cache_dir=cache_dir)
+    second = ad.acquire_data(url, tmp_path / 'second.data', cache_dir=cache_dir)
+
+    assert first == second == hashlib.sha256(PAYLOAD).hexdigest()
+    assert (tmp_path / 'second.data').read_bytes() == PAYLOAD
+    assert len(Handler.requests) == 2
+    assert Handler.requests[1]['If-None-Match'] == ETAG
+
+
+# Test 3: a download from a server that gzip-encodes bodies resumes at the right offset
+@pytest.mark.parametrize('encoding', ['negotiated', 'always'])
+def test_download_resumes_gzip_encoded(url, tmp_path, encoding):
+    Handler.gzip, Handler.fail_after = encoding, 2000
+    save_path = tmp_path / 'cloud.data'
+    metadata = ad.download(url, save_path, wait=0, chunk_size=1024)
+
+    assert save_path.read_bytes() == PAYLOAD
+    assert metadata['sha256'] == hashlib.sha256(PAYLOAD).hexdigest()
+    assert all(r['Accept-Encoding'] == 'identity' for r in Handler.requests)
+    # A body encoded against the client's wishes cannot be resumed by range
+    expected = 'bytes=1024-' if encoding == 'negotiated' else None
+    assert [r.get('Range') for r in Handler.requests] == [None, expected]
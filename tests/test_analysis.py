@@ -0,0 +1,62 @@
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+import src.analysis as eda
+
+features = pd.DataFrame({
+    'IR_mean': np.arange(20, dtype=float),
+    'log_entropy': np.linspace(-1, 1, 20),
+    'class': [0.0, 1.0] * 10
+})
+
+# Test 1: only the configured features are plotted, named by their column index
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_save_figures_selected_features(tmp_path, n_jobs):
+    config = {'target_name': 'class', 'features': ['log_entropy', 'class'], 'n_jobs': n_jobs}
+    paths = eda.save_figures(features, config, tmp_path)
+    assert paths == [tmp_path / 'histogram_1.png', tmp_path / 'histogram_2.png']
+    assert all(path.stat().st_size > 0 for path in paths)
+
+# Test 2: rendering does not leave figures open in pyplot
+def test_save_figures_closes_figures(tmp_path):
+    before = plt.get_fignums()
+    eda.save_figures(features, {'target_name': 'class'}, tmp_path)
+    assert plt.get_fignums() == before
+    assert len(list(tmp_path.glob('*.png'))) == 3
+
+# Test 3: one-pass histograms match np.histogram over the same shared bin edges
+def test_compute_histograms_matches_numpy(tmp_path):
+    data = features.copy()
+    data.loc[3, 'log_entropy'] = np.nan
+    histograms = eda.compute_histograms(data, 'class', ['IR_mean', 'log_entropy'], bins=4)
+    for i, column in enumerate(histograms['columns']):
+        values = data[column].to_numpy()
+        finite = np.isfinite(values)
+        for k, label in enumerate([0.0, 1.0]):
+            counts, edges = np.histogram(
+                values[finite & (data['class'] == label)], bins=4,
+                range=(values[finite].min(), values[finite].max()))
+            assert np.allclose(histograms['edges'][i], edges)
+            assert np.array_equal(histograms['counts'][i, k], counts)
+
+    eda.save_histograms(histograms, tmp_path / 'histograms.json')
+    loaded = eda.load_histograms(tmp_path / 'histograms.json')
+    assert np.array_equal(loaded['counts'], histograms['counts'])
+
+# Test 4: values on bin edges, e.g. of quantized data, are binned like np.histogram
+@pytest.mark.parametrize('bins', [3, 10, 20])
+def test_compute_histograms_edge_values(bins):
+    rng = np.random.default_rng(1)
+    scale, offset = rng.integers(3, 30, 40), np.round(rng.random(40) * 5) / 10
+    data = pd.DataFrame(np.round(rng.random((200, 40)) * scale) / 10 + offset,
+                        columns=[f'f{i}' for i in range(40)])
+    data['class'] = rng.integers(0, 2, 200).astype(float)
+    histograms = eda.compute_histograms(data, 'class', list(data.columns[:-1]), bins=bins)
+    for i, column in enumerate(histograms['columns']):
+        values = data[column].to_numpy()
+        for k, label in enumerate([0.0, 1.0]):
+            counts, edges = np.histogram(values[data['class'] == label], bins=bins,
+                                         range=(values.min(), values.max()))
+            np.testing.assert_array_equal(histograms['edges'][i], edges)
+            np.testing.assert_array_equal(histograms['counts'][i, k], counts)
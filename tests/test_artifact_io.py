@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+import src.artifact_io as aio
+
+data = pd.DataFrame({
+    'IR_mean': [50.0, 100.0, 150.0],
+    'log_entropy': np.log([1.2, 2.2, 3.2]),
+    'class': [0.0, 1.0, 1.0]
+}, index=[7, 3, 5])
+
+# Test 1: every format round-trips the values and column order, without the index
+@pytest.mark.parametrize('fmt', list(aio.SUFFIXES))
+def test_round_trip(tmp_path, fmt):
+    path = aio.write_frame(data, tmp_path / 'features.csv', fmt)
+    assert path.name == 'features' + aio.SUFFIXES[fmt]
+    assert aio.infer_format(path) == fmt
+    loaded = aio.read_frame(path)
+    pd.testing.assert_frame_equal(loaded, data.reset_index(drop=True), check_column_type=False)
+
+# Test 2: memory-mapped reads return read-only views instead of copies
+@pytest.mark.parametrize('fmt', ['feather', 'npy'])
+def test_mmap_read_is_read_only(tmp_path, fmt):
+    path = aio.write_frame(data, tmp_path / 'features', fmt)
+    loaded = aio.read_frame(path, mmap=True)
+    assert not loaded['IR_mean'].to_numpy().flags.writeable
+
+# Test 3: unhappy test where the format is not supported
+def test_unsupported_format(tmp_path):
+    with pytest.raises(ValueError):
+        aio.write_frame(data, tmp_path / 'features', 'xlsx')
+
+# Test 4: chunks appended with FrameWriter read back whole or in fixed-size chunks
+@pytest.mark.parametrize('fmt', list(aio.SUFFIXES))
+def test_frame_writer_and_iter_frame(tmp_path, fmt):
+    with aio.FrameWriter(tmp_path / 'features', fmt) as writer:
+        writer.write(data.iloc[:2])
+        writer.write(data.iloc[2:])
+    assert writer.rows == 3
+    expected = data.reset_index(drop=True)
+    assert np.array_equal(aio.read_frame(writer.path).to_numpy(), expected.to_numpy())
+    chunks = list(aio.iter_frame(writer.path, 2))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), expected, check_column_type=False)
+
+# Test 5: row counts are read from the artifact without loading its values
+@pytest.mark.parametrize('fmt', list(aio.SUFFIXES))
+def test_count_rows(tmp_path, fmt):
+    with aio.FrameWriter(tmp_path / 'features', fmt) as writer:
+        writer.write(data)
+        writer.write(data.iloc[:2])
+    assert aio.count_rows(writer.path) == 5
+
+# Test 6: a block that raises while writing chunks leaves no partial artifact behind
+@pytest.mark.parametrize('fmt', list(aio.SUFFIXES))
+def test_frame_writer_discards_partial_artifact(tmp_path, fmt):
+    with pytest.raises(RuntimeError):
+        with aio.FrameWriter(tmp_path / 'features', fmt) as writer:
+            writer.write(data)
+            raise RuntimeError('chunk failed')
+    assert not writer.path.exists()
+    assert list(tmp_path.iterdir()) == []
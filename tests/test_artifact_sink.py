@@ -0,0 +1,67 @@
+import threading
+
+import boto3
+import pytest
+
+import src.artifact_sink as asink
+import src.aws_utils as aws
+
+moto = pytest.importorskip('moto')
+
+BUCKET = 'test-bucket'
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+# Test 1: artifacts are written in the background and uploaded as soon as each is written
+def test_write_then_upload(s3_client, tmp_path):
+    uploader = aws.S3Uploader(s3_client, tmp_path, BUCKET, prefix='run', manifest_path=tmp_path.parent / 'manifest.json')
+    sink = asink.ArtifactSink(max_workers=2, uploader=uploader)
+    release = threading.Event()
+
+    def slow_write(path, text):
+        release.wait()
+        path.write_text(text)
+
+    sink.write(tmp_path / 'train.csv', slow_write, tmp_path / 'train.csv', 'a\n1\n')
+    sink.write(tmp_path / 'test.csv', (tmp_path / 'test.csv').write_text, 'a\n2\n')
+    sink.flush([tmp_path / 'test.csv'])
+    uploader.submit(tmp_path / 'test.csv').result()
+    # The test data is already in the bucket while the train data is still being written
+    assert not (tmp_path / 'train.csv').exists()
+    assert s3_client.get_object(Bucket=BUCKET, Key='run/test.csv')['Body'].read() == b'a\n2\n'
+
+    release.set()
+    (tmp_path / 'metrics').mkdir()
+    (tmp_path / 'metrics' / 'model.yaml').write_text('auc: 0.9\n')
+    sink.upload(tmp_path / 'metrics')
+    sink.close()
+    keys = {obj['Key'] for obj in s3_client.list_objects_v2(Bucket=BUCKET)['Contents']}
+    assert keys == {'run/train.csv', 'run/test.csv', 'run/metrics/model.yaml'}
+    assert set(aws.load_manifest(tmp_path.parent / 'manifest.json')) == {f's3://{BUCKET}/{key}' for key in keys}
+
+
+# Test 2: a failed write fails the flush of its artifact and is reported when the sink closes
+def test_write_errors(tmp_path):
+    sink = asink.ArtifactSink()
+
+    def fail():
+        raise OSError('disk full')
+
+    sink.write(tmp_path / 'scores', fail)
+    sink.write(tmp_path / 'metrics.yaml', (tmp_path / 'metrics.yaml').write_text, 'auc: 0.9\n')
+    sink.flush([tmp_path / 'metrics.yaml'])
+    with pytest.raises(OSError, match='disk full'):
+        sink.flush([tmp_path])
+    with pytest.raises(asink.ArtifactSinkError) as error:
+        sink.close()
+    assert list(error.value.errors) == [str(tmp_path / 'scores')]
@@ -0,0 +1,133 @@
+import boto3
+import pytest
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+import src.aws_utils as aws
+
+moto = pytest.importorskip('moto')
+
+BUCKET = 'test-bucket'
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def make_artifacts(base_dir):
+    (base_dir / 'figures').mkdir(parents=True)
+    for i in range(20):
+        (base_dir / 'figures' / f'histogram_{i}.png').write_bytes(bytes([i]) * 100)
+    (base_dir / 'features.csv').write_bytes(b'a,b\n' + b'1,2\n' * 1_600_000)
+
+
+# Test 1: concurrent multipart uploads put every file under the prefix and return their URIs
+def test_upload_files_recursive_concurrent(s3_client, tmp_path):
+    make_artifacts(tmp_path)
+    config = TransferConfig(multipart_threshold=5 * aws.MB, multipart_chunksize=5 * aws.MB)
+    uris = aws.upload_files_recursive(s3_client, tmp_path, BUCKET, prefix='experiments/',
+                                      max_workers=4, config=config)
+
+    files = sorted(p for p in tmp_path.rglob('*') if p.is_file())
+    keys = ['experiments/' + p.relative_to(tmp_path).as_posix() for p in files]
+    assert uris == [f's3://{BUCKET}/{key}' for key in keys]
+    for path, key in zip(files, keys):
+        assert s3_client.get_object(Bucket=BUCKET, Key=key)['Body'].read() == path.read_bytes()
+    # The large file went up in parts
+    head = s3_client.head_object(Bucket=BUCKET, Key='experiments/features.csv')
+    assert head['ETag'].strip('"').endswith('-2')
+
+
+# Test 2: a failed upload is retried, and the error is raised once retries run out
+def test_upload_file_retries(s3_client, tmp_path, monkeypatch):
+    path = tmp_path / 'metrics.yaml'
+    path.write_text('auc: 0.9\n')
+    upload = s3_client.upload_file
+    failures = []
+
+    def flaky_upload(*args, **kwargs):
+        if len(failures) < 2:
+            failures.append(args)
+            raise ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Slow down'}}, 'PutObject')
+        return upload(*args, **kwargs)
+
+    monkeypatch.setattr(s3_client, 'upload_file', flaky_upload)
+    assert aws.upload_file(s3_client, path, BUCKET, 'metrics.yaml', backoff=0) == \
+        f's3://{BUCKET}/metrics.yaml'
+    assert len(failures) == 2
+
+    failures.clear()
+    with pytest.raises(ClientError):
+        aws.upload_file(s3_client, path, BUCKET, 'metrics.yaml', retries=1, backoff=0)
+
+
+# Test 3: sync transfers only new or changed content, copying content already in the bucket
+def test_sync_files_incremental(s3_client, tmp_path, monkeypatch):
+    run = tmp_path / 'run'
+    manifest = tmp_path / 'manifest.json'
+    make_artifacts(run)
+    transfers = []
+    for method in ('upload_file', 'copy'):
+        original = getattr(s3_client, method)
+        monkeypatch.setattr(s3_client, method, lambda *args, _f=original, _m=method, **kwargs:
+                            transfers.append(_m) or _f(*args, **kwargs))
+
+    (run / 'train.csv').write_bytes((run / 'features.csv').read_bytes())
+    uris = aws.sync_files(s3_client, run, BUCKET, manifest, prefix='experiments')
+    assert uris == [f's3://{BUCKET}/experiments/' + p.relative_to(run).as_posix()
+                    for p in sorted(run.rglob('*')) if p.is_file()]
+    # train.csv has the same content as features.csv, so it is copied server-side
+    assert sorted(transfers) == ['copy'] + ['upload_file'] * 21
+
+    transfers.clear()
+    aws.sync_files(s3_client, run, BUCKET, manifest, prefix='experiments')
+    assert transfers == []
+
+    transfers.clear()
+    (run / 'figures' / 'copy.png').write_bytes((run / 'features.csv').read_bytes())
+    (run / 'figures' / 'histogram_0.png').write_bytes(b'changed')
+    s3_client.put_object(Bucket=BUCKET, Key='experiments/figures/histogram_1.png', Body=b'other')
+    aws.sync_files(s3_client, run, BUCKET, manifest, prefix='experiments')
+    assert sorted(transfers) == ['copy', 'upload_file', 'upload_file']
+    for path in [run / 'figures' / name for name in ('copy.png', 'histogram_0.png', 'histogram_1.png')]:
+        key = 'experiments/' + path.relative_to(run).as_posix()
+        assert s3_client.get_object(Bucket=BUCKET, Key=key)['Body'].read() == path.read_bytes()
+
+
+# Test 4: a transferred object missing from the listing is recorded with its own ETag
+def test_sync_files_object_missing_from_listing(s3_client, tmp_path, monkeypatch):
+    run = tmp_path / 'run'
+    manifest = tmp_path / 'manifest.json'
+    make_artifacts(run)
+    listing = aws.list_objects
+    monkeypatch.setattr(aws, 'list_objects', lambda *args: {
+        key: etag for key, etag in listing(*args).items() if not key.endswith('features.csv')})
+
+    aws.sync_files(s3_client, run, BUCKET, manifest, prefix='experiments')
+    entry = aws.load_manifest(manifest)[f's3://{BUCKET}/experiments/features.csv']
+    assert entry['etag'] == s3_client.head_object(Bucket=BUCKET, Key='experiments/features.csv')['ETag']
+
+
+# Test 5: content is not copied from a key that the same sync overwrites with new content
+@pytest.mark.parametrize('changed, moved', [('a.txt', 'b.txt'), ('b.txt', 'a.txt')])
+def test_sync_files_source_changes(s3_client, tmp_path, changed, moved):
+    run = tmp_path / 'run'
+    manifest = tmp_path / 'manifest.json'
+    run.mkdir()
+    (run / changed).write_bytes(b'X')
+    aws.sync_files(s3_client, run, BUCKET, manifest, prefix='p')
+
+    # The moved file takes the old content of the changed one
+    (run / changed).write_bytes(b'Y')
+    (run / moved).write_bytes(b'X')
+    for _ in range(2):
+        aws.sync_files(s3_client, run, BUCKET, manifest, prefix='p', max_workers=1)
+        for name in (changed, moved):
+            assert s3_client.get_object(Bucket=BUCKET, Key=f'p/{name}')['Body'].read() == (run / name).read_bytes()
@@ -0,0 +1,33 @@
+from pathlib import Path
+
+import src.create_dataset as cd
+from benchmarks import bench_pipeline as bp
+from benchmarks.synthetic_clouds import COLUMNS, write_clouds
+
+
+# Test 1: synthetic files parse into the requested rows, split into two class blocks
+def test_write_clouds(tmp_path):
+    path = write_clouds(tmp_path / 'clouds.data', 1001, chunk_rows=100)
+    data = cd.create_dataset(path, {'load_data': {'names': COLUMNS}})
+    assert len(data) == 1001
+    assert data['class'].value_counts().to_dict() == {0.0: 500, 1.0: 501}
+    assert (data[COLUMNS] > 0).all().all()
+    assert (data['IR_min'] <= data['IR_mean']).all() and (data['IR_mean'] <= data['IR_max']).all()
+
+
+# Test 2: only increases beyond both the relative tolerance and the noise floor regress
+def test_regressions():
+    baseline = {'1000': {'train_model': {'seconds': 1.0, 'peak_mb': 100.0}}}
+    results = {'1000': {'train_model': {'seconds': 1.4, 'peak_mb': 200.0},
+                        'score_model': {'seconds': 9.0, 'peak_mb': 0.0}}}
+    found = bp.regressions(results, baseline, tolerance=0.5, min_seconds=0.05, min_mb=16)
+    assert found == ['train_model at 1000 rows: peak_mb 200.000 vs baseline 100.000']
+    assert bp.regressions(results, baseline, tolerance=0.2, min_seconds=0.5, min_mb=200) == []
+
+
+# Test 3: the benchmark configuration generates features instead of reading the store
+def test_load_config_disables_feature_store():
+    config = bp.load_config(Path(bp.__file__).resolve().parents[1] / 'config' / 'default-config.yaml', 'npy', 500)
+    assert config['run_config']['feature_store'] is None
+    assert config['run_config']['artifact_format'] == 'npy'
+    assert config['run_config']['chunk_rows'] == 500
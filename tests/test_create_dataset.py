@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+import src.create_dataset as cd
+
+COLUMNS = ['a', 'b', 'c']
+config = {'load_data': {'names': COLUMNS}}
+
+RAW = """;;;;;;;;;;;;;;;;
+; CLOUD DATABASE with 2 classes
+; 1 2 3
+;;;;;;;;;;;;;;;;
+
+1.0000  2.0000  3.0000
+4.0000  5.0000  6.0000
+
+; second class
+-1.5  2.5\t3.5
+7.0   8.0  9.0
+"""
+
+# Test 1: class blocks are found from the layout, not from fixed line numbers
+def test_create_dataset_blocks(tmp_path):
+    path = tmp_path / 'clouds.data'
+    path.write_text(RAW)
+    data = cd.create_dataset(path, config)
+    assert list(data.columns) == COLUMNS + ['class']
+    assert np.array_equal(data['class'], [0.0, 0.0, 1.0, 1.0])
+    assert np.allclose(data[COLUMNS].values, [[1, 2, 3], [4, 5, 6], [-1.5, 2.5, 3.5], [7, 8, 9]])
+    assert data['a'].dtype == np.float64
+
+# Test 2: a trailing line without a newline still belongs to the last block
+def test_create_dataset_no_trailing_newline(tmp_path):
+    path = tmp_path / 'clouds.data'
+    path.write_text(RAW.rstrip('\n'))
+    data = cd.create_dataset(path, config)
+    assert len(data) == 4
+
+# Test 3: lines with the wrong number of values are not treated as data
+def test_scan_layout_skips_malformed_lines():
+    buf = np.frombuffer(b'1 2 3\n1 2\n4 5 6\n', dtype=np.uint8)
+    starts, ends, block = cd.scan_layout(buf, 3)
+    assert starts.tolist() == [0, 10]
+    assert ends.tolist() == [5, 15]
+    assert block.tolist() == [0, 1]
+
+# Test 4: unhappy test where the file does not exist
+def test_create_dataset_missing_file(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        cd.create_dataset(tmp_path / 'missing.data', config)
+
+# Test 5: chunked parsing yields fixed-size chunks that add up to the whole dataset
+@pytest.mark.parametrize('chunk_rows', [1, 3, 100])
+def test_iter_dataset_matches_create_dataset(tmp_path, chunk_rows):
+    path = tmp_path / 'clouds.data'
+    path.write_text(RAW)
+    chunks = list(cd.iter_dataset(path, config, chunk_rows))
+    assert all(len(chunk) == chunk_rows for chunk in chunks[:-1])
+    data = pd.concat(chunks, ignore_index=True)
+    pd.testing.assert_frame_equal(data, cd.create_dataset(path, config))
+
+# Test 6: unhappy test where the file does not hold exactly two blocks of data lines
+@pytest.mark.parametrize('raw', [
+    '1 2 3\n4 5 6\n',
+    RAW + '\n; third class\n1 1 1\n',
+])
+def test_create_dataset_wrong_block_count(tmp_path, raw):
+    path = tmp_path / 'clouds.data'
+    path.write_text(raw)
+    with pytest.raises(ValueError, match='Expected 2 blocks'):
+        cd.create_dataset(path, config)
+    with pytest.raises(ValueError, match='Expected 2 blocks'):
+        list(cd.iter_dataset(path, config, 1))
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.evaluate_performance as ep
+
+
+@pytest.fixture
+def scored():
+    rng = np.random.default_rng(0)
+    target = rng.integers(0, 2, size=5000).astype(float)
+    # Forest-like scores: averages over 20 trees, noisily related to the class
+    proba = np.clip(np.round((target * 0.3 + rng.uniform(0, 0.7, size=5000)) * 20) / 20, 0, 1)
+    test_data = pd.DataFrame({'class': target})
+    scores = pd.DataFrame({'ypred_proba': proba, 'ypred_bin': (proba > 0.5) * 1.0})
+    return test_data, scores
+
+
+# Test 1: metrics accumulated chunk by chunk match the ones computed on all rows at once
+def test_accumulate_metrics(scored):
+    test_data, scores = scored
+    expected = ep.evaluate_performance(test_data, scores, {'target_name': 'class'})
+    chunks = ((test_data.iloc[i:i + 700], scores.iloc[i:i + 700]) for i in range(0, 5000, 700))
+    result = ep.accumulate_metrics(chunks, [0.0, 1.0], {'target_name': 'class', 'bins': 1000}).result()
+
+    assert result['auc'] == pytest.approx(expected['auc'])
+    assert result['confusion'] == expected['confusion']
+    assert result['accuracy'] == pytest.approx(expected['accuracy'])
+    report, expected_report = result['classification_report'], expected['classification_report']
+    assert report.pop('accuracy') == pytest.approx(expected_report.pop('accuracy'))
+    pd.testing.assert_frame_equal(pd.DataFrame(report), pd.DataFrame(expected_report))
+
+
+# Test 2: accumulators of separate shards merge into the accumulator of all rows
+def test_merge_accumulators(scored, tmp_path):
+    test_data, scores = scored
+    whole = ep.MetricsAccumulator([0.0, 1.0]).update(test_data['class'], scores)
+    first = ep.MetricsAccumulator([0.0, 1.0]).update(test_data['class'][:1234], scores[:1234])
+    second = ep.MetricsAccumulator([0.0, 1.0]).update(test_data['class'][1234:], scores[1234:])
+    merged = first.merge(ep.load_accumulator(second.save(tmp_path / 'shard.npz')))
+    assert merged.result() == whole.result()
+
+    with pytest.raises(ValueError, match='Unknown labels'):
+        whole.update(np.full(3, 2.0), scores[:3])
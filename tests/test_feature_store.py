@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LogisticRegression
+
+import src.feature_store as fs
+import src.score_model as sm
+import src.stages as st
+
+CONFIG = {
+    'create_dataset': {'load_data': {'header': None}},
+    'generate_features': {'log_transform': {'log_entropy': 'visible_entropy'}},
+}
+
+
+def make_features(rows=100):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'visible_entropy': rng.random(rows),
+        'log_entropy': rng.random(rows),
+        'class': np.arange(rows) % 2,
+    })
+
+
+# Test 1: stored features are keyed by data checksum and config, with range and row-id access
+def test_feature_store_round_trip(tmp_path):
+    store = fs.FeatureStore(tmp_path)
+    features = make_features()
+    assert store.get('abc', CONFIG) is None
+    chunks = (features.iloc[start:start + 30] for start in range(0, 100, 30))
+    stored = store.put('abc', CONFIG, chunks)
+
+    assert store.get('abc', CONFIG).path == stored.path
+    assert store.get('abd', CONFIG) is None
+    assert store.get('abc', {**CONFIG, 'generate_features': {}}) is None
+    assert store.latest(CONFIG).path == stored.path
+    assert stored.frame().equals(features)
+    window = stored.range(10, 20, ['log_entropy'])
+    assert list(window.index) == list(range(10, 20))
+    assert not window['log_entropy'].to_numpy().flags.writeable
+    np.testing.assert_array_equal(window['log_entropy'], features['log_entropy'][10:20])
+    taken = stored.take([5, 99, 0])
+    pd.testing.assert_frame_equal(taken, features.iloc[[5, 99, 0]], check_index_type=False)
+    with pytest.raises(IndexError):
+        stored.take([100])
+    with pytest.raises(ValueError, match='not numeric'):
+        store.put('abc', {}, features.assign(name='x'))
+
+
+# Test 2: batch scoring of stored rows matches scoring the same rows in memory
+def test_score_features(tmp_path):
+    features = make_features()
+    stored = fs.FeatureStore(tmp_path).put('abc', CONFIG, features)
+    columns = ['visible_entropy', 'log_entropy']
+    model = LogisticRegression().fit(features[columns], features['class'])
+    config = {'initial_features': columns, 'chunk_rows': 16}
+
+    scores = sm.score_features(stored, model, config)
+    expected = sm.predict_scores(model, features[columns])
+    pd.testing.assert_frame_equal(scores, expected)
+    picked = sm.score_features(stored, model, config, row_ids=[3, 50, 7])
+    assert list(picked.index) == [3, 50, 7]
+    np.testing.assert_allclose(picked['ypred_proba'], expected['ypred_proba'].iloc[[3, 50, 7]])
+
+
+# Test 3: changing the parsing config upstream of generate_features misses the store
+def test_stored_features_follow_upstream_config(tmp_path):
+    (tmp_path / 'clouds.data').write_text('1 2 3\n')
+    config = {**CONFIG, 'run_config': {'feature_store': str(tmp_path / 'store')}}
+    ctx = st.RunContext(tmp_path, config)
+    assert st.stored_features(ctx) is None
+    st.feature_store(ctx).put(st.raw_checksum(ctx), config, make_features())
+    assert len(st.stored_features(ctx)) == 100
+
+    changed = {**config, 'create_dataset': {'load_data': {'header': 0}}}
+    assert st.stored_features(st.RunContext(tmp_path, changed)) is None
+
+
+# Test 4: a failure while storing features leaves neither an entry nor its staging directory
+def test_feature_store_put_failure(tmp_path):
+    store = fs.FeatureStore(tmp_path)
+
+    def chunks():
+        yield make_features(10)
+        raise RuntimeError('chunk failed')
+
+    with pytest.raises(RuntimeError):
+        store.put('abc', CONFIG, chunks())
+    assert store.get('abc', CONFIG) is None
+    assert list((tmp_path / 'abc').iterdir()) == []
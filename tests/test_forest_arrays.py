@@ -0,0 +1,46 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+import src.forest_arrays as fa
+
+
+@pytest.fixture(scope='module')
+def forest_and_data():
+    rng = np.random.default_rng(0)
+    features = rng.normal(size=(2000, 4))
+    target = np.where(features[:, 0] + features[:, 1] ** 2 + rng.normal(size=2000) > 1, 1.0, 0.0)
+    model = RandomForestClassifier(n_estimators=25, max_depth=8, random_state=0)
+    return model.fit(features, target), rng.normal(size=(500, 4))
+
+
+# Test 1: the array evaluator agrees with predict_proba and predict, including after a save/load
+def test_array_forest_parity(forest_and_data, tmp_path):
+    model, features = forest_and_data
+    forest = fa.load_forest(fa.export_forest(model).save(tmp_path / 'forest.npz'))
+    np.testing.assert_array_equal(forest.predict_proba(features), model.predict_proba(features))
+    assert np.array_equal(forest.predict(features), model.predict(features))
+    assert np.array_equal(forest.predict_proba(features[:1]), forest.predict_proba(features)[:1])
+
+
+# Test 2: loading and evaluating an exported forest does not import scikit-learn
+def test_array_forest_without_sklearn(forest_and_data, tmp_path):
+    model, features = forest_and_data
+    fa.export_forest(model).save(tmp_path / 'forest.npz')
+    np.save(tmp_path / 'features.npy', features)
+    script = (
+        'import importlib.util, sys\n'
+        f'spec = importlib.util.spec_from_file_location("forest_arrays", {str(Path(fa.__file__))!r})\n'
+        'module = importlib.util.module_from_spec(spec)\n'
+        'spec.loader.exec_module(module)\n'
+        'import numpy as np\n'
+        f'forest = module.load_forest({str(tmp_path / "forest.npz")!r})\n'
+        f'np.save({str(tmp_path / "proba.npy")!r}, forest.predict_proba(np.load({str(tmp_path / "features.npy")!r})))\n'
+        'assert "sklearn" not in sys.modules\n'
+    )
+    subprocess.run([sys.executable, '-c', script], check=True)
+    np.testing.assert_array_equal(np.load(tmp_path / 'proba.npy'), model.predict_proba(features))
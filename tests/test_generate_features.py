@@ -210,3 +210,38 @@ def test_generate_features_missing_data():
         pass
     else:
         assert False
+
+# Test 11: generate_features returns a new DataFrame and leaves its input untouched
+def test_generate_features_does_not_mutate_input():
+    data = pd.DataFrame({
+        'visible_contrast': [5, 10, 15],
+        'visible_entropy': [1.2, 2.2, 3.2],
+        'IR_mean': [50, 100, 150],
+        'IR_max': [500, 1000, 1500],
+        'IR_min': [10, 20, 30]
+    })
+    original = data.copy()
+    features = gf.generate_features(data, config_features)
+    pd.testing.assert_frame_equal(data, original)
+    assert list(features.columns) == list(data.columns) + ['log_entropy', 'entropy_x_contrast', 'IR_norm_range']
+
+# Test 12: a compiled plan orders features built from other features after their inputs
+def test_compiled_plan_resolves_feature_dependencies():
+    plan = gf.compile_plan({
+        'multiply': {'log_x_contrast': {'col_a': 'log_entropy', 'col_b': 'visible_contrast'}},
+        'log_transform': {'log_entropy': 'visible_entropy'}
+    })
+    data = pd.DataFrame({'visible_contrast': [5.0, 10.0], 'visible_entropy': [1.2, 2.2]})
+    out = np.empty((2, 2), order='F')
+    result = plan.execute(plan.input_arrays(data), out=out)
+    assert result is out
+    assert np.allclose(out[:, plan.outputs.index('log_x_contrast')], np.log([1.2, 2.2]) * [5, 10])
+    assert gf.get_plan(config_features) is gf.get_plan(dict(config_features))
+
+# Test 13: unhappy test where a feature is defined in terms of itself through another feature
+def test_compiled_plan_rejects_cycles():
+    with pytest.raises(ValueError):
+        gf.compile_plan({'multiply': {
+            'a': {'col_a': 'b', 'col_b': 'x'},
+            'b': {'col_a': 'a', 'col_b': 'x'}
+        }})
@@ -0,0 +1,92 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import boto3
+import joblib
+import numpy as np
+import pytest
+from sklearn.linear_model import LogisticRegression
+
+import src.model_cache as mc
+
+moto = pytest.importorskip('moto')
+
+BUCKET = 'models'
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def put_model(s3_client, tmp_path, key, seed):
+    rng = np.random.default_rng(seed)
+    features = rng.normal(size=(100, 3))
+    model = LogisticRegression().fit(features, features[:, 0] > 0)
+    joblib.dump(model, tmp_path / 'upload.pkl')
+    s3_client.upload_file(str(tmp_path / 'upload.pkl'), BUCKET, key)
+    return model
+
+
+# Test 1: a model is downloaded once per ETag and loaded with memory-mapped arrays
+def test_model_cache_downloads_each_version_once(s3_client, tmp_path, monkeypatch):
+    downloads = []
+    download_file = s3_client.download_file
+    monkeypatch.setattr(s3_client, 'download_file',
+                        lambda *args, **kwargs: downloads.append(args[1]) or download_file(*args, **kwargs))
+    cache = mc.ModelCache(tmp_path / 'cache', s3_client)
+
+    first = put_model(s3_client, tmp_path, 'models/lr.pkl', seed=0)
+    loaded = cache.load(BUCKET, 'models/lr.pkl')
+    assert isinstance(loaded.coef_, np.memmap)
+    assert np.array_equal(loaded.coef_, first.coef_)
+    cache.load(BUCKET, 'models/lr.pkl')
+    assert downloads == ['models/lr.pkl']
+
+    second = put_model(s3_client, tmp_path, 'models/lr.pkl', seed=1)
+    assert np.array_equal(cache.load(BUCKET, 'models/lr.pkl').coef_, second.coef_)
+    assert downloads == ['models/lr.pkl', 'models/lr.pkl']
+
+
+# Test 2: when S3 cannot be reached, the latest cached version is used
+def test_model_cache_offline_fallback(s3_client, tmp_path, monkeypatch):
+    cache = mc.ModelCache(tmp_path / 'cache', s3_client)
+    model = put_model(s3_client, tmp_path, 'models/lr.pkl', seed=0)
+    cache.load(BUCKET, 'models/lr.pkl')
+
+    monkeypatch.setattr(cache, 'etag', lambda *args: None)
+    assert np.array_equal(cache.load(BUCKET, 'models/lr.pkl').coef_, model.coef_)
+    with pytest.raises(FileNotFoundError):
+        cache.load(BUCKET, 'models/missing.pkl')
+
+
+# Test 3: concurrent cold starts of the same version both get the complete entry
+def test_model_cache_concurrent_cold_start(s3_client, tmp_path, monkeypatch):
+    both_downloading = threading.Barrier(2, timeout=5)
+    download_file = s3_client.download_file
+    staging = []
+
+    def slow_download(*args, **kwargs):
+        staging.append(Path(args[2]).parent)
+        both_downloading.wait()
+        # Neither cold start removed the other's staging directory
+        assert all(path.is_dir() for path in staging)
+        download_file(*args, **kwargs)
+
+    monkeypatch.setattr(s3_client, 'download_file', slow_download)
+    model = put_model(s3_client, tmp_path, 'models/lr.pkl', seed=0)
+    caches = [mc.ModelCache(tmp_path / 'cache', s3_client) for _ in range(2)]
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        paths = list(pool.map(lambda cache: cache.path(BUCKET, 'models/lr.pkl'), caches))
+
+    assert len(set(staging)) == 2
+    assert paths[0] == paths[1] and paths[0].is_file()
+    assert np.array_equal(joblib.load(paths[0]).coef_, model.coef_)
+    assert [p.name for p in paths[0].parents[1].iterdir()] == [paths[0].parent.name]
@@ -0,0 +1,46 @@
+import importlib
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Modules that only the stages using them may import
+HEAVY_MODULES = ['boto3', 'joblib', 'matplotlib', 'requests', 'scipy', 'seaborn', 'sklearn']
+
+# Seconds the command line may take to import, well above its time without heavy modules
+IMPORT_BUDGET = 1.5
+
+IMPORT_CHECK = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'loaded': sorted(m for m in {heavy} if m in sys.modules)}}))
+'''
+
+
+def import_in_subprocess(module):
+    code = IMPORT_CHECK.format(module=module, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.splitlines()[-1])
+
+
+# Test 1: the package and the command line import without the heavy dependencies, within budget
+def test_import_is_lazy():
+    for module in ('src', 'pipeline'):
+        result = import_in_subprocess(module)
+        assert result['loaded'] == []
+        assert result['seconds'] < IMPORT_BUDGET
+
+
+# Test 2: without a subcommand the whole pipeline runs; stage subcommands take a run directory
+def test_parse_args(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    pipeline = importlib.import_module('pipeline')
+    args = pipeline.parse_args(['--config', 'custom.yaml', '--resume'])
+    assert (args.command, args.config, args.resume, args.no_cache) == ('run', 'custom.yaml', True, False)
+    args = pipeline.parse_args(['train', '--run-dir', 'artifacts/1', '--no-cache'])
+    assert (args.command, args.run_dir, args.no_cache) == ('train', Path('artifacts/1'), True)
+    assert set(pipeline.COMMANDS.values()) == {stage.name for stage in pipeline.st.STAGES}
@@ -0,0 +1,84 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+from sklearn.ensemble import RandomForestClassifier
+
+import src.prediction_service as ps
+
+FEATURES = ['log_entropy', 'IR_norm_range', 'entropy_x_contrast']
+
+
+@pytest.fixture(scope='module')
+def model_and_data():
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(rng.normal(size=(200, 3)), columns=FEATURES)
+    target = (data['log_entropy'] > 0).astype(float)
+    model = RandomForestClassifier(n_estimators=10, max_depth=5, random_state=0)
+    return model.fit(data, target), data
+
+
+# Test 1: concurrent requests are coalesced into batches no larger than the limit
+def test_micro_batcher_coalesces_requests():
+    release = threading.Event()
+
+    def predict(rows):
+        release.wait()
+        return {'double': rows['x'].to_numpy() * 2}
+
+    batcher = ps.MicroBatcher(predict, max_batch_size=8, max_wait_ms=50)
+    futures = [batcher.submit(pd.DataFrame({'x': [float(i)]})) for i in range(20)]
+    release.set()
+    assert [f.result(timeout=5)['double'][0] for f in futures] == [2.0 * i for i in range(20)]
+    batcher.close()
+    assert sum(batcher.batch_sizes) == 20
+    assert max(batcher.batch_sizes) <= 8 and len(batcher.batch_sizes) < 20
+
+
+# Test 2: the HTTP service gives the same answers as the local model, through RemoteModel
+def test_prediction_server_matches_model(model_and_data):
+    model, data = model_and_data
+    server = ps.PredictionServer(('127.0.0.1', 0), {'random_forest': model}, max_wait_ms=20)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+        remote = ps.RemoteModel(url, 'random_forest')
+
+        def predict_row(i):
+            return ps.RemoteModel(url, 'random_forest').predict_proba(data.iloc[[i]])[0]
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            proba = np.array(list(pool.map(predict_row, range(64))))
+        assert np.allclose(proba, model.predict_proba(data.iloc[:64]))
+        assert np.array_equal(remote.predict(data), model.predict(data))
+        assert list(remote.classes_) == list(model.classes_)
+        assert len(server.batchers['random_forest'].batch_sizes) < 65
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# Test 3: a request with missing or extra features is rejected without failing its batch
+def test_prediction_server_rejects_bad_columns(model_and_data):
+    model, data = model_and_data
+    server = ps.PredictionServer(('127.0.0.1', 0), {'random_forest': model}, max_wait_ms=200)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/predict/random_forest'
+        good = {'rows': data.iloc[:4].to_dict(orient='records')}
+        missing = {'rows': data.iloc[:4, :2].to_dict(orient='records')}
+        extra = {'rows': data.iloc[:4].assign(other=1.0).to_dict(orient='records')}
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            responses = list(pool.map(lambda body: requests.post(url, json=body, timeout=5),
+                                      [good, missing, extra]))
+        assert [response.status_code for response in responses] == [200, 400, 400]
+        assert 'entropy_x_contrast' in responses[1].json()['error']
+        assert 'other' in responses[2].json()['error']
+        assert np.allclose(responses[0].json()['proba'], model.predict_proba(data.iloc[:4]))
+        assert server.batchers['random_forest'].batch_sizes == [4]
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,71 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import src.profiling as prof
+import src.stages as st
+
+
+# Test 1: a measured block records its time, CPU time and memory growth, and its profile
+def test_measure(tmp_path):
+    with prof.measure(tmp_path / 'profile' / 'block.prof') as record:
+        block = np.ones((4000, 4000))
+    assert record['wall_seconds'] > 0 and record['cpu_seconds'] > 0
+    assert record['peak_rss_delta_mb'] >= block.nbytes / prof.MB * 0.9
+    assert (tmp_path / 'profile' / 'block.prof').is_file()
+    assert 'cumulative' in (tmp_path / 'profile' / 'block.txt').read_text()
+
+
+# Test 2: a profiled stage records its rows in and out and the bytes it wrote
+def test_run_profiled(tmp_path):
+    ctx = st.RunContext(tmp_path, {'run_config': {'artifact_format': 'csv'}})
+    pd.DataFrame({'visible_entropy': np.linspace(0.1, 1, 10)}).to_csv(ctx.path('clouds'), index=False)
+
+    def double(ctx):
+        pd.concat([ctx.frame('clouds')] * 2).to_csv(ctx.path('features'), index=False)
+
+    stage = st.Stage('double', double, inputs=('clouds',), outputs=('features',))
+    state = {}
+    record = st.run_profiled(stage, ctx, None, state)
+    assert record['status'] == 'ran'
+    assert record['rows_in'] == {'clouds': 10} and record['rows_out'] == {'features': 20}
+    assert record['bytes_written'] == ctx.path('features').stat().st_size
+
+    prof.save_profile({'double': record}, tmp_path / prof.PROFILE_FILE)
+    assert json.loads((tmp_path / prof.PROFILE_FILE).read_text()) == prof.load_profile(tmp_path / prof.PROFILE_FILE)
+    assert st.run_profiled(stage, ctx, None, state)['bytes_written'] == 0
+
+
+# Test 3: blocks measured at the same time are flagged, and thread CPU time is their own
+def test_measure_overlapped():
+    started, release = threading.Barrier(2), threading.Event()
+
+    def busy():
+        with prof.measure() as record:
+            started.wait()
+            end = time.perf_counter() + 0.2
+            while time.perf_counter() < end:
+                pass
+            release.wait()
+        return record
+
+    def idle():
+        with prof.measure() as record:
+            started.wait()
+            time.sleep(0.3)
+            release.set()
+        return record
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = pool.submit(busy), pool.submit(idle)
+        busy_record, idle_record = (future.result() for future in futures)
+    assert busy_record['overlapped'] and idle_record['overlapped']
+    assert busy_record['thread_cpu_seconds'] >= 0.1
+    assert idle_record['thread_cpu_seconds'] < 0.05 <= idle_record['cpu_seconds']
+    with prof.measure() as record:
+        pass
+    assert not record['overlapped']
@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+
+import src.scheduler as sch
+import src.stages as st
+
+
+def make_stages():
+    return [
+        st.Stage('load', None, outputs=('raw',)),
+        st.Stage('figures', None, inputs=('raw',), outputs=('figures',)),
+        st.Stage('train', None, inputs=('raw',), outputs=('model',)),
+        st.Stage('score', None, inputs=('raw', 'model'), outputs=('scores',)),
+    ]
+
+
+# Test 1: stages depend on the stages producing their inputs, and cycles are rejected
+def test_dependencies():
+    assert sch.dependencies(make_stages()) == {
+        'load': set(), 'figures': {'load'}, 'train': {'load'}, 'score': {'load', 'train'}}
+    cycle = [st.Stage('a', None, inputs=('y',), outputs=('x',)), st.Stage('b', None, inputs=('x',), outputs=('y',))]
+    with pytest.raises(ValueError, match='depend on each other'):
+        sch.dependencies(cycle)
+
+
+# Test 2: independent stages overlap up to the worker limit, after their dependencies
+def test_run_stages_concurrently():
+    lock, active, events = threading.Lock(), [0], []
+
+    def run(stage):
+        with lock:
+            active[0] += 1
+            events.append(('start', stage.name, active[0]))
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+            events.append(('end', stage.name, active[0]))
+        return stage.name.upper()
+
+    done = []
+    results = sch.run_stages(make_stages(), run, 2, lambda stage, result, remaining: done.append(
+        (stage.name, result, sorted(s.name for s in remaining))))
+    assert results == {'load': 'LOAD', 'figures': 'FIGURES', 'train': 'TRAIN', 'score': 'SCORE'}
+    assert max(count for kind, _, count in events if kind == 'start') == 2
+    order = [name for kind, name, _ in events if kind == 'start']
+    assert order.index('score') > order.index('train') > order.index('load')
+    assert done[0] == ('load', 'LOAD', ['figures', 'score', 'train'])
+
+    events.clear()
+    sch.run_stages(make_stages(), run, 1)
+    assert [name for kind, name, _ in events if kind == 'start'] == ['load', 'figures', 'train', 'score']
+    assert max(count for kind, _, count in events if kind == 'start') == 1
+
+
+# Test 3: after a failure, stages depending on it never start and the error is raised
+def test_run_stages_failure():
+    started = []
+
+    def run(stage):
+        started.append(stage.name)
+        if stage.name == 'train':
+            raise RuntimeError('training failed')
+
+    with pytest.raises(RuntimeError, match='training failed'):
+        sch.run_stages(make_stages(), run, 2)
+    assert 'score' not in started
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+import src.score_model as sm
+
+FEATURES = ['log_entropy', 'IR_norm_range', 'entropy_x_contrast']
+
+
+@pytest.fixture(scope='module')
+def model_and_data():
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(rng.normal(size=(500, 3)), columns=FEATURES)
+    data['class'] = (data['log_entropy'] + rng.normal(scale=0.5, size=500) > 0).astype(float)
+    model = RandomForestClassifier(n_estimators=10, max_depth=5, random_state=0)
+    model.fit(data[FEATURES], data['class'])
+    return model, data
+
+
+# Test 1: one traversal gives the same probabilities and labels as predict_proba and predict
+def test_score_model_matches_predict(model_and_data):
+    model, data = model_and_data
+    scores = sm.score_model(data, model, {'initial_features': FEATURES, 'threshold': 0.5})
+    assert np.array_equal(scores['ypred_proba'], model.predict_proba(data[FEATURES])[:, 1])
+    assert np.array_equal(scores['ypred_bin'], model.predict(data[FEATURES]))
+
+
+# Test 2: chunked scoring, in process or in workers, matches scoring the whole frame
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_score_model_chunked(model_and_data, n_jobs):
+    model, data = model_and_data
+    config = {'initial_features': FEATURES}
+    whole = sm.score_model(data, model, config)
+    chunked = sm.score_model(data, model, dict(config, chunk_rows=64, n_jobs=n_jobs))
+    pd.testing.assert_frame_equal(chunked, whole)
+
+
+# Test 3: the threshold sets which probabilities are labelled as the second class
+def test_score_model_threshold(model_and_data):
+    model, data = model_and_data
+    scores = sm.score_model(data, model, {'initial_features': FEATURES, 'threshold': 0.8})
+    assert np.array_equal(scores['ypred_bin'], (scores['ypred_proba'] > 0.8).astype(float))
@@ -0,0 +1,57 @@
+import src.stage_cache as sc
+import src.stages as st
+
+calls = []
+
+def write_raw(ctx):
+    calls.append('raw')
+    ctx.path('raw.txt').write_text(str(ctx.config['raw']['value']))
+
+def write_double(ctx):
+    calls.append('double')
+    value = int(ctx.path('raw.txt').read_text())
+    ctx.path('double.txt').write_text(str(value * ctx.config['double']['factor']))
+
+STAGES = [
+    st.Stage('raw', write_raw, outputs=('raw.txt',), config_keys=('raw',)),
+    st.Stage('double', write_double, inputs=('raw.txt',), outputs=('double.txt',),
+             config_keys=('double',)),
+]
+
+def run(run_dir, config, cache):
+    run_dir.mkdir(exist_ok=True)
+    ctx = st.RunContext(run_dir, config)
+    state = st.load_state(run_dir)
+    return [st.run_stage(stage, ctx, cache, state) for stage in STAGES]
+
+# Test 1: unchanged stages are served from the cache; only changed config sections re-run
+def test_stage_cache_reuses_unchanged_stages(tmp_path):
+    calls.clear()
+    cache = sc.StageCache(tmp_path / 'cache')
+    config = {'raw': {'value': 2}, 'double': {'factor': 2}}
+    assert run(tmp_path / 'run1', config, cache) == ['ran', 'ran']
+    assert run(tmp_path / 'run2', config, cache) == ['cached', 'cached']
+    assert (tmp_path / 'run2' / 'double.txt').read_text() == '4'
+
+    config['double']['factor'] = 3
+    assert run(tmp_path / 'run3', config, cache) == ['cached', 'ran']
+    assert (tmp_path / 'run3' / 'double.txt').read_text() == '6'
+    assert calls == ['raw', 'double', 'double']
+
+# Test 2: a resumed run skips the stages recorded as complete in its directory
+def test_resume_skips_completed_stages(tmp_path):
+    calls.clear()
+    config = {'raw': {'value': 5}, 'double': {'factor': 2}}
+    assert run(tmp_path / 'run', config, None) == ['ran', 'ran']
+    (tmp_path / 'run' / 'double.txt').unlink()
+    assert run(tmp_path / 'run', config, None) == ['resumed', 'ran']
+    assert calls == ['raw', 'double', 'double']
+
+# Test 3: changing an input artifact changes the key of the stages that consume it
+def test_digest_path_tracks_contents(tmp_path):
+    path = tmp_path / 'figures'
+    path.mkdir()
+    (path / 'a.png').write_bytes(b'a')
+    before = sc.digest_path(path)
+    (path / 'a.png').write_bytes(b'b')
+    assert sc.digest_path(path) != before
@@ -0,0 +1,82 @@
+import copy
+from pathlib import Path
+
+import pandas as pd
+import pytest
+import yaml
+
+import src.stages as st
+import src.sweep as sw
+
+CONFIG_PATH = Path(__file__).resolve().parents[1] / 'config' / 'default-config.yaml'
+
+
+def load_config():
+    with open(CONFIG_PATH, 'r') as f:
+        return yaml.safe_load(f)
+
+
+def write_features(ctx):
+    ctx.path('features').write_text('a\n1\n')
+
+
+# Test 1: configs differing only in train_model share every stage upstream of training
+def test_plan_sweep_shares_common_stages(tmp_path):
+    configs = [load_config() for _ in range(3)]
+    configs[2]['train_model'] = copy.deepcopy(configs[2]['train_model'])
+    configs[2]['train_model']['random_state'] = 7
+    contexts = [st.RunContext(tmp_path / str(i), config) for i, config in enumerate(configs)]
+    nodes = sw.plan_sweep(contexts)
+
+    shared = [node for node in nodes if node.shared]
+    assert [node.stages[0] for node in shared] == [
+        'acquire', 'create_dataset', 'generate_features', 'analysis', 'train_model',
+        'score_model', 'evaluate_performance']
+    assert [node.runs for node in shared] == [(0, 1, 2)] * 4 + [(0, 1)] * 3
+    own = [node for node in nodes if not node.shared]
+    assert [(node.runs, node.stages) for node in own] == [
+        ((2,), ('train_model', 'score_model', 'evaluate_performance'))]
+    assert set(own[0].needs) == {node.name for node in shared[:4]}
+    assert shared[4].needs == (shared[2].name,)
+
+
+# Test 2: an adopted stage is hard-linked, shares the in-memory result and is recorded complete
+def test_adopt_stage(tmp_path):
+    stage = st.Stage('features', write_features, outputs=('features',), config_keys=('generate_features',))
+    config = {'generate_features': {'x': 1}, 'run_config': {'artifact_format': 'csv'}}
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    source = st.RunContext(tmp_path / 'a', config)
+    ctx = st.RunContext(tmp_path / 'b', config)
+    source_state = {}
+    assert st.run_stage(stage, source, None, source_state) == 'ran'
+    features = pd.DataFrame({'a': [1]})
+    source.keep('features', features)
+
+    state = {}
+    st.adopt_stage(stage, source, ctx, state)
+    assert ctx.path('features').samefile(source.path('features'))
+    assert ctx.frame('features') is features
+    assert state == source_state == st.load_state(tmp_path / 'b')
+
+
+# Test 3: each run of a sweep uploads below its own prefix and syncs through its own manifest
+def test_run_config_separates_uploads(tmp_path):
+    config = {'aws': {'prefix': 'experiments/', 'sync': True}, 'train_model': {}}
+    first = sw.run_config(config, tmp_path / 'sweep-1', 'rf')
+    second = sw.run_config(config, tmp_path / 'sweep-1', 'lr')
+    assert first['aws']['prefix'] == 'experiments/sweep-1/rf'
+    assert Path(first['aws']['manifest']) == tmp_path / 'sweep-1' / '.s3-manifest-rf.json'
+    assert first['aws']['manifest'] != second['aws']['manifest']
+    assert config['aws'] == {'prefix': 'experiments/', 'sync': True}
+    custom = sw.run_config({'aws': {'manifest': str(tmp_path / 'm.json')}}, tmp_path / 'sweep-1', 'rf')
+    assert custom['aws']['prefix'] == 'sweep-1/rf'
+    assert Path(custom['aws']['manifest']) == tmp_path / 'm-rf.json'
+
+
+# Test 4: worker processes leave uploads to the run's own sink in the sweep process
+def test_run_own_stages_does_not_upload(tmp_path, monkeypatch):
+    import src.aws_utils as aws
+    monkeypatch.setattr(aws, 'artifact_uploader', lambda *args: pytest.fail('the worker opened an uploader'))
+    config = {'aws': {'upload': True, 'bucket_name': 'bucket'}, 'run_config': {}}
+    assert sw.run_own_stages(tmp_path, config, (), None) == {}
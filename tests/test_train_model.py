@@ -0,0 +1,137 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+import src.stages as st
+import src.train_model as tm
+
+FEATURES = ['log_entropy', 'IR_norm_range', 'entropy_x_contrast']
+
+
+@pytest.fixture
+def config():
+    return {
+        'initial_features': FEATURES, 'target_name': 'class', 'test_size': 0.4,
+        'train_test_split': {'random_state': 42}, 'n_estimators': 27, 'max_depth': 10,
+        'search': {
+            'enabled': True, 'resource': 'n_estimators', 'factor': 3, 'random_state': 0,
+            'n_jobs': 2, 'param_grid': {'max_depth': [1, 4, None], 'min_samples_leaf': [1, 5, 20]},
+        },
+    }
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(rng.normal(size=(600, 3)), columns=FEATURES)
+    data['class'] = (data['log_entropy'] * data['IR_norm_range'] + rng.normal(scale=0.3, size=600) > 0) * 1.0
+    return data
+
+
+# Test 1: successive halving keeps a third of the candidates per rung with three times the trees
+def test_train_model_search(data, config):
+    models, train, test, results = tm.train_model(data, config)
+    model = models['random_forest']
+    assert set(results['model']) == {'random_forest'}
+    per_rung = results.groupby('rung').agg(candidates=('candidate', 'size'), trees=('n_estimators', 'first'))
+    assert per_rung['candidates'].tolist() == [9, 3, 1]
+    assert per_rung['trees'].tolist() == [3, 9, 27]
+
+    final = results[results['rung'] == 2].iloc[0]
+    assert {k: model.get_params()[k] for k in json.loads(final['params'])} == json.loads(final['params'])
+    assert len(model.estimators_) == 27 and not model.warm_start
+    assert len(train) + len(test) == len(data)
+
+
+# Test 2: moving to the next rung grows new trees and keeps the ones already fitted
+def test_fit_and_score_warm_starts(data):
+    model = RandomForestClassifier(n_estimators=3, warm_start=True, random_state=0)
+    args = (data[FEATURES], data['class'], data[FEATURES], data['class'], 'roc_auc')
+    tm._fit_and_score(model, 'n_estimators', 3, *args)
+    first_trees = list(model.estimators_)
+    tm._fit_and_score(model, 'n_estimators', 9, *args)
+    assert len(model.estimators_) == 9 and model.estimators_[:3] == first_trees
+
+
+# Test 3: without a search, the configured forest is trained and the results are empty
+def test_train_model_without_search(data, config):
+    config['search']['enabled'] = False
+    models, _, _, results = tm.train_model(data, config)
+    assert models['random_forest'].n_estimators == 27 and models['random_forest'].max_depth == 10
+    assert results.empty and list(results.columns) == tm.SEARCH_COLUMNS
+
+
+# Test 4: several models are trained concurrently from the shared training matrix
+def test_train_models_in_processes(data, config):
+    config['search']['enabled'] = False
+    config['models'] = [
+        {'name': 'random_forest', 'model': 'RandomForestClassifier', 'params': {'random_state': 0}},
+        {'name': 'logistic_regression', 'model': 'LogisticRegression'},
+    ]
+    specs = tm.model_specs(config)
+    assert specs[0]['params'] == {'n_estimators': 27, 'max_depth': 10, 'n_jobs': None, 'random_state': 0}
+
+    features, target = data[FEATURES], data['class']
+    models, results = tm.train_models(features, target, specs, n_workers=2)
+    assert list(models) == ['random_forest', 'logistic_regression'] and results.empty
+    for spec in specs:
+        expected, _ = tm.fit_model(spec, features, target)
+        assert np.array_equal(models[spec['name']].predict_proba(features), expected.predict_proba(features))
+        assert list(models[spec['name']].feature_names_in_) == FEATURES
+
+
+# Test 5: an update adds trees to a forest, keeps the old ones and leaves the base model intact
+def test_retrain_model(data, config):
+    config['search']['enabled'] = False
+    config['models'] = [
+        {'name': 'random_forest', 'model': 'RandomForestClassifier', 'params': {'random_state': 0}},
+        {'name': 'sgd', 'model': 'SGDClassifier', 'params': {'loss': 'log_loss', 'random_state': 0}},
+        {'name': 'logistic_regression', 'model': 'LogisticRegression'},
+    ]
+    config['incremental'] = {'n_estimators': 5}
+    base, _, _, _ = tm.train_model(data.iloc[:300], config)
+    base_thresholds = [tree.tree_.threshold for tree in base['random_forest'].estimators_]
+    base_coef = base['sgd'].coef_.copy()
+
+    models, train, test, updates = tm.retrain_model(data.iloc[300:], base, config)
+    assert len(train) + len(test) == 300
+    forest = models['random_forest']
+    assert len(forest.estimators_) == 32
+    assert all(np.array_equal(tree.tree_.threshold, thresholds)
+               for tree, thresholds in zip(forest.estimators_, base_thresholds))
+    assert len(base['random_forest'].estimators_) == 27
+    assert not np.array_equal(models['sgd'].coef_, base_coef)
+    assert np.array_equal(base['sgd'].coef_, base_coef)
+    for update in updates.values():
+        assert update['rows'] == len(train)
+        assert 0 <= update['before']['auc'] <= 1 and 0 <= update['after']['auc'] <= 1
+
+    with pytest.raises(ValueError, match='every class'):
+        tm.update_model(forest, train[FEATURES], train['class'] * 0, config['incremental'])
+
+
+# Test 6: incremental training updates the latest earlier run that completed training
+def test_base_models_follow_completed_runs(tmp_path):
+    config = {'train_model': {'incremental': {'enabled': True}}}
+
+    def make_run(path, trained=True):
+        (path / 'models').mkdir(parents=True)
+        st.save_state(path, {'train_model': {'key': 'k', 'digests': {}}} if trained else {})
+        return path
+
+    base = make_run(tmp_path / '100')
+    make_run(tmp_path / '200', trained=False)
+    make_run(tmp_path / '400')
+    assert st.base_models(st.RunContext(make_run(tmp_path / '300', trained=False), config)) == {
+        'base_models': base / 'models'}
+
+    base = make_run(tmp_path / 'sweep-100' / 'rf')
+    make_run(tmp_path / 'sweep-100' / 'lr')
+    make_run(tmp_path / 'sweep-300' / 'lr')
+    ctx = st.RunContext(make_run(tmp_path / 'sweep-300' / 'rf', trained=False), config)
+    assert st.base_models(ctx) == {'base_models': base / 'models'}
+    with pytest.raises(FileNotFoundError):
+        st.base_models(st.RunContext(make_run(tmp_path / 'sweep-300' / 'svm', trained=False), config))